@@ -0,0 +1,248 @@
+#JSON API for the booking kiosk and the partners, under /api/v1
+
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, g, request, session
+
+from archive import with_history
+from availability import book_reservation, booked_parameters, free_condition
+from fulltext import search_people
+from help import row_exists
+from pagination import Computed, number, paginate
+from search import FACETS
+from versions import snapshot
+
+PREFIX = "/api/v1"
+
+
+def api_login_required(f):
+    """Like login_required, but answers 401 instead of redirecting to the login form"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("user_id") is None:
+            return {"error": "Log in first"}, 401
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not g.is_admin:
+            return {"error": "Only the admins can see this"}, 403
+        return f(*args, **kwargs)
+
+    return api_login_required(decorated_function)
+
+
+class Resource:
+    """
+    A list the API can page through.
+
+    fields maps every field to its SQL expression, source is the FROM part of the query
+    and tables are the tables whose counters tell if the list changed.
+    """
+
+    def __init__(self, fields, source, tables, key="id", catalog=False):
+        self.fields = fields
+        self.source = source
+        self.tables = tables
+        self.key = key
+        #Rows with the names of the engines, colors and car types also change with the catalog
+        self.catalog = catalog
+
+    def select(self, names):
+        return "SELECT " + ", ".join(f"{self.fields[name]} AS {name}" for name in names) + " FROM " + self.source
+
+
+class Api:
+    """
+    The JSON routes, next to the HTML ones.
+
+    Every list takes the same sort, order, filter, value, size, after and before arguments
+    as the admin tables, plus fields to pick the fields of every row. The lists have an
+    ETag made from the change counters of their tables, so a client that sends it back in
+    If-None-Match gets a 304 after one lookup of the counters, without running the query.
+    """
+
+    def __init__(self, app, db, catalog):
+        self.db = db
+        self.catalog = catalog
+        self.page_size = app.config["PAGE_SIZE"]
+
+        reservation_days = db.days_between("r.start_date", "r.end_date")
+        contract_days = db.days_between("start_date", "end_date")
+
+        self.vehicles = Resource({
+            "id": "v.id",
+            "make": "v.make",
+            "model": "v.model",
+            "engine_type_id": "v.engine_type_id",
+            "engine_type": "e.engine_type",
+            "color_id": "v.color_id",
+            "color": "c.color_name",
+            "car_type_id": "v.car_type_id",
+            "car_type": "ct.car_type",
+            "year": "v.year",
+            "price_per_day": "v.price_per_day",
+        }, "vehicles v JOIN engine e ON e.id = v.engine_type_id JOIN color c ON c.id = v.color_id JOIN car_type ct ON ct.id = v.car_type_id",
+            ["vehicles"], key="v.id", catalog=True)
+        #Being free in a period depends on the bookings and the fleet alerts too
+        self.free_vehicles = Resource(self.vehicles.fields, self.vehicles.source, ["vehicles", "reservations", "contracts", "fleet_alerts"], key="v.id", catalog=True)
+
+        self.cars = Resource({column: column for column in ["id", "make", "model", "engine_type_id", "color_id", "car_type_id", "year", "insurance_expiration_date", "maintenance_need_date", "price_per_day", "accidents"]},
+                             "vehicles", ["vehicles"])
+
+        reservation_fields = {column: "r." + column for column in ["id", "user_id", "first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date", "reservation_made_date"]}
+        reservation_fields.update({"days": Computed(reservation_days, int), "total_price": Computed(f"{reservation_days} * v.price_per_day", number)})
+        #The total price follows the price of the vehicle, so a change to the vehicles changes the list too
+        self.reservations = Resource(reservation_fields, "reservations r JOIN vehicles v ON r.vehicle_id = v.id", ["reservations", "vehicles"], key="r.id")
+        #With history=1 the archived ones too, they only change when the live tables move rows there
+        self.reservation_history = Resource(reservation_fields, f"{with_history('reservations')} r JOIN vehicles v ON r.vehicle_id = v.id", ["reservations", "vehicles"], key="r.id")
+
+        contract_fields = {column: column for column in ["id", "contract_number", "first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date", "contract_made_date", "price_per_day"]}
+        contract_fields.update({"days": Computed(contract_days, int), "total_price": Computed(f"{contract_days} * price_per_day", number)})
+        self.contracts = Resource(contract_fields, "contracts", ["contracts"])
+        self.contract_history = Resource(contract_fields, f"{with_history('contracts')} k", ["contracts"])
+
+        api = Blueprint("api", __name__, url_prefix=PREFIX)
+        api.add_url_rule("/vehicles", "vehicles", api_login_required(self.list_vehicles))
+        api.add_url_rule("/cars", "cars", admin_required(self.list_cars))
+        api.add_url_rule("/reservations", "reservations", api_login_required(self.list_reservations))
+        api.add_url_rule("/reservations", "make_reservation", api_login_required(self.make_reservation), methods=["POST"])
+        api.add_url_rule("/contracts", "contracts", admin_required(self.list_contracts))
+        api.add_url_rule("/search", "search", admin_required(self.search))
+        app.register_blueprint(api)
+
+    def etag(self, resource, scope):
+        """Tag of a list from the counters of its tables, the user it is for and the URL arguments"""
+        versions = snapshot(self.db, resource.tables)
+        if resource.catalog:
+            versions += (self.catalog.version,)
+        key = f"{request.endpoint}|{scope}|{versions}|{sorted(request.args.items(multi=True))}"
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def fields(self, resource):
+        """The fields asked in ?fields=, all of them by default, or None if one is unknown"""
+        names = [name.strip() for name in request.args.get("fields", "").split(",") if name.strip()]
+        if not names:
+            return list(resource.fields)
+        if any(name not in resource.fields for name in names):
+            return None
+        return names
+
+    def listing(self, resource, scope, conditions=(), parameters=()):
+        """One page of a resource as JSON, or a 304 if the client has the current one"""
+        names = self.fields(resource)
+        if names is None:
+            return {"error": "Unknown field, the fields are " + ", ".join(resource.fields)}, 400
+
+        tag = self.etag(resource, scope)
+        #Weak comparison, the tag is made weak when the response is compressed
+        if request.if_none_match.contains_weak(tag):
+            return "", 304, {"ETag": f'"{tag}"', "Cache-Control": "private, no-cache"}
+
+        #The cursors need the ID and the sort field even if they weren't asked for
+        sort = request.args.get("sort", "id")
+        selected = list(dict.fromkeys(["id"] + ([sort] if sort in resource.fields else []) + names))
+        page = paginate(self.db, resource.select(selected), resource.fields, self.page_size, key=resource.key, conditions=conditions, parameters=parameters)
+
+        data = [{name: row[name] for name in names} for row in page.rows]
+        return {"data": data, "next": page.next_link(), "prev": page.prev_link()}, 200, {"ETag": f'"{tag}"', "Cache-Control": "private, no-cache"}
+
+    def list_vehicles(self):
+        #The same filters as the reservations page, ?engine=1,2&start_date=2025-07-01&end_date=2025-07-05
+        conditions = []
+        parameters = []
+        for facet, column in FACETS.items():
+            values = [value for value in request.args.get(facet, "").split(",") if value]
+            if not all(value.isdigit() for value in values):
+                return {"error": "Select valid options"}, 400
+            if values:
+                conditions.append(f"v.{column} IN ({', '.join(['?'] * len(values))})")
+                parameters.extend(int(value) for value in values)
+
+        start_date = request.args.get("start_date")
+        end_date = request.args.get("end_date")
+        if start_date or end_date:
+            error, start_date, end_date = check_period(start_date, end_date)
+            if error:
+                return {"error": error}, 400
+            conditions.append(free_condition())
+            parameters.extend(booked_parameters(start_date, end_date))
+            return self.listing(self.free_vehicles, "all", conditions, parameters)
+
+        return self.listing(self.vehicles, "all", conditions, parameters)
+
+    def list_cars(self):
+        return self.listing(self.cars, "all")
+
+    def list_reservations(self):
+        #The admins see every reservation, the customers only their own
+        resource = self.reservation_history if request.args.get("history") == "1" else self.reservations
+        if g.is_admin:
+            return self.listing(resource, "all")
+        return self.listing(resource, session["user_id"], ["r.user_id = ?"], [session["user_id"]])
+
+    def list_contracts(self):
+        return self.listing(self.contract_history if request.args.get("history") == "1" else self.contracts, "all")
+
+    def search(self):
+        #?q=ana pop finds the people whose names, phone numbers, contract numbers or emails start with the words
+        try:
+            limit = min(max(int(request.args.get("limit", self.page_size)), 1), 200)
+        except ValueError:
+            return {"error": "Enter a number for the limit"}, 400
+        return {"data": search_people(self.db, request.args.get("q", ""), limit)}
+
+    def make_reservation(self):
+        data = request.get_json(silent=True) or request.form
+        #The form is a MultiDict, which is a dict too
+        if not isinstance(data, dict):
+            return {"error": "Send a JSON object or a form"}, 400
+
+        for field in ["first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date"]:
+            if not data.get(field):
+                return {"error": f"Enter a {field.replace('_', ' ')}"}, 400
+
+        try:
+            vehicle_id = int(data["vehicle_id"])
+        except (TypeError, ValueError):
+            vehicle_id = 0
+        if vehicle_id <= 0:
+            return {"error": "Enter a positive vehicle ID"}, 400
+
+        if not row_exists(self.db, "vehicles", vehicle_id):
+            return {"error": "Invalid vehicle id"}, 404
+
+        error, start_date, end_date = check_period(data["start_date"], data["end_date"], future=True)
+        if error:
+            return {"error": error}, 400
+
+        reservation = book_reservation(self.db, session["user_id"], data["first_name"], data["last_name"], data["phone_number"],
+                                       vehicle_id, start_date, end_date, datetime.now())
+        if not reservation:
+            return {"error": "The vehicle is already booked in that period"}, 409
+
+        return {"id": reservation}, 201, {"Location": f"{PREFIX}/reservations?filter=id&value={reservation}"}
+
+
+def check_period(start_date, end_date, future=False):
+    """Error message for a wrong rental period or None, and the dates as YYYY-MM-DD"""
+    if not start_date or not end_date:
+        return "Enter both a start date and an end date", None, None
+    try:
+        check_start_date = datetime.strptime(start_date, "%Y-%m-%d")
+        check_end_date = datetime.strptime(end_date, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return "Enter the dates as YYYY-MM-DD", None, None
+
+    if future and check_start_date < datetime.now():
+        return "The start date can't be in the past", None, None
+    if check_end_date <= check_start_date:
+        return "The end date can't be before or the same as the start", None, None
+    return None, check_start_date.date().isoformat(), check_end_date.date().isoformat()
@@ -1,69 +1,313 @@
+import hmac
+import inspect
+import os
 from datetime import datetime
-from cs50 import SQL
-from flask import Flask, redirect, render_template, request, session, g
-from flask_session import Session
-from werkzeug.security import check_password_hash, generate_password_hash
+from functools import wraps
+
+import click
+from flask import Blueprint, Flask, Response, current_app, redirect, render_template, request, session, g, stream_with_context
+from werkzeug.local import LocalProxy
+
+from api import Api
+from archive import ARCHIVE_AFTER_DAYS, ARCHIVES, archive_finished, with_history
+from assets import Assets
+from database import connect
+from fulltext import search_people
+from fleet import ALERT_DAYS, scan_fleet, fleet_summary
+from help import login_required, row_exists, IdentityCache, CatalogCache, RenderCache
+from jobs import Scheduler
+from metrics import Metrics
+from pages import Query, Render, run_steps, stream_page
+from pagination import Computed, PageQuery, number, paginate
+from passwords import PasswordHasher
+from reports import DIMENSIONS, delete_booking, delete_vehicle, rebuild as rebuild_reports, reprice_vehicle, usage_report
+from sessions import configure_sessions
+from streaming import Compression
+from migrations import migrate
+from versions import VERSION, bump, current, version_of
+from availability import book_reservation, book_contract
+from search import FACETS, empty_filters, facet_counts, search_queries
+from server import HealthCheck, start_background
+from transfer import TABLES as TRANSFER_TABLES, FORMATS, Importer, export_rows, format_of, read_rows
+
+#The routes and the hooks, create_app() registers them on the app
+views = Blueprint("views", __name__, cli_group=None)
+
+
+def service(name):
+    """A part of the current app, made by create_app()"""
+    return LocalProxy(lambda: current_app.extensions["luxent"][name])
+
+
+#The routes reach the parts of the app through these names
+db = service("db")
+assets = service("assets")
+metrics = service("metrics")
+hasher = service("hasher")
+catalog = service("catalog")
+scheduler = service("scheduler")
+identity_cache = service("identity_cache")
+render_cache = service("render_cache")
+fields = service("fields")
+
+
+def create_app(config=None):
+    """
+    Make the app with its database, caches and background jobs.
+
+    config overrides the settings read from the environment. With PREFORK the background
+    threads aren't started here, server.py starts them in every worker after the fork.
+    """
+    app = Flask(__name__)
+
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND", "sqlite")
+    app.config["PAGE_SIZE"] = 50
+    app.config["RENDER_CACHE_BYTES"] = 16 * 1024 * 1024
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+    #Save the stacks of the requests slower than this, off unless it is set
+    app.config["PROFILE_SLOW_MS"] = int(os.environ.get("PROFILE_SLOW_MS", 0))
+    app.config["PROFILE_FOLDER"] = os.environ.get("PROFILE_FOLDER", "profiles")
+    #Background jobs, JOBS=0 turns them off in this process, another one can run them
+    app.config["JOBS_ENABLED"] = os.environ.get("JOBS", "1") != "0"
+    app.config["FLEET_SCAN_INTERVAL"] = int(os.environ.get("FLEET_SCAN_INTERVAL", 3600))
+    app.config["FLEET_ALERT_DAYS"] = int(os.environ.get("FLEET_ALERT_DAYS", ALERT_DAYS))
+    #The bookings that ended more than ARCHIVE_AFTER_DAYS ago are moved to the archive tables
+    app.config["ARCHIVE_INTERVAL"] = int(os.environ.get("ARCHIVE_INTERVAL", 3600))
+    app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS", ARCHIVE_AFTER_DAYS))
+    #SQLite by default, DATABASE_URL can point every app node to the same PostgreSQL database
+    app.config["DATABASE_URL"] = os.environ.get("DATABASE_URL", "sqlite:///luxent.db")
+    #Set by gunicorn.conf.py, the workers are forked from the process that made the app
+    app.config["PREFORK"] = False
+    app.config.update(config or {})
+    configure_sessions(app)
+
+    #Fingerprinted static files, built with "flask --app app build-assets"
+    assets = Assets(app)
+
+    #gzip or brotli for the pages, the JSON and the exports. Made before the other after_request
+    #functions, so it runs after them once they changed the response
+    Compression(app)
+
+    #Timings of the routes, the queries and the templates
+    metrics = Metrics(app)
+
+    db = metrics.instrument(connect(app.config["DATABASE_URL"]))
+    #Bring the schema up to date, only the migrations that weren't applied yet run
+    migrate(db)
+
+    #Password hashing runs in its own processes
+    hasher = PasswordHasher(app.config["PASSWORD_HASH_METHOD"], app.config["PASSWORD_HASH_WORKERS"])
+
+    #Engine, color and car type tables, warmed at startup
+    catalog = CatalogCache(db)
+    catalog.load()
+
+    #JSON versions of the lists and of the reservation form
+    Api(app, db, catalog)
+
+    #Insurance and maintenance alerts, rebuilt in the background so the requests only read them
+    scheduler = Scheduler(db)
+    scheduler.add("fleet_alerts", app.config["FLEET_SCAN_INTERVAL"], lambda: scan_fleet(db, app.config["FLEET_ALERT_DAYS"]))
+    #Finished bookings out of the live tables, in small batches
+    scheduler.add("archive", app.config["ARCHIVE_INTERVAL"], lambda: archive_finished(db, app.config["ARCHIVE_AFTER_DAYS"]))
+
+    #Roles of the logged in users, resolved once at login or register and dropped in every
+    #worker when the users counter moves
+    identity_cache = IdentityCache(lambda: current(db, "users"))
+
+    #Rendered public pages and vehicle catalog
+    render_cache = RenderCache(app.config["RENDER_CACHE_BYTES"])
+
+    #What the names at the top of this file point to
+    app.extensions["luxent"] = {
+        "db": db,
+        "assets": assets,
+        "metrics": metrics,
+        "hasher": hasher,
+        "catalog": catalog,
+        "scheduler": scheduler,
+        "identity_cache": identity_cache,
+        "render_cache": render_cache,
+        "fields": admin_fields(db),
+    }
+    app.register_blueprint(views)
+
+    #Answered before the session is opened and the user is loaded
+    app.wsgi_app = HealthCheck(app.wsgi_app, db)
+
+    #The production server starts the threads in every worker after the fork, see server.py
+    if not app.config["PREFORK"]:
+        start_background(app)
+    return app
+
+
+def resolve_identity(user_id):
+    """Look up the roles of a user with a single query and cache them"""
+    rows = db.execute("""
+        SELECT
+            u.id,
+            EXISTS (SELECT 1 FROM admins a WHERE a.user_id = u.id) AS is_admin,
+            EXISTS (SELECT 1 FROM customers c WHERE c.user_id = u.id) AS is_customer
+        FROM users u
+        WHERE u.id = ?
+    """, user_id)
+    if not rows:
+        identity_cache.invalidate(user_id)
+        return None
+
+    identity = {"is_admin": bool(rows[0]["is_admin"]), "is_customer": bool(rows[0]["is_customer"])}
+    identity_cache.set(user_id, identity)
+    return identity
+
+
+def role():
+    """Which navbar the page gets"""
+    if g.is_admin:
+        return "admin"
+    if g.is_customer:
+        return "customer"
+    return "user" if session.get("user_id") else "guest"
+
+
+def page_view(steps):
+    """Decorate the GET pages written as steps of pages.py, asgi.py runs the same steps on the async database"""
+
+    @wraps(steps)
+    def view(*args, **kwargs):
+        return run_steps(steps(*args, **kwargs), db)
+
+    view.steps = steps
+    return view
+
+
+def cached_page(template, version=None, context=None):
+    """Steps that render a template once per role and data version, context is a dict or the steps that make it, only run on a miss"""
+    key = (template, role(), version)
+    html = render_cache.get(key)
+    if html is None:
+        values = (yield from context) if inspect.isgenerator(context) else context or {}
+        html = yield Render(template, **values)
+        render_cache.set(key, html)
+    return html
+
+
+def vehicles_changed():
+    """Call after every change to the vehicles table"""
+    bump(db, "vehicles")
+    render_cache.invalidate("reservations.html")
+    #The dates may have changed, the alerts are rebuilt by the scheduler thread
+    scheduler.wake("fleet_alerts")
+
+
+def user_changed(user_id):
+    """Call after a change to the roles or the account of a user, the other workers drop their cached roles too"""
+    bump(db, "users")
+    identity_cache.invalidate(user_id)
+
+
+def table_changed(table):
+    """Call after a bulk change to the vehicles, reservations or contracts"""
+    if table == "vehicles":
+        vehicles_changed()
+    else:
+        bump(db, table)
+
+
+def search_context(filters):
+    """Steps that give everything the reservations page shows for some filters"""
+    (groups_sql, groups_parameters), (cars_sql, cars_parameters) = search_queries(filters)
+    #The async database reads the counts and the cars at the same time
+    groups, cars = yield [Query(groups_sql, *groups_parameters), Query(cars_sql, *cars_parameters)]
+    return catalog_context(cars, facet_counts(groups, filters), filters)
+
+
+def catalog_context(cars, counts, filters):
+    """The reservations page for the cars a search found"""
+    return {
+        "cars": cars,
+        "counts": counts,
+        "filters": filters,
+        "engine_types": catalog.rows("engine"),
+        "colors": catalog.rows("color"),
+        "car_types": catalog.rows("car_type")
+    }
 
-from help import login_required
 
-app = Flask(__name__)
+def admin_fields(db):
+    """The SQL of the reservations and contracts tables, the days between two dates depend on the database"""
+    #How many days a car is rented and the total price, computed by SQLite instead of row by row in Python
+    reservation_days = db.days_between("r.start_date", "r.end_date")
+    contract_days = db.days_between("start_date", "end_date")
 
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+    #Columns of the admin tables that can be sorted and filtered in SQL
+    reservation_columns = {column: "r." + column for column in ["id", "user_id", "first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date", "reservation_made_date"]}
+    reservation_columns.update({"days": Computed(reservation_days, int), "total_price": Computed(f"{reservation_days} * v.price_per_day", number)})
+    contract_columns = {column: column for column in ["id", "contract_number", "first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date", "contract_made_date", "price_per_day"]}
+    contract_columns.update({"days": Computed(contract_days, int), "total_price": Computed(f"{contract_days} * price_per_day", number)})
 
-db = SQL("sqlite:///luxent.db")
+    return {
+        "reservations": f"r.id, r.user_id, r.first_name, r.last_name, r.phone_number, r.vehicle_id, r.start_date, r.end_date, r.reservation_made_date, {reservation_days} AS days, {reservation_days} * v.price_per_day AS total_price",
+        "contracts": f"id, contract_number, first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_made_date, price_per_day, {contract_days} AS days, {contract_days} * price_per_day AS total_price",
+        "reservation_columns": reservation_columns,
+        "contract_columns": contract_columns,
+    }
 
 
-@app.after_request
+VEHICLE_COLUMNS = {column: column for column in ["id", "make", "model", "engine_type_id", "color_id", "car_type_id", "year", "insurance_expiration_date", "maintenance_need_date", "price_per_day", "accidents"]}
+
+
+@views.after_app_request
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    """Ensure the pages of logged in users aren't cached, the static files can be and the API sets its own headers"""
+    if request.endpoint == "static":
+        return assets.cache_static(response)
+    if request.endpoint == "assets" or request.blueprint == "api":
+        return response
+
+    if session.get("user_id") and response.mimetype == "text/html":
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
     return response
 
 
-@app.before_request
+@views.before_app_request
 def load_user():
     """ Load user-specific info"""
     g.is_admin = False
     g.is_customer = False
 
-    #Check if user is admin or customer
-    if session.get("user_id"):
-        user = db.execute("SELECT * FROM users WHERE id = ?", session["user_id"])
-        if not user:
+    #Check if user is admin or customer, the database is only queried on a cache miss
+    user_id = session.get("user_id")
+    if user_id:
+        identity = identity_cache.get(user_id) or resolve_identity(user_id)
+        if not identity:
             session.clear()
             return redirect("/login")
 
-        admin = db.execute("SELECT * FROM admins WHERE user_id = ?", session["user_id"])
-        if admin:
-            g.is_admin = True
-
-        customer = db.execute("SELECT * FROM customers WHERE user_id = ?", session["user_id"])
-        if customer:
-            g.is_customer = True
+        g.is_admin = identity["is_admin"]
+        g.is_customer = identity["is_customer"]
 
 
 #Routes for customer
 
-@app.route("/")
+@views.route("/")
+@page_view
 def index():
     #Check if the user is logged
     user_id = session.get("user_id")
 
     #If it's logged in, it's going to have a custom navbar depending on it's role
     if user_id:
-        rows = db.execute("SELECT * FROM users WHERE id = ?", user_id)
-        is_admin = rows[0]["id"]
-        return render_template("index.html", is_admin=is_admin)
+        return (yield from cached_page("index.html", context={"is_admin": g.is_admin}))
     #If it's noy it'd going to render as guest
     else:
-        return render_template("index.html")
+        return (yield from cached_page("index.html"))
 
 
-@app.route("/login", methods=["GET", "POST"])
+@views.route("/login", methods=["GET", "POST"])
 def login():
     #Clear the session
     session.clear()
@@ -73,37 +317,49 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
 
-        # Query user data
-        user = db.execute("SELECT * FROM users WHERE username = ?", username)
+        # Query user data together with its roles
+        user = db.execute("""
+            SELECT
+                u.id,
+                u.password,
+                EXISTS (SELECT 1 FROM admins a WHERE a.user_id = u.id) AS is_admin,
+                EXISTS (SELECT 1 FROM customers c WHERE c.user_id = u.id) AS is_customer
+            FROM users u
+            WHERE u.username = ?
+        """, username)
 
         #Check if username and passwords match
-        if len(user) != 1 or not check_password_hash(user[0]["password"], password):
+        if len(user) != 1 or not hasher.check(user[0]["password"], password):
             return render_template("sorry.html", message="Inavlid username or password")
 
-        # Set session for the logged-in user
+        # Upgrade the hash if the work factor changed since it was made
+        if hasher.needs_rehash(user[0]["password"]):
+            db.execute("UPDATE users SET password = ? WHERE id = ?", hasher.hash(password), user[0]["id"])
+
+        # Set session for the logged-in user and remember its roles
         session["user_id"] = user[0]["id"]
+        identity = {"is_admin": bool(user[0]["is_admin"]), "is_customer": bool(user[0]["is_customer"])}
+        identity_cache.set(user[0]["id"], identity)
 
         # Check if user is admin
-        admin = db.execute("SELECT * FROM admins WHERE user_id = ?", user[0]["id"])
-        if len(admin) > 0:
+        if identity["is_admin"]:
             return redirect("/all_reservations")
 
         # Check if user is a customer
-        customer = db.execute("SELECT * FROM customers WHERE user_id = ?", user[0]["id"])
-        if len(customer) > 0:
+        if identity["is_customer"]:
             return redirect("/")
 
     else:
         #If it's not logged in render the form
         return render_template("login.html")
 
-@app.route("/logout")
+@views.route("/logout")
 def logout():
     #Log out the user
     session.clear()
     return redirect("/")
 
-@app.route("/register", methods=["GET", "POST"])
+@views.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
 
@@ -139,119 +395,90 @@ def register():
             return render_template("sorry.html", message="Passwords don't match")
 
         #Hashing the password and insert the data in the database
-        hashed_password = generate_password_hash(password)
+        hashed_password = hasher.hash(password)
 
         #Insert the new user in the users table and customers table
-        user = db.execute("INSERT INTO users(username, password) VALUES(?, ?)", username, hashed_password)
+        user = db.insert("INSERT INTO users(username, password) VALUES(?, ?)", username, hashed_password)
         db.execute("INSERT INTO customers(user_id, first_name, last_name, email) VALUES(?, ?, ?, ?)", user, first_name, last_name, email)
 
         #Log in the user after the insertion
         session["user_id"] = user
+        identity_cache.set(user, {"is_admin": False, "is_customer": True})
         return redirect("/")
 
     else:
         #Render the form if it's the GET method
         return render_template("register.html")
 
-@app.route("/reservations", methods=["GET", "POST"])
+@views.route("/reservations", methods=["GET", "POST"])
+@page_view
 @login_required
 def reservations():
-    # Fetch options for filtering
-    engine_types = db.execute("SELECT engine_type FROM engine")
-    colors = db.execute("SELECT color_name FROM color")
-    car_types = db.execute("SELECT car_type FROM car_type")
-
-    # Base query
-    base_query = """
-        SELECT
-            v.id,
-            v.make,
-            v.model,
-            e.engine_type AS engine_type,
-            c.color_name AS color,
-            ct.car_type AS car_type,
-            v.year,
-            v.price_per_day
-        FROM vehicles v
-        JOIN engine e ON e.id = v.engine_type_id
-        JOIN color c ON c.id = v.color_id
-        JOIN car_type ct ON ct.id = v.car_type_id
-    """
+    # The unfiltered catalog only changes with the vehicles
+    if request.method == "GET":
+        version = (version_of((yield Query(VERSION, "vehicles"))), catalog.version)
+        return (yield from cached_page("reservations.html", version, search_context(empty_filters())))
+
+    # Retrieve selected filters
+    filters = empty_filters()
+    for facet in FACETS:
+        try:
+            filters[facet] = [int(value) for value in request.form.getlist(f"{facet}[]")]
+        except ValueError:
+            return render_template("sorry.html", message="Select valid options")
+
+    # Check the price and year ranges
+    for field in ["min_price", "max_price", "min_year", "max_year"]:
+        value = request.form.get(field)
+        if value:
+            try:
+                filters[field] = int(value)
+            except ValueError:
+                return render_template("sorry.html", message="Enter whole numbers for the price and the year")
+
+    # Words to look for in the make and the model
+    filters["text"] = request.form.get("text", "")
+
+    # Keep only the cars that are free for the whole period
+    start_date = request.form.get("start_date")
+    end_date = request.form.get("end_date")
+    if start_date or end_date:
+        if not start_date or not end_date:
+            return render_template("sorry.html", message="Enter both a start date and an end date")
+
+        try:
+            check_start_date = datetime.strptime(start_date, "%Y-%m-%d")
+            check_end_date = datetime.strptime(end_date, "%Y-%m-%d")
+        except ValueError:
+            return render_template("sorry.html", message="Enter the dates as YYYY-MM-DD")
 
-    where_conditions = []
-    parameters = []
+        if check_end_date <= check_start_date:
+            return render_template("sorry.html", message="The end date can't be before or the same as the start")
 
-    if request.method == "POST":
-        # Retrieve selected filters
-        selected_engine_types = request.form.getlist("engine_type[]")
-        selected_colors = request.form.getlist("color[]")
-        selected_car_types = request.form.getlist("car_type[]")
-
-        # Add conditions for selected engine types
-        if selected_engine_types:
-            where_conditions.append(f"e.engine_type IN ({', '.join(['?'] * len(selected_engine_types))})")
-            parameters.extend(selected_engine_types)
-
-        # Add conditions for selected colors
-        if selected_colors:
-            where_conditions.append(f"c.color_name IN ({', '.join(['?'] * len(selected_colors))})")
-            parameters.extend(selected_colors)
-
-        # Add conditions for selected car types
-        if selected_car_types:
-            where_conditions.append(f"ct.car_type IN ({', '.join(['?'] * len(selected_car_types))})")
-            parameters.extend(selected_car_types)
-
-    # Construct the final query
-    if where_conditions:
-        base_query += " WHERE " + " AND ".join(where_conditions)
-
-    # Execute the query
-    try:
-        cars = db.execute(base_query, parameters) if parameters else db.execute(base_query)
-    except Exception as e:
-        print("Error executing query:", e)
-        cars = []
+        filters["start_date"] = check_start_date.date().isoformat()
+        filters["end_date"] = check_end_date.date().isoformat()
 
-    return render_template("reservations.html", cars=cars, engine_types=engine_types, colors=colors, car_types=car_types)
+    return (yield Render("reservations.html", **(yield from search_context(filters))))
 
-@app.route("/my_reservations")
+@views.route("/my_reservations")
+@page_view
 @login_required
 def my_reservations():
-    #Select all the reservations made by the customer
-    rows = db.execute("SELECT r.id, r.first_name, r.last_name, r.phone_number, r.vehicle_id, r.start_date, r.end_date, r.reservation_made_date, v.price_per_day FROM reservations r JOIN vehicles v ON r.vehicle_id = v.id WHERE r.user_id = ?", session["user_id"])
-
-    #Creating an empty list
-    reservations = []
-
-    #Creating a loop to modify every reservation made by the user
-    for row in rows:
-        #Check the start and end date
-        start_date = datetime.strptime(row["start_date"], "%Y-%m-%d")
-        end_date = datetime.strptime(row["end_date"], "%Y-%m-%d")
-
-        #Check how many days is the car rented and the total price
-        days = (end_date - start_date).days
-        total_price = days * row["price_per_day"]
-
-        #Append all the informations made and querried from the database
-        reservations.append({
-            "id": row["id"],
-            "first_name": row["first_name"],
-            "last_name": row["last_name"],
-            "phone_number": row["phone_number"],
-            "vehicle_id": row["vehicle_id"],
-            "reservation_made_date": row["reservation_made_date"],
-            "start_date": row["start_date"],
-            "end_date": row["end_date"],
-            "days": days,
-            "total_price": total_price
-        })
+    #The past reservations are in the archive, they are only read when asked for
+    history = request.args.get("history") == "1"
+
+    #Select all the reservations made by the customer, with the days and the total price
+    reservations = yield Query(reservations_of_user(history), session["user_id"])
 
     #Render the template with all the data
-    return render_template("my_reservations.html", reservations=reservations)
+    return (yield Render("my_reservations.html", reservations=reservations, history=history))
+
+def reservations_of_user(history):
+    """The query of the reservations of a user, with the finished ones too if history"""
+    source = with_history("reservations") if history else "reservations"
+    return f"SELECT {fields['reservations']} FROM {source} r JOIN vehicles v ON r.vehicle_id = v.id WHERE r.user_id = ? ORDER BY r.id"
 
-@app.route("/make_reservation", methods=["GET", "POST"])
+@views.route("/make_reservation", methods=["GET", "POST"])
 @login_required
 def make_reservation():
     if request.method == "POST":
@@ -282,9 +509,7 @@ def make_reservation():
             return render_template("sorry.html", message="Enter a end date")
 
         #Check if the vehicle exists in the database
-        check_vehicles_id = db.execute("SELECT id FROM vehicles")
-        vehicle_ids = [row["id"] for row in check_vehicles_id]
-        if int(vehicle_id) not in vehicle_ids:
+        if not row_exists(db, "vehicles", vehicle_id):
             return render_template("sorry.html", message="Invalid vehicle id")
 
         #Check the start date and end date
@@ -298,8 +523,10 @@ def make_reservation():
         if check_end_date <= check_start_date:
             return render_template("sorry.html", message="The end date can't be in the past or the same as the start")
 
-        #Insert the new reservation in the reservations table
-        db.execute("INSERT INTO reservations (user_id, first_name, last_name, phone_number, vehicle_id, start_date, end_date, reservation_made_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", session["user_id"], first_name, last_name, phone_number, vehicle_id, start_date, end_date, current_time)
+        #Insert the new reservation in the reservations table if the vehicle is free
+        reservation = book_reservation(db, session["user_id"], first_name, last_name, phone_number, int(vehicle_id), check_start_date.date(), check_end_date.date(), current_time)
+        if not reservation:
+            return render_template("sorry.html", message="The vehicle is already booked in that period")
 
         return redirect("/")
     else:
@@ -307,7 +534,7 @@ def make_reservation():
 
 #Routes for admin
 
-@app.route("/add_admin", methods=["GET", "POST"])
+@views.route("/add_admin", methods=["GET", "POST"])
 @login_required
 def add_admin():
     if request.method == "POST":
@@ -329,61 +556,33 @@ def add_admin():
             return render_template("sorry.html", message="Username already exists.")
 
         # Insert new user
-        hashed_password = generate_password_hash(password)
-        db.execute("INSERT INTO users (username, password) VALUES (?, ?)", username, hashed_password)
-
-        # Retrieve new user's ID directly after the insert
-        new_user_id = db.execute("SELECT id FROM users WHERE username = ?", username)
-        if not new_user_id:
+        hashed_password = hasher.hash(password)
+        user_id = db.insert("INSERT INTO users (username, password) VALUES (?, ?)", username, hashed_password)
+        if not user_id:
             return render_template("sorry.html", message="Error creating admin user.")
 
-        user_id = new_user_id[0]["id"]  # Access the ID
-
-        # Insert into admins table
+        # Insert into admins table and drop any stale roles of that user
         db.execute("INSERT INTO admins (user_id) VALUES (?)", user_id)
+        user_changed(user_id)
 
         return redirect("/all_reservations")
 
     return render_template("add_admin.html")
 
 
-@app.route("/all_reservations", methods=["GET", "POST"])
+@views.route("/all_reservations", methods=["GET", "POST"])
 @login_required
 def all_reservations():
-    #Select all of the reservations
-    rows = db.execute("SELECT r.id, r.user_id, r.first_name, r.last_name, r.phone_number, r.vehicle_id, r.start_date, r.end_date, r.reservation_made_date, v.price_per_day FROM reservations r JOIN vehicles v ON r.vehicle_id = v.id")
-
-    #Creating an empty list
-    reservations = []
-
-    #Looping through every reservation
-    for row in rows:
-
-        #Check the date
-        start_date = datetime.strptime(row["start_date"], "%Y-%m-%d")
-        end_date = datetime.strptime(row["end_date"], "%Y-%m-%d")
-
-        #Check how many days the car is rented and the total price
-        days = (end_date - start_date).days
-        total_price = days * row["price_per_day"]
-
-        #Append the new data to the list
-        reservations.append({
-            "id": row["id"],
-            "first_name": row["first_name"],
-            "last_name": row["last_name"],
-            "phone_number": row["phone_number"],
-            "vehicle_id": row["vehicle_id"],
-            "reservation_made_date": row["reservation_made_date"],
-            "start_date": row["start_date"],
-            "end_date": row["end_date"],
-            "days": days,
-            "total_price": total_price
-        })
-
-    return render_template("all_reservations.html", reservations=reservations)
-
-@app.route("/remove", methods=["GET", "POST"])
+    #The finished reservations too with history=1
+    history = request.args.get("history") == "1"
+    source = with_history("reservations") if history else "reservations"
+
+    #Select one page of the reservations, or all of them with size=all, with the days and the total price
+    page = paginate(db, f"SELECT {fields['reservations']} FROM {source} r JOIN vehicles v ON r.vehicle_id = v.id", fields["reservation_columns"], current_app.config["PAGE_SIZE"], key="r.id", allow_all=True)
+
+    return stream_page("all_reservations.html", reservations=page.rows, page=page, history=history)
+
+@views.route("/remove", methods=["GET", "POST"])
 @login_required
 def remove():
     if request.method == "POST":
@@ -403,12 +602,12 @@ def remove():
                 return render_template("sorry.html", message="Enter a positive number")
 
             #Check if the ID exist
-            check_reservation_id = db.execute("SELECT id FROM reservations")
-            reservation_ids = [row["id"] for row in check_reservation_id]
-            if int(remove_reservation) not in reservation_ids:
+            if not row_exists(db, "reservations", remove_reservation):
                 return render_template("sorry.html", message="Invalid reservation ID")
 
-            db.execute("DELETE FROM reservations WHERE id = ?", remove_reservation)
+            #Also takes the reservation out of the reports
+            delete_booking(db, "reservations", remove_reservation)
+            bump(db, "reservations")
             return redirect("/all_reservations")
 
         #Removing a vehicle
@@ -418,12 +617,14 @@ def remove():
                 return render_template("sorry.html", message="Enter a positive number")
 
             #Check if the ID exist
-            check_vehicles_id = db.execute("SELECT id FROM vehicles")
-            vehicle_ids = [row["id"] for row in check_vehicles_id]
-            if int(remove_car) not in vehicle_ids:
+            if not row_exists(db, "vehicles", remove_car):
                 return render_template("sorry.html", message="Invalid vehicle ID")
 
-            db.execute("DELETE FROM vehicles WHERE id = ?", remove_car)
+            #Its reservations and contracts go with it, and out of the reports
+            delete_vehicle(db, remove_car)
+            bump(db, "reservations")
+            bump(db, "contracts")
+            vehicles_changed()
             return redirect("/cars")
 
         #Removing a contract
@@ -433,17 +634,16 @@ def remove():
                 return render_template("sorry.html", message="Enter a positive number")
 
             #Check if the ID exist
-            check_contract_id = db.execute("SELECT id FROM contracts")
-            contract_ids = [row["id"] for row in check_contract_id]
-            if int(remove_contract) not in contract_ids:
+            if not row_exists(db, "contracts", remove_contract):
                 return render_template("sorry.html", message="Invalid contract ID")
 
-            db.execute("DELETE FROM contracts WHERE id = ?", remove_contract)
+            delete_booking(db, "contracts", remove_contract)
+            bump(db, "contracts")
             return redirect("/contracts")
     else:
         return render_template("remove.html")
 
-@app.route("/adding_car", methods=["GET", "POST"])
+@views.route("/adding_car", methods=["GET", "POST"])
 @login_required
 def adding_car():
     if request.method == "POST":
@@ -461,9 +661,7 @@ def adding_car():
         if not engine_type_id or int(engine_type_id) <= 0:
             return render_template("sorry.html", message="Enter a positive engine ID.")
 
-        check_engine_type_id = db.execute("SELECT id FROM engine")
-        engine_ids = [row["id"] for row in check_engine_type_id]
-        if int(engine_type_id) not in engine_ids:
+        if not catalog.has_id("engine", engine_type_id):
             return render_template("sorry.html", message="Invalid engine ID")
 
         #Check the color ID
@@ -471,9 +669,7 @@ def adding_car():
         if not color_id or int(color_id) <= 0:
             return render_template("sorry.html", message="Enter a positive color ID.")
 
-        check_color_id = db.execute("SELECT id FROM color")
-        color_ids = [row["id"] for row in check_color_id]
-        if int(color_id) not in color_ids:
+        if not catalog.has_id("color", color_id):
             return render_template("sorry.html", message="Invalid color ID")
 
         #Check the car type ID
@@ -481,9 +677,7 @@ def adding_car():
         if not car_type_id or int(car_type_id) <= 0:
             return render_template("sorry.html", message="Enter a positive car type ID.")
 
-        check_car_type_id = db.execute("SELECT id FROM car_type")
-        car_type_ids = [row["id"] for row in check_car_type_id]
-        if int(car_type_id) not in car_type_ids:
+        if not catalog.has_id("car_type", car_type_id):
             return render_template("sorry.html", message="Invalid car type ID")
 
         #Check the year
@@ -519,13 +713,14 @@ def adding_car():
             return render_template("sorry.html", message="The maintenance date can't be the in the past")
 
         #Insert into vehicles
-        db.execute("INSERT INTO vehicles (make, model, engine_type_id, color_id, car_type_id, year, insurance_expiration_date, maintenance_need_date, price_per_day, accidents) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", make, model, engine_type_id, color_id, car_type_id, year, insurance_expiration_date, maintenance_need_date, price_per_day, accidents)
+        db.execute("INSERT INTO vehicles (make, model, engine_type_id, color_id, car_type_id, year, insurance_expiration_date, maintenance_need_date, price_per_day, accidents) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", make, model, engine_type_id, color_id, car_type_id, year, check_insurance_date.date(), check_maintenance_date.date(), price_per_day, accidents)
+        vehicles_changed()
 
         return redirect("/cars")
     else:
         return render_template("adding_car.html")
 
-@app.route("/change_details", methods=["GET", "POST"])
+@views.route("/change_details", methods=["GET", "POST"])
 @login_required
 def change_details():
     if request.method == "POST":
@@ -546,9 +741,7 @@ def change_details():
             return render_template("sorry.html", message="Enter a positive car ID.")
 
         #Check if the vehicle exists
-        check_vehicles_id = db.execute("SELECT id FROM vehicles")
-        vehicle_ids = [row["id"] for row in check_vehicles_id]
-        if int(car_id) not in vehicle_ids:
+        if not row_exists(db, "vehicles", car_id):
             return render_template("sorry.html", message="Invalid vehicle id")
 
         #Update the insurance date
@@ -558,7 +751,8 @@ def change_details():
             if check_insurance_date <= current_time:
                 return render_template("sorry.html", message="The insurance date can't be in the past")
 
-            db.execute("UPDATE vehicles SET insurance_expiration_date = ? WHERE id = ?", insurance_expiration_date, car_id)
+            db.execute("UPDATE vehicles SET insurance_expiration_date = ? WHERE id = ?", check_insurance_date.date(), car_id)
+            vehicles_changed()
             return redirect("/cars")
 
         #Update the maintenance date
@@ -568,7 +762,8 @@ def change_details():
             if check_maintenance_date <= current_time:
                 return render_template("sorry.html", message="The maintenance date can't be the in the past")
 
-            db.execute("UPDATE vehicles SET maintenance_need_date = ? WHERE id = ?", maintenance_need_date, car_id)
+            db.execute("UPDATE vehicles SET maintenance_need_date = ? WHERE id = ?", check_maintenance_date.date(), car_id)
+            vehicles_changed()
             return redirect("/cars")
 
         #Update the price per day
@@ -577,61 +772,90 @@ def change_details():
             if int(price_per_day) <= 0:
                 return render_template("sorry.html", message="The price can't be negative")
 
-            db.execute("UPDATE vehicles SET price_per_day = ? WHERE id = ?", price_per_day, car_id)
+            #The reservations are worth the new price, in the reports too
+            with db.transaction():
+                old_price = db.execute("SELECT price_per_day FROM vehicles WHERE id = ?", car_id)[0]["price_per_day"]
+                db.execute("UPDATE vehicles SET price_per_day = ? WHERE id = ?", price_per_day, car_id)
+                reprice_vehicle(db, car_id, old_price, price_per_day)
+            vehicles_changed()
             return redirect("/cars")
 
         if not insurance_expiration_date and not price_per_day and not maintenance_need_date:
             db.execute("UPDATE vehicles SET accidents = ? WHERE id = ?", accidents, car_id)
+            vehicles_changed()
             return redirect("/cars")
 
     else:
         return render_template("change_details.html")
 
-@app.route("/cars", methods=["GET", "POST"])
+@views.route("/cars", methods=["GET", "POST"])
+@page_view
 @login_required
 def cars():
-    #See all the vehicles
-    cars = db.execute("SELECT * FROM vehicles")
-    return render_template("cars.html", cars=cars)
+    #See one page of the vehicles, size=all streams every vehicle from a cursor
+    query = PageQuery("SELECT * FROM vehicles", VEHICLE_COLUMNS, current_app.config["PAGE_SIZE"], allow_all=True)
+    vehicles = query.page((yield Query(query.sql, *query.parameters, stream=query.everything)))
+    return (yield Render("cars.html", stream=True, cars=vehicles.rows, page=vehicles, engine_types=catalog.rows("engine"), colors=catalog.rows("color"), car_types=catalog.rows("car_type")))
 
-@app.route("/contracts")
+@views.route("/contracts")
 @login_required
 def contracts():
-    #Select all the contracts
-    rows = db.execute("SELECT * FROM contracts")
-
-    #Created an empty list
-    contracts = []
-
-    #Looping all the contracts
-    for row in rows:
-
-        #Check the date
-        start_date = datetime.strptime(row["start_date"], "%Y-%m-%d")
-        end_date = datetime.strptime(row["end_date"], "%Y-%m-%d")
-
-        #See how many days the car is rented and the total price of it
-        days = (end_date - start_date).days
-        total_price = days * row["price_per_day"]
-
-        #Append in the list the data
-        contracts.append({
-            "id": row["id"],
-            "contract_number": row["contract_number"],
-            "first_name": row["first_name"],
-            "last_name": row["last_name"],
-            "phone_number": row["phone_number"],
-            "vehicle_id": row["vehicle_id"],
-            "contract_made_date": row["contract_made_date"],
-            "start_date": row["start_date"],
-            "end_date": row["end_date"],
-            "price_per_day": row["price_per_day"],
-            "days": days,
-            "total_price": total_price
-        })
-    return render_template("contracts.html", contracts=contracts)
-
-@app.route("/adding_contract", methods=["GET", "POST"])
+    #The finished contracts too with history=1
+    history = request.args.get("history") == "1"
+    source = with_history("contracts") + " k" if history else "contracts"
+
+    #Select one page of the contracts, with the days and the total price
+    page = paginate(db, f"SELECT {fields['contracts']} FROM {source}", fields["contract_columns"], current_app.config["PAGE_SIZE"], allow_all=True)
+
+    return stream_page("contracts.html", contracts=page.rows, page=page, history=history)
+
+@views.route("/search")
+@login_required
+def search_people_page():
+    if not g.is_admin:
+        return redirect("/")
+
+    #Names, phone numbers, contract numbers or emails, the start of every word is enough
+    query = request.args.get("q", "")
+    people = search_people(db, query) if query.strip() else []
+    return render_template("search.html", query=query, people=people)
+
+@views.route("/fleet_alerts")
+@login_required
+def fleet_alerts():
+    if not g.is_admin:
+        return redirect("/")
+
+    #Only reads the alerts the last scan saved
+    alerts, counts = fleet_summary(db)
+    return render_template("fleet_alerts.html", alerts=alerts, counts=counts, days=current_app.config["FLEET_ALERT_DAYS"], jobs=[job for job in scheduler.status() if job["name"] == "fleet_alerts"])
+
+@views.route("/reports")
+@login_required
+def reports():
+    if not g.is_admin:
+        return redirect("/")
+
+    #The last twelve months by default
+    today = datetime.now()
+    year, month = (today.year, today.month - 11) if today.month > 11 else (today.year - 1, today.month + 1)
+    start_month = request.args.get("start") or f"{year}-{month:02d}"
+    end_month = request.args.get("end") or today.strftime("%Y-%m")
+    dimension = request.args.get("by", "car_type")
+
+    if dimension not in DIMENSIONS:
+        return render_template("sorry.html", message="Select what to group by")
+    try:
+        if datetime.strptime(end_month, "%Y-%m") < datetime.strptime(start_month, "%Y-%m"):
+            return render_template("sorry.html", message="The end month can't be before the start")
+    except ValueError:
+        return render_template("sorry.html", message="Enter the months as YYYY-MM")
+
+    #Read from the rollups, not from the bookings
+    timeline, breakdown = usage_report(db, start_month, end_month, dimension)
+    return render_template("reports.html", timeline=timeline, breakdown=breakdown, start=start_month, end=end_month, by=dimension, dimensions=DIMENSIONS)
+
+@views.route("/adding_contract", methods=["GET", "POST"])
 @login_required
 def adding_contract():
     if request.method == "POST":
@@ -669,11 +893,13 @@ def adding_contract():
             return render_template("sorry.html", message="Enter price per day")
 
         #Check if the vehicle ID exist
-        check_vehicles_id = db.execute("SELECT id FROM vehicles")
-        vehicle_ids = [row["id"] for row in check_vehicles_id]
-        if int(vehicle_id) not in vehicle_ids:
+        if not row_exists(db, "vehicles", vehicle_id):
             return render_template("sorry.html", message="Invalid vehicle id")
 
+        #Check if the contract number is free, the archived contracts keep theirs
+        if db.execute(f"SELECT 1 AS found FROM contracts WHERE contract_number = ? UNION ALL SELECT 1 AS found FROM {ARCHIVES['contracts']} WHERE contract_number = ?", contract_number, contract_number):
+            return render_template("sorry.html", message="Contract number already used")
+
         #Check if the date it's valid
         check_start_date = datetime.strptime(start_date, "%Y-%m-%d")
         check_end_date = datetime.strptime(end_date, "%Y-%m-%d")
@@ -685,16 +911,107 @@ def adding_contract():
         if check_end_date <= check_start_date:
             return render_template("sorry.html", message="The end date can't be in the past or the same as the start")
 
-        #Insert into the contracts table
-        db.execute("INSERT INTO contracts (contract_number, first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_made_date, price_per_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", contract_number, first_name, last_name, phone_number, int(vehicle_id), start_date, end_date, current_time, price_per_day)
+        #Insert into the contracts table if the vehicle is free
+        contract = book_contract(db, contract_number, first_name, last_name, phone_number, int(vehicle_id), check_start_date.date(), check_end_date.date(), current_time, price_per_day)
+        if not contract:
+            return render_template("sorry.html", message="The vehicle is already booked in that period")
 
         return redirect("/contracts")
     else:
         return render_template("adding_contract.html")
 
+@views.route("/transfer", methods=["GET", "POST"])
+@login_required
+def transfer():
+    #Only the admins can import and export
+    if not g.is_admin:
+        return redirect("/")
+
+    if request.method == "POST":
+        #Check the table and the file
+        table = request.form.get("table")
+        if table not in TRANSFER_TABLES:
+            return render_template("sorry.html", message="Select a table")
+
+        file = request.files.get("file")
+        if not file or not file.filename:
+            return render_template("sorry.html", message="Select a CSV or JSON lines file")
+
+        #Read the upload as it comes and insert it in chunks
+        report = Importer(db, catalog, table).run(read_rows(file.stream, format_of(file.filename)))
+        if report["inserted"]:
+            table_changed(table)
+
+        return render_template("transfer.html", tables=TRANSFER_TABLES, formats=FORMATS, report=report)
+    else:
+        return render_template("transfer.html", tables=TRANSFER_TABLES, formats=FORMATS)
+
+@views.route("/export/<table>.<format>")
+@login_required
+def export(table, format):
+    if not g.is_admin:
+        return redirect("/")
+
+    if table not in TRANSFER_TABLES or format not in FORMATS:
+        return render_template("sorry.html", message="Unknown table or format")
+
+    #Sent while it is read, a chunk of rows at a time, with the archived rows for history=1
+    history = request.args.get("history") == "1"
+    response = Response(stream_with_context(export_rows(db, table, format, history=history)), mimetype=FORMATS[format])
+    response.headers["Content-Disposition"] = f"attachment; filename={table}{'_history' if history else ''}.{format}"
+    return response
+
+@views.cli.command("migrate")
+def migrate_command():
+    """Apply the schema migrations that weren't applied yet and show the applied ones"""
+    #The app migrates when it is made too, then there is nothing left to apply here
+    for migration in migrate(db):
+        click.echo(f"Applied {migration}")
+    for row in db.execute("SELECT version, name, applied_at FROM schema_migrations ORDER BY version"):
+        click.echo(f"{row['version']:>3}  {row['applied_at']}  {row['name']}")
+
+@views.cli.command("run-job")
+@click.argument("name")
+def run_job_command(name):
+    """Run a background job now, for a cron job when the app runs with JOBS=0"""
+    if name not in scheduler.jobs:
+        raise click.BadParameter(f"The jobs are {', '.join(scheduler.jobs)}", param_hint="NAME")
+    click.echo(f"{name}: {scheduler.run(name)}")
+
+@views.cli.command("rebuild-reports")
+def rebuild_reports_command():
+    """Compute the revenue and utilization rollups again from all the bookings"""
+    with db.transaction():
+        rebuild_reports(db)
+    click.echo("Rebuilt the reports")
+
+@views.cli.command("import")
+@click.argument("table", type=click.Choice(list(TRANSFER_TABLES)))
+@click.argument("file", type=click.File("rb"))
+@click.option("--format", type=click.Choice(list(FORMATS)), help="Defaults to the extension of the file")
+def import_command(table, file, format):
+    """Import vehicles, reservations or contracts from a CSV or JSON lines file"""
+    report = Importer(db, catalog, table).run(read_rows(file, format or format_of(file.name)))
+    if report["inserted"]:
+        table_changed(table)
+
+    for error in report["errors"]:
+        click.echo(f"Line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Inserted {report['inserted']} {table}, rejected {report['rejected']}")
+
+@views.cli.command("export")
+@click.argument("table", type=click.Choice(list(TRANSFER_TABLES)))
+@click.argument("output", type=click.File("w"), default="-")
+@click.option("--format", type=click.Choice(list(FORMATS)), default="csv")
+@click.option("--history", is_flag=True, help="Add the archived reservations or contracts")
+def export_command(table, output, format, history):
+    """Export vehicles, reservations or contracts as CSV or JSON lines"""
+    for chunk in export_rows(db, table, format, history=history):
+        output.write(chunk)
+
 #Both users
 
-@app.route("/change_password", methods=["GET", "POST"])
+@views.route("/change_password", methods=["GET", "POST"])
 def change_password():
     if request.method == "POST":
         #Check if the user provided the data
@@ -719,24 +1036,49 @@ def change_password():
         if password != confirm_password:
             return render_template("sorry.html", message="Passwords don't match")
 
-        #Update the password
-        db.execute("UPDATE users SET password = ? WHERE username = ?", generate_password_hash(password), username)
+        #Update the password and drop the cached roles of that user
+        db.execute("UPDATE users SET password = ? WHERE username = ?", hasher.hash(password), username)
+        user_changed(check_username[0]["id"])
 
         return redirect("/")
     else:
         return render_template("change_password.html")
 
-@app.route("/about_us", methods=["GET", "POST"])
+@views.route("/cache_stats")
+@login_required
+def cache_stats():
+    #Only the admins can see how the caches perform
+    if not g.is_admin:
+        return redirect("/")
+
+    return {"identity": identity_cache.stats(), "catalog": catalog.stats(), "render": render_cache.stats()}
+
+@views.route("/metrics")
+def show_metrics():
+    #For the admins, or for a scraper that sends the METRICS_TOKEN
+    token = os.environ.get("METRICS_TOKEN")
+    if not (token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")):
+        if not session.get("user_id"):
+            return redirect("/login")
+        if not g.is_admin:
+            return redirect("/")
+
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@views.route("/about_us", methods=["GET", "POST"])
+@page_view
 def about():
-    return render_template("about_us.html")
+    return (yield from cached_page("about_us.html"))
 
-@app.route("/contact")
+@views.route("/contact")
+@page_view
 def contact():
-    return render_template("contact.html")
+    return (yield from cached_page("contact.html"))
 
-@app.route("/faq")
+@views.route("/faq")
+@page_view
 def faq():
-    return render_template("faq.html")
+    return (yield from cached_page("faq.html"))
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
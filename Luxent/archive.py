@@ -0,0 +1,61 @@
+#Finished reservations and contracts are moved to archive tables, so the live tables only hold current bookings
+
+from datetime import date, timedelta
+
+from versions import bump
+
+#The archive table of every live table, with the same columns and IDs
+ARCHIVES = {"reservations": "reservations_archive", "contracts": "contracts_archive"}
+COLUMNS = {
+    "reservations": ["id", "user_id", "vehicle_id", "start_date", "end_date", "phone_number", "first_name", "last_name", "reservation_made_date"],
+    "contracts": ["id", "first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date", "contract_number", "contract_made_date", "price_per_day"],
+}
+
+#How many days after its end a booking is archived, and the rows moved by one transaction
+ARCHIVE_AFTER_DAYS = 30
+BATCH_SIZE = 1000
+
+
+def create_archives(db):
+    """Make the archive tables with the columns and types of the live ones"""
+    for table, archive in ARCHIVES.items():
+        if db.dialect == "postgresql":
+            db.execute(f"CREATE TABLE IF NOT EXISTS {archive} (LIKE {table} INCLUDING DEFAULTS, PRIMARY KEY (id))")
+            continue
+        #The IDs come from the live table, so they aren't AUTOINCREMENT here
+        types = {row["name"]: row["type"] for row in db.execute(f"PRAGMA table_info({table})")}
+        columns = ", ".join(f"{column} {types.get(column, '')}".strip() for column in COLUMNS[table] if column != "id")
+        db.execute(f"CREATE TABLE IF NOT EXISTS {archive} (id INTEGER PRIMARY KEY, {columns})")
+
+
+def with_history(table):
+    """The FROM part for a live table and its archive together, give it an alias"""
+    columns = ", ".join(COLUMNS[table])
+    return f"(SELECT {columns} FROM {table} UNION ALL SELECT {columns} FROM {ARCHIVES[table]})"
+
+
+def archive_finished(db, days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, today=None):
+    """
+    Move the bookings that ended more than days ago to the archive tables.
+
+    Every batch is its own short transaction, so the bookings made meanwhile only wait for
+    one batch. The rows keep their IDs and the rollups don't change. Returns the number of
+    rows moved from every table.
+    """
+    cutoff = ((today or date.today()) - timedelta(days=days)).isoformat()
+    moved = {}
+    for table, archive in ARCHIVES.items():
+        columns = COLUMNS[table]
+        insert = f"INSERT INTO {archive} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+        moved[table] = 0
+        while True:
+            with db.transaction():
+                rows = db.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE end_date < ? ORDER BY id LIMIT ?", cutoff, batch_size)
+                if not rows:
+                    break
+                #Deleted first, so the search index forgets the live row before it gets the archived one
+                db.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['?'] * len(rows))})", *[row["id"] for row in rows])
+                db.execute_many(insert, [[row[column] for column in columns] for row in rows])
+                bump(db, table)
+            moved[table] += len(rows)
+    return moved
@@ -0,0 +1,175 @@
+#The app for an ASGI server like uvicorn: the pages written as steps of pages.py run their queries
+#on an async database in the event loop, every other request goes to the Flask app through a2wsgi.
+#Start it with "uvicorn --factory asgi:create_asgi_app" in this folder, the README tells more.
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+from io import BytesIO
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import render_template, request_started
+
+from app import create_app, service
+from database import connect_async
+from pages import Query, Render
+from server import shutdown
+
+async_db = service("async_db")
+
+
+async def render(template, **context):
+    """Render a template on a thread, a big page would hold the event loop meanwhile"""
+    job = functools.partial(contextvars.copy_context().run, render_template, template, **context)
+    return await asyncio.get_running_loop().run_in_executor(None, job)
+
+
+async def run_steps(steps):
+    """run_steps() of pages.py on the async database, the streamed pages are rendered whole"""
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        if isinstance(step, Render):
+            result = await render(step.template, **step.context)
+        elif isinstance(step, Query):
+            result = await async_db.execute(step.sql, *step.parameters)
+        else:
+            #On several connections at the same time
+            result = list(await asyncio.gather(*(async_db.execute(query.sql, *query.parameters) for query in step)))
+
+
+class AsgiApp:
+    """
+    The ASGI app around the Flask app.
+
+    The GET routes without arguments whose view has steps run as tasks in the event loop,
+    with the session, the hooks and the error pages of Flask, and wait for the async
+    database without holding a thread. The session store and the roles of the user are
+    synchronous, so opening and saving the session and the before_request functions run
+    on a thread like render(). The other requests, and size=all that streams from a
+    cursor, go to a2wsgi's WSGIMiddleware, which runs the Flask app on a pool of threads.
+    """
+
+    def __init__(self, app, threads):
+        self.app = app
+        self.wsgi = WSGIMiddleware(app, workers=threads)
+        self.handlers = {}
+        for rule in app.url_map.iter_rules():
+            steps = getattr(app.view_functions[rule.endpoint], "steps", None)
+            if steps and not rule.arguments and "GET" in rule.methods:
+                self.handlers[rule.rule] = steps
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        handler = self.handlers.get(scope["path"]) if scope["method"] == "GET" else None
+        if handler is None or parse_qs(scope["query_string"].decode("latin-1")).get("size") == ["all"]:
+            return await self.wsgi(scope, receive, send)
+        return await self.run_async(handler, scope, send)
+
+    async def lifespan(self, receive, send):
+        """Open the async database when the server starts and close everything when it stops"""
+        db = self.app.extensions["luxent"]["async_db"]
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await db.open()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await db.close()
+                self.wsgi.executor.shutdown(wait=False)
+                shutdown(self.app)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def run_async(self, handler, scope, send):
+        environ = build_environ(scope, BytesIO())
+        context = self.app.request_context(environ)
+
+        #The context variables of this request, Flask's request, session and g are in them.
+        #The steps that wait for the session store or the synchronous database run on a thread
+        #in them, the handler runs in them as a task
+        variables = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+
+        def in_thread(function, *args):
+            return loop.run_in_executor(None, functools.partial(variables.run, function, *args))
+
+        pushed = False
+
+        def start():
+            nonlocal pushed
+            #Opens the session, then before_request loads the roles of the user
+            context.push()
+            pushed = True
+            request_started.send(self.app, _async_wrapper=self.app.ensure_sync)
+            return self.app.preprocess_request()
+
+        def failed(e):
+            #Raised again in the thread, so Flask logs the traceback
+            try:
+                raise e
+            except Exception:
+                return self.app.handle_exception(e)
+
+        error = None
+        try:
+            try:
+                response = await self.dispatch(handler, in_thread(start), in_thread, variables)
+            except Exception as e:
+                error = e
+                if not pushed:
+                    raise
+                response = await in_thread(failed, e)
+            chunks, status, headers = response.get_wsgi_response(environ)
+            await send({
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            })
+            for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if pushed:
+                await in_thread(context.pop, error)
+
+    async def dispatch(self, handler, started, in_thread, variables):
+        """full_dispatch_request() of Flask for the steps of a page, started is the thread running the before_request functions"""
+        try:
+            rv = await started
+            if rv is None:
+                #login_required answers with a redirect instead of the steps
+                rv = variables.run(handler)
+                if inspect.isgenerator(rv):
+                    rv = await asyncio.create_task(run_steps(rv), context=variables)
+        except Exception as e:
+            rv = variables.run(self.app.handle_user_exception, e)
+        #The after_request functions and the saving of the session
+        return await in_thread(self.app.finalize_request, rv)
+
+
+def create_asgi_app(config=None):
+    """Make the Flask app and the ASGI app around it, config is the one of create_app()"""
+    app = create_app(config)
+    #Threads of the Flask app for the other requests, and of the SQLite queries of the async database
+    app.config.setdefault("WSGI_THREADS", int(os.environ.get("WSGI_THREADS", 8)))
+    app.config.setdefault("ASYNC_DB_THREADS", int(os.environ.get("ASYNC_DB_THREADS", 4)))
+
+    metrics = app.extensions["luxent"]["metrics"]
+    app.extensions["luxent"]["async_db"] = metrics.instrument_async(connect_async(app.config["DATABASE_URL"], app.config["ASYNC_DB_THREADS"]))
+    return AsgiApp(app, app.config["WSGI_THREADS"])
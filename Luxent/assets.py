@@ -0,0 +1,205 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import shutil
+
+import click
+from flask import request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+#The built files go in static/dist, next to their sources
+DIST = "dist"
+MANIFEST = "manifest.json"
+
+TEXT_FILES = {".css", ".js", ".svg", ".txt"}
+IMAGE_FILES = {".jpg", ".jpeg", ".png"}
+
+#Widths of the responsive image variants
+WIDTHS = [640, 1280, 1920]
+
+#A fingerprinted file never changes, so the browser can keep it for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def hashed_name(name, digest, suffix=None):
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{digest}{suffix or extension}"
+
+
+def source_files(static_folder):
+    #Every file under static, except the built ones
+    for root, directories, files in os.walk(static_folder):
+        directories[:] = [d for d in directories if os.path.join(root, d) != os.path.join(static_folder, DIST)]
+        for file in files:
+            yield os.path.relpath(os.path.join(root, file), static_folder).replace(os.sep, "/")
+
+
+def image_variants(path, digest, dist, name):
+    """Write AVIF, WebP and smaller JPEG copies of an image at a few widths, if Pillow can"""
+    try:
+        from PIL import Image, features
+    except ImportError:
+        return []
+
+    variants = []
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        for format in ("avif", "webp", "jpeg"):
+            if format != "jpeg" and not features.check(format):
+                continue
+            for width in WIDTHS + [image.width]:
+                if width > image.width or any(v["format"] == format and v["width"] == width for v in variants):
+                    continue
+                resized = image.resize((width, round(image.height * width / image.width))) if width < image.width else image
+                variant = hashed_name(name, digest, f".{width}.{format}")
+                resized.save(os.path.join(dist, variant), format.upper(), quality=70)
+                variants.append({"format": format, "width": width, "file": variant})
+    return variants
+
+
+def compress(path):
+    """Write .gz and, if the brotli package is there, .br copies of a text file"""
+    with open(path, "rb") as file:
+        data = file.read()
+    with open(path + ".gz", "wb") as file:
+        file.write(gzip.compress(data, 9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + ".br", "wb") as file:
+        file.write(brotli.compress(data, quality=11))
+
+
+def build(static_folder):
+    """Write fingerprinted, precompressed copies of the static files and the image variants to static/dist"""
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+
+    files = {}
+    variants = {}
+    #What the stylesheets point to, a resized JPEG when there is one
+    css_targets = {}
+    names = sorted(source_files(static_folder), key=lambda name: os.path.splitext(name)[1] in TEXT_FILES)
+
+    #The images go first so the stylesheets can point to their new names
+    for name in names:
+        path = os.path.join(static_folder, name)
+        extension = os.path.splitext(name)[1].lower()
+        with open(path, "rb") as file:
+            data = file.read()
+
+        if extension == ".css":
+            text = data.decode()
+            for source, built in css_targets.items():
+                text = text.replace(f"/static/{source}", f"/assets/{built}")
+            data = text.encode()
+
+        digest = fingerprint(data)
+        files[name] = hashed_name(name, digest)
+        target = os.path.join(dist, files[name])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as file:
+            file.write(data)
+
+        if extension in TEXT_FILES:
+            compress(target)
+        elif extension in IMAGE_FILES:
+            variants[name] = image_variants(path, digest, os.path.dirname(target), os.path.basename(name))
+            for variant in variants[name]:
+                variant["file"] = posixpath.join(posixpath.dirname(files[name]), variant["file"])
+            jpegs = [v for v in variants[name] if v["format"] == "jpeg" and v["width"] <= max(WIDTHS)]
+            css_targets[name] = max(jpegs, key=lambda v: v["width"])["file"] if jpegs else files[name]
+        else:
+            css_targets[name] = files[name]
+
+    with open(os.path.join(dist, MANIFEST), "w") as file:
+        json.dump({"files": files, "variants": variants}, file, indent=4)
+    return files
+
+
+class Assets:
+    """
+    Serve the built static files with long lived cache headers.
+
+    Without a build, asset_url() still adds the content hash to the /static URL so a
+    changed file gets a new URL.
+    """
+
+    def __init__(self, app):
+        self.static_folder = app.static_folder
+        self.dist = os.path.join(self.static_folder, DIST)
+        self.load()
+
+        app.add_url_rule("/assets/<path:filename>", "assets", self.serve)
+        app.jinja_env.globals["asset_url"] = self.url
+        app.jinja_env.globals["asset_srcset"] = self.srcset
+
+        @app.cli.command("build-assets")
+        def build_assets():
+            """Fingerprint, compress and convert the static files"""
+            files = build(self.static_folder)
+            click.echo(f"Built {len(files)} files into {self.dist}")
+
+    def load(self):
+        path = os.path.join(self.dist, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as file:
+                manifest = json.load(file)
+            self.files = manifest["files"]
+            self.variants = manifest["variants"]
+            self.built = True
+        else:
+            self.files = {}
+            for name in source_files(self.static_folder):
+                with open(os.path.join(self.static_folder, name), "rb") as file:
+                    self.files[name] = fingerprint(file.read())
+            self.variants = {}
+            self.built = False
+
+    def url(self, name):
+        if name not in self.files:
+            return f"/static/{name}"
+        if self.built:
+            return f"/assets/{self.files[name]}"
+        return f"/static/{name}?v={self.files[name]}"
+
+    def srcset(self, name, format):
+        """srcset of the variants of an image in one format, empty without a build"""
+        return ", ".join(f"/assets/{v['file']} {v['width']}w" for v in self.variants.get(name, []) if v["format"] == format)
+
+    def serve(self, filename):
+        path = safe_join(self.dist, filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+
+        #Send the precompressed copy the browser accepts
+        mimetype = mimetypes.guess_type(filename)[0]
+        encoding = None
+        for candidate, extension in (("br", ".br"), ("gzip", ".gz")):
+            if candidate in request.accept_encodings and os.path.isfile(path + extension):
+                encoding = candidate
+                filename += extension
+                break
+
+        response = send_from_directory(self.dist, filename, mimetype=mimetype, max_age=31536000)
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    def cache_static(self, response):
+        #A /static URL with the right content hash can be cached like a built file
+        name = request.view_args.get("filename") if request.view_args else None
+        if name in self.files and request.args.get("v") == self.files[name]:
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
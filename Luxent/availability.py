@@ -0,0 +1,73 @@
+#Vehicle availability over the reservations and contracts tables
+
+from reports import record_bookings
+from versions import bump
+
+#The overlap checks seek the (vehicle_id, end_date, start_date) indexes of migrations.py.
+#A booking [start, end) overlaps another one if it starts before the other ends and ends after the other starts.
+#A vehicle with a fleet alert can't be booked past the date its insurance expires or its maintenance is due
+BOOKED = """
+    (EXISTS (SELECT 1 FROM reservations r WHERE r.vehicle_id = {vehicle} AND r.start_date < ? AND r.end_date > ?)
+    OR EXISTS (SELECT 1 FROM contracts k WHERE k.vehicle_id = {vehicle} AND k.start_date < ? AND k.end_date > ?)
+    OR EXISTS (SELECT 1 FROM fleet_alerts a WHERE a.vehicle_id = {vehicle} AND a.due_date < ?))
+"""
+
+#The bookings archive.py moved out ended in the past, only an import of old bookings can overlap them
+ARCHIVED = """
+    (EXISTS (SELECT 1 FROM reservations_archive r WHERE r.vehicle_id = ? AND r.start_date < ? AND r.end_date > ?)
+    OR EXISTS (SELECT 1 FROM contracts_archive k WHERE k.vehicle_id = ? AND k.start_date < ? AND k.end_date > ?))
+"""
+
+
+def booked_parameters(start_date, end_date):
+    """Parameters for one use of the BOOKED condition"""
+    return [end_date, start_date, end_date, start_date, end_date]
+
+
+def free_condition(vehicle="v.id"):
+    """SQL condition that is true when the vehicle is free for the whole period"""
+    return "NOT " + BOOKED.format(vehicle=vehicle)
+
+
+def is_booked(db, vehicle_id, start_date, end_date, archived=False):
+    """Check if a vehicle has a reservation or a contract in the period, also in the archive with archived"""
+    rows = db.execute("SELECT " + BOOKED.format(vehicle="?") + " AS booked",
+                      vehicle_id, end_date, start_date, vehicle_id, end_date, start_date, vehicle_id, end_date)
+    if not rows[0]["booked"] and archived:
+        rows = db.execute("SELECT " + ARCHIVED + " AS booked", vehicle_id, end_date, start_date, vehicle_id, end_date, start_date)
+    return bool(rows[0]["booked"])
+
+
+def book_reservation(db, user_id, first_name, last_name, phone_number, vehicle_id, start_date, end_date, made_date):
+    """
+    Insert a reservation only if the vehicle is free in that period.
+
+    The check and the insert run in one transaction that holds the vehicle, so two requests
+    can't book the same dates. Returns the new reservation ID or None if the vehicle is already booked.
+    """
+    with db.transaction():
+        db.lock_row("vehicles", vehicle_id)
+        if is_booked(db, vehicle_id, start_date, end_date):
+            return None
+        reservation = db.insert("INSERT INTO reservations (user_id, first_name, last_name, phone_number, vehicle_id, start_date, end_date, reservation_made_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 user_id, first_name, last_name, phone_number, vehicle_id, start_date, end_date, made_date)
+        record_bookings(db, [(vehicle_id, start_date, end_date, None)])
+        bump(db, "reservations")
+        return reservation
+
+
+def book_contract(db, contract_number, first_name, last_name, phone_number, vehicle_id, start_date, end_date, made_date, price_per_day):
+    """
+    Insert a contract only if the vehicle is free in that period.
+
+    Returns the new contract ID or None if the vehicle is already booked.
+    """
+    with db.transaction():
+        db.lock_row("vehicles", vehicle_id)
+        if is_booked(db, vehicle_id, start_date, end_date):
+            return None
+        contract = db.insert("INSERT INTO contracts (contract_number, first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_made_date, price_per_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              contract_number, first_name, last_name, phone_number, vehicle_id, start_date, end_date, made_date, price_per_day)
+        record_bookings(db, [(vehicle_id, start_date, end_date, price_per_day)])
+        bump(db, "contracts")
+        return contract
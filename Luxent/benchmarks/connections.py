@@ -0,0 +1,254 @@
+"""
+Compare how many concurrent connections the WSGI and the ASGI servers take.
+
+Run from the Luxent folder on a database made by generate.py, for example:
+
+    python benchmarks/connections.py --database bench.db --workers 2 --connections 100 --connections 1000
+    python benchmarks/connections.py --url http://localhost:8000 --pid 1234 --connections 500
+
+It starts gunicorn with gunicorn.conf.py, then uvicorn with asgi.py, with the same number
+of workers, and for every --connections count keeps that many keep-alive connections open.
+Each one is a logged in customer that asks for one of the read pages, reads it for about
+--think seconds and asks again. The memory is the PSS of the server and its workers at the
+end of a step, --wsgi-workers and --asgi-workers can differ to compare at equal memory.
+With --url only that server is measured, --pid gives its memory.
+"""
+
+import argparse
+import asyncio
+import http.cookiejar
+import os
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+LUXENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#The pages that asgi.py answers with async handlers
+PATHS = ["/reservations", "/my_reservations", "/cars", "/cars?sort=price_per_day&order=desc", "/", "/faq"]
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    #The login answers with a redirect, only its cookie is needed
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def login(url, username):
+    """The session cookie of a user, to send on the raw connections"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), NoRedirect())
+    data = urllib.parse.urlencode({"username": username, "password": "password"}).encode()
+    try:
+        opener.open(url + "/login", data=data).read()
+    except urllib.error.HTTPError as error:
+        error.read()
+    cookies = "; ".join(f"{cookie.name}={cookie.value}" for cookie in jar)
+    if not cookies:
+        raise SystemExit(f"Couldn't log in as {username}")
+    return cookies
+
+
+async def fetch(reader, writer, path, host, cookie):
+    """One request on a keep-alive connection, returns the status and if the server closes the connection"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\nAccept-Encoding: gzip\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            #The piece and its line end, the last one is empty
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status, headers.get("connection", "").lower() == "close"
+
+
+async def customer(number, address, cookies, options, clock, timings, errors):
+    """A customer that keeps its connection open and reads a page every think seconds"""
+    rng = random.Random(options.seed * 100000 + number)
+    host, port = address
+    cookie = rng.choice(cookies)
+    connection = None
+    #The customers don't all ask at the same moment
+    await asyncio.sleep(rng.uniform(0, options.think))
+
+    while True:
+        start = time.perf_counter()
+        if start >= clock["stop"]:
+            break
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            status, closing = await asyncio.wait_for(fetch(*connection, rng.choice(PATHS), host, cookie), options.timeout)
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            status, closing = None, True
+
+        if start >= clock["measure"]:
+            if status is None or status >= 400:
+                errors.append(status)
+            else:
+                timings.append(time.perf_counter() - start)
+        if closing and connection is not None:
+            connection[1].close()
+            connection = None
+        await asyncio.sleep(rng.uniform(0.5, 1.5) * options.think)
+
+    if connection is not None:
+        connection[1].close()
+
+
+async def load(address, cookies, connections, options):
+    timings, errors = [], []
+    clock = {"measure": time.perf_counter() + options.warmup}
+    clock["stop"] = clock["measure"] + options.duration
+    await asyncio.gather(*[customer(number, address, cookies, options, clock, timings, errors) for number in range(connections)])
+    return timings, errors
+
+
+def memory(pid):
+    """PSS in MB of a process and its children, the pages shared by the workers are split between them"""
+    if pid is None or not os.path.exists("/proc/self/smaps_rollup"):
+        return None
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as file:
+                    parents[int(entry)] = int(file.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                pass
+    tree = [pid]
+    for process in tree:
+        tree.extend(child for child, parent in parents.items() if parent == process)
+
+    total = 0
+    for process in tree:
+        try:
+            with open(f"/proc/{process}/smaps_rollup") as file:
+                total += sum(int(line.split()[1]) for line in file if line.startswith("Pss:"))
+        except OSError:
+            pass
+    return total / 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, workers, options):
+    """Start gunicorn or uvicorn on the database and wait until it answers /healthz"""
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.abspath(options.database), JOBS="0")
+    if kind == "wsgi":
+        env.update(BIND=f"127.0.0.1:{port}", WEB_WORKERS=str(workers))
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "--factory", "asgi:create_asgi_app", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(workers), "--no-access-log", "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=LUXENT, env=env, start_new_session=True)
+
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"The {kind} server stopped with status {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz") as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.5)
+    stop_server(process)
+    raise SystemExit(f"The {kind} server didn't start")
+
+
+def stop_server(process):
+    #The workers are in the same process group as the master
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+def measure(name, url, pid, options):
+    """Run every connection count against a server and print a line for each"""
+    parsed = urllib.parse.urlsplit(url)
+    address = (parsed.hostname, parsed.port or 80)
+    rng = random.Random(options.seed)
+    cookies = [login(url, f"user{rng.randrange(options.users)}") for _ in range(options.sessions)]
+
+    for connections in options.connections:
+        timings, errors = asyncio.run(load(address, cookies, connections, options))
+        timings.sort()
+        mb = memory(pid)
+        print(f"{name:<8}{connections:>12}{len(timings):>10}{len(errors):>8}{len(timings) / options.duration:>10.1f}"
+              f"{percentile(timings, 0.50) * 1000:>10.1f}{percentile(timings, 0.95) * 1000:>10.1f}{percentile(timings, 0.99) * 1000:>10.1f}"
+              f"{mb if mb is not None else float('nan'):>12.1f}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the concurrent connections of the WSGI and ASGI servers")
+    parser.add_argument("--database", default="bench.db", help="SQLite database made by generate.py, for the servers started here")
+    parser.add_argument("--url", help="measure a server that is already running instead")
+    parser.add_argument("--pid", type=int, help="master process of the --url server, for its memory")
+    parser.add_argument("--server", action="append", choices=["wsgi", "asgi"], help="can be given twice, both by default")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes of both servers")
+    parser.add_argument("--wsgi-workers", type=int, help="worker processes of gunicorn, --workers by default")
+    parser.add_argument("--asgi-workers", type=int, help="worker processes of uvicorn, --workers by default")
+    parser.add_argument("--connections", type=int, action="append", help="open connections of a step, can be given more than once")
+    parser.add_argument("--think", type=float, default=1, help="average seconds between the requests of a connection")
+    parser.add_argument("--timeout", type=float, default=10, help="a request slower than this counts as an error")
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured per step")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds before the measurement starts")
+    parser.add_argument("--users", type=int, default=10000, help="how many synthetic users the database has")
+    parser.add_argument("--sessions", type=int, default=20, help="how many users the connections are logged in as")
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+    options.connections = options.connections or [100, 500, 1000]
+
+    #One file descriptor per connection
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(f"{'server':<8}{'connections':>12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'memory MB':>12}")
+    if options.url:
+        measure("url", options.url.rstrip("/"), options.pid, options)
+        return
+
+    workers = {"wsgi": options.wsgi_workers or options.workers, "asgi": options.asgi_workers or options.workers}
+    for kind in options.server or ["wsgi", "asgi"]:
+        port = free_port()
+        process = start_server(kind, port, workers[kind], options)
+        try:
+            measure(kind, f"http://127.0.0.1:{port}", process.pid, options)
+        finally:
+            stop_server(process)
+
+
+if __name__ == "__main__":
+    main()
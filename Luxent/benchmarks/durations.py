@@ -0,0 +1,118 @@
+"""
+Compare the rental days and total price computed in Python with the ones computed in SQL.
+
+Run from the Luxent folder, for example:
+
+    python benchmarks/durations.py --rows 100000
+
+It fills the contracts table of a temporary SQLite database and times the old path of
+the contracts page, every row read and copied into a new dict with strptime twice for
+the days, against the query of app.py that selects the days and the total price. Then
+the same for one page sorted by the total price: the old path had to compute every row
+and sort them in Python, the new one is a keyset page of paginate().
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from app import admin_fields
+from database import SQLiteDatabase
+from pagination import paginate
+
+
+def python_rows(db):
+    #What the contracts route did before the days and the total price were in the query
+    rows = db.execute("SELECT id, contract_number, first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_made_date, price_per_day FROM contracts")
+    contracts = []
+    for row in rows:
+        start_date = datetime.strptime(row["start_date"], "%Y-%m-%d")
+        end_date = datetime.strptime(row["end_date"], "%Y-%m-%d")
+        days = (end_date - start_date).days
+        contracts.append({
+            "id": row["id"],
+            "contract_number": row["contract_number"],
+            "first_name": row["first_name"],
+            "last_name": row["last_name"],
+            "phone_number": row["phone_number"],
+            "vehicle_id": row["vehicle_id"],
+            "start_date": row["start_date"],
+            "end_date": row["end_date"],
+            "contract_made_date": row["contract_made_date"],
+            "price_per_day": row["price_per_day"],
+            "days": days,
+            "total_price": days * row["price_per_day"],
+        })
+    return contracts
+
+
+def fill(db, rows, rng):
+    db.execute("CREATE TABLE contracts (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT, last_name TEXT, phone_number TEXT, vehicle_id INTEGER, "
+               "start_date DATE, end_date DATE, contract_number TEXT, contract_made_date DATE, price_per_day NUMERIC)")
+    first = date(2020, 1, 1)
+    values = []
+    for number in range(rows):
+        start = first + timedelta(days=rng.randrange(2000))
+        values.append(["Bench", "Mark", "0700000000", rng.randint(1, 1000), start, start + timedelta(days=rng.randint(1, 30)),
+                       f"B{number}", start - timedelta(days=1), rng.choice([70, 80, 100, 120])])
+    with db.transaction():
+        db.execute_many("INSERT INTO contracts (first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_number, contract_made_date, price_per_day) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+
+
+def best(function, repeat):
+    """The fastest of repeat runs in milliseconds, and the last result"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Days and total price in Python or in SQL")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db = SQLiteDatabase(os.path.join(folder, "durations.db"))
+        fill(db, options.rows, random.Random(options.seed))
+        fields = admin_fields(db)
+        #paginate() reads the arguments of the current request
+        app = Flask(__name__)
+
+        print(f"{'step':<28}{'python ms':>12}{'sql ms':>10}")
+
+        old, old_rows = best(lambda: python_rows(db), options.repeat)
+        new, new_rows = best(lambda: db.execute(f"SELECT {fields['contracts']} FROM contracts"), options.repeat)
+        assert [(row["days"], row["total_price"]) for row in old_rows] == [(row["days"], row["total_price"]) for row in new_rows]
+        print(f"{'all rows':<28}{old:>12.1f}{new:>10.1f}")
+
+        def python_page():
+            return sorted(python_rows(db), key=lambda row: (row["total_price"], row["id"]))[:options.page_size]
+
+        def sql_page():
+            with app.test_request_context("/", query_string={"sort": "total_price"}):
+                return paginate(db, f"SELECT {fields['contracts']} FROM contracts", fields["contract_columns"], options.page_size).rows
+
+        old, old_page = best(python_page, options.repeat)
+        new, new_page = best(sql_page, options.repeat)
+        assert [row["id"] for row in old_page] == [row["id"] for row in new_page]
+        print(f"{'page sorted by total_price':<28}{old:>12.1f}{new:>10.1f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
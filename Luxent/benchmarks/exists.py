@@ -0,0 +1,73 @@
+"""
+Time the ID checks of the forms as the tables grow.
+
+Run from the Luxent folder, for example:
+
+    python benchmarks/exists.py --rows 1000 --rows 100000 --rows 1000000
+
+For every size it fills the vehicles table of a temporary SQLite database and times
+help.row_exists, one primary key lookup, against the scan the forms used to do: every
+ID of the table loaded into a list and searched with in. The lookup should take about
+the same time at every size, the scan grows with the table.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SQLiteDatabase
+from help import row_exists
+
+
+def scan_exists(db, table, row_id):
+    #What make_reservation, remove, change_details, adding_contract and adding_car did before
+    return int(row_id) in [row["id"] for row in db.execute(f"SELECT id FROM {table}")]
+
+
+def fill(db, rows):
+    db.execute("DELETE FROM vehicles")
+    with db.transaction():
+        db.execute_many("INSERT INTO vehicles (id, make, model, year, price_per_day) VALUES (?, ?, ?, ?, ?)",
+                        ([row_id, "BMW", "X5", 2020, 100] for row_id in range(1, rows + 1)))
+
+
+def timed(check, db, ids):
+    """Microseconds per check"""
+    start = time.perf_counter()
+    for row_id in ids:
+        check(db, "vehicles", row_id)
+    return (time.perf_counter() - start) / len(ids) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the ID checks as the tables grow")
+    parser.add_argument("--rows", type=int, action="append", help="table size, can be given more than once")
+    parser.add_argument("--lookups", type=int, default=10000, help="checks with row_exists per size")
+    parser.add_argument("--scans", type=int, default=20, help="checks with the old scan per size, it is slow")
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+    sizes = options.rows or [1000, 10000, 100000, 1000000]
+    rng = random.Random(options.seed)
+
+    with tempfile.TemporaryDirectory() as folder:
+        db = SQLiteDatabase(os.path.join(folder, "exists.db"))
+        db.execute("CREATE TABLE vehicles (id INTEGER PRIMARY KEY AUTOINCREMENT, make TEXT, model TEXT, year INTEGER, price_per_day NUMERIC)")
+
+        print(f"{'rows':>10}{'row_exists us':>16}{'scan us':>14}")
+        for rows in sizes:
+            fill(db, rows)
+            #Half of the IDs exist, half are past the end
+            ids = [rng.randint(1, 2 * rows) for _ in range(options.lookups)]
+            lookup = timed(row_exists, db, ids)
+            scan = timed(scan_exists, db, ids[:options.scans])
+            print(f"{rows:>10}{lookup:>16.1f}{scan:>14.1f}", flush=True)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
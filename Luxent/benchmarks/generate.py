@@ -0,0 +1,182 @@
+"""
+Fill a new SQLite database with synthetic users, vehicles, reservations and contracts.
+
+Run from the Luxent folder, for example:
+
+    python benchmarks/generate.py bench.db --vehicles 10000 --reservations 5000000
+
+Every synthetic user has the password "password", the admin is "admin". The bookings of
+a vehicle never overlap, like the ones the app saves.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+from database import SQLiteDatabase
+from migrations import migrate
+
+MAKES = {
+    "BMW": ["330e", "540i", "X5", "i4"],
+    "Audi": ["A4", "A6", "Q5", "e-tron"],
+    "Mercedes": ["C200", "E300", "GLC", "EQE"],
+    "Volkswagen": ["Golf", "Passat", "Tiguan", "ID.4"],
+    "Skoda": ["Octavia", "Superb", "Kodiaq", "Enyaq"],
+    "Toyota": ["Corolla", "Camry", "RAV4", "Prius"],
+}
+FIRST_NAMES = ["Ana", "Andrei", "Maria", "Ion", "Elena", "Mihai", "Ioana", "Gabriel", "Cristina", "Alex"]
+LAST_NAMES = ["Popescu", "Ionescu", "Arbore", "Stan", "Dumitru", "Radu", "Marin", "Tudor", "Florea", "Matei"]
+
+RESERVATION_INSERT = "INSERT INTO reservations (user_id, vehicle_id, start_date, end_date, phone_number, first_name, last_name, reservation_made_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+CONTRACT_INSERT = "INSERT INTO contracts (first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_number, contract_made_date, price_per_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+#Rows per executemany
+BATCH = 50000
+
+
+def batches(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_schema(connection, schema_path):
+    """Create the tables of the bundled database, with its engines, colors and car types"""
+    source = sqlite3.connect(schema_path)
+    for (sql,) in source.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND sql IS NOT NULL"):
+        connection.execute(sql)
+    for table in ["engine", "color", "car_type"]:
+        rows = source.execute(f"SELECT * FROM {table}").fetchall()
+        connection.executemany(f"INSERT INTO {table} VALUES ({', '.join(['?'] * len(rows[0]))})", rows)
+    source.close()
+
+
+def bookings(random, vehicles, count, start):
+    """
+    Spread count bookings over the vehicles, one after the other with small gaps.
+
+    Yields (vehicle_id, start_date, end_date) in the order they would have been made.
+    """
+    per_vehicle, extra = divmod(count, vehicles)
+    for vehicle_id in range(1, vehicles + 1):
+        day = start + timedelta(days=random.randrange(30))
+        for _ in range(per_vehicle + (1 if vehicle_id <= extra else 0)):
+            day += timedelta(days=random.randrange(3))
+            end = day + timedelta(days=random.randint(1, 7))
+            yield vehicle_id, day.isoformat(), end.isoformat()
+            day = end
+
+
+def generate(path, schema, users, vehicles, reservations, contracts, seed):
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        raise SystemExit(f"{path} already exists")
+
+    connection = sqlite3.connect(path, isolation_level=None)
+    #Nothing to lose if it fails, so skip the journal
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("BEGIN")
+    copy_schema(connection, schema)
+
+    engines = [row[0] for row in connection.execute("SELECT id FROM engine")]
+    colors = [row[0] for row in connection.execute("SELECT id FROM color")]
+    car_types = [row[0] for row in connection.execute("SELECT id FROM car_type")]
+
+    #One hash for everyone, hashing millions of passwords would take hours
+    password = generate_password_hash("password")
+    connection.execute("INSERT INTO users (id, username, password) VALUES (1, 'admin', ?)", (password,))
+    connection.execute("INSERT INTO admins (user_id) VALUES (1)")
+
+    for batch in batches((i + 2, f"user{i}", password) for i in range(users)):
+        connection.executemany("INSERT INTO users (id, username, password) VALUES (?, ?, ?)", batch)
+    for batch in batches((i + 2, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f"user{i}@example.com") for i in range(users)):
+        connection.executemany("INSERT INTO customers (user_id, first_name, last_name, email) VALUES (?, ?, ?, ?)", batch)
+
+    def vehicle():
+        make = rng.choice(list(MAKES))
+        today = date.today()
+        return (make, rng.choice(MAKES[make]), rng.choice(engines), rng.choice(colors), rng.choice(car_types), rng.randint(2015, today.year),
+                (today + timedelta(days=rng.randint(30, 700))).isoformat(), (today + timedelta(days=rng.randint(30, 700))).isoformat(),
+                rng.randrange(40, 400, 10), rng.choice(["No", "No", "No", "Yes"]))
+
+    for batch in batches(vehicle() for _ in range(vehicles)):
+        connection.executemany("INSERT INTO vehicles (make, model, engine_type_id, color_id, car_type_id, year, insurance_expiration_date, maintenance_need_date, price_per_day, accidents) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+
+    #The reservations and the contracts of a vehicle follow each other, so none of them overlap.
+    #A booking takes 5 days on average with the gap, so most of them end before today
+    total = reservations + contracts
+    start = date.today() - timedelta(days=5 * (total // vehicles) + 30)
+    made = datetime.combine(start, datetime.min.time())
+    reservation_rows = []
+    contract_rows = []
+    contract_number = 1000
+    contracts_left = contracts
+    for remaining, (vehicle_id, start_date, end_date) in zip(range(total, 0, -1), bookings(rng, vehicles, total, start)):
+        #Pick the contracts at random but end with exactly as many as asked
+        if rng.random() * remaining < contracts_left:
+            contracts_left -= 1
+            contract_number += 1
+            contract_rows.append((rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f"07{rng.randrange(10 ** 8):08d}", vehicle_id, start_date, end_date,
+                                  str(contract_number), made.strftime("%Y-%m-%d %H:%M:%S"), rng.randrange(40, 400, 10)))
+        else:
+            reservation_rows.append((rng.randint(2, users + 1) if users else 1, vehicle_id, start_date, end_date, f"07{rng.randrange(10 ** 8):08d}",
+                                     rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), made.strftime("%Y-%m-%d %H:%M:%S")))
+
+        if len(reservation_rows) >= BATCH:
+            connection.executemany(RESERVATION_INSERT, reservation_rows)
+            reservation_rows = []
+        if len(contract_rows) >= BATCH:
+            connection.executemany(CONTRACT_INSERT, contract_rows)
+            contract_rows = []
+
+    if reservation_rows:
+        connection.executemany(RESERVATION_INSERT, reservation_rows)
+    if contract_rows:
+        connection.executemany(CONTRACT_INSERT, contract_rows)
+
+    connection.execute("COMMIT")
+    connection.close()
+
+    #The indexes and tables of the app, built once the rows are in
+    db = SQLiteDatabase(path)
+    migrate(db)
+    db.execute("ANALYZE")
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a new SQLite database with synthetic data")
+    parser.add_argument("path", help="the database to create")
+    parser.add_argument("--schema", default="luxent.db", help="database to copy the tables and the catalog from")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--reservations", type=int, default=100000)
+    parser.add_argument("--contracts", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.vehicles < 1:
+        parser.error("At least one vehicle is needed")
+
+    start = time.perf_counter()
+    generate(args.path, args.schema, args.users, args.vehicles, args.reservations, args.contracts, args.seed)
+    print(f"Wrote {args.users} users, {args.vehicles} vehicles, {args.reservations} reservations and {args.contracts} contracts "
+          f"to {args.path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Run load scenarios against the app and report the throughput and the latency percentiles.
+
+Run from the Luxent folder on a database made by generate.py, for example:
+
+    python benchmarks/run.py --database bench.db --users 10000 --vehicles 1000
+    python benchmarks/run.py --database bench.db --server --concurrency 16
+    python benchmarks/run.py --url http://localhost:8000 --scenario browse
+
+Without --server or --url the requests go to the app in this process through the Flask
+test client, with --server they go over HTTP to a threaded WSGI server started here and
+with --url to a server that is already running. --save writes the results to a baseline
+file and --baseline compares with one, the exit status is 1 if a step got slower.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date, timedelta
+
+LUXENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class InProcessClient:
+    """The Flask test client, each one has its own session"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, headers=None):
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        return response.status_code, response.headers
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    #A redirect is an answer like any other, it isn't followed
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Requests over HTTP, with its own cookies"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, method, path, data=None, headers=None):
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        request = urllib.request.Request(self.url + path, data=body, method=method, headers=headers or {})
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status, response.headers
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code, error.headers
+
+
+class Scenario:
+    """
+    A user that does the same steps over and over.
+
+    setup() runs once per worker before the clock starts, step() runs one step and
+    returns its name and the status of the response.
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def setup(self, client, rng):
+        pass
+
+    def login(self, client, username):
+        status, _ = client.request("POST", "/login", {"username": username, "password": "password"})
+        if status != 302:
+            raise SystemExit(f"Couldn't log in as {username}, status {status}")
+
+
+class Browse(Scenario):
+    """A customer looking at the catalog, filtering it and paging through the API"""
+
+    def setup(self, client, rng):
+        self.login(client, f"user{rng.randrange(self.options.users)}")
+        self.etag = None
+
+    def step(self, client, rng):
+        choice = rng.random()
+        if choice < 0.3:
+            return "browse:catalog", client.request("GET", "/reservations")[0]
+
+        if choice < 0.8:
+            start = date.today() + timedelta(days=rng.randrange(365))
+            data = {"engine[]": [rng.randint(1, 3)], "color[]": rng.sample(range(1, 5), 2), "min_year": 2018,
+                    "start_date": start.isoformat(), "end_date": (start + timedelta(days=rng.randint(1, 10))).isoformat()}
+            return "browse:filter", client.request("POST", "/reservations", data)[0]
+
+        #A kiosk that keeps the list and only asks if it changed
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        status, response_headers = client.request("GET", "/api/v1/vehicles?size=50&fields=id,make,model,price_per_day", headers=headers)
+        self.etag = response_headers.get("ETag") or self.etag
+        return "browse:api", status
+
+
+class Book(Scenario):
+    """A customer making reservations, some of them for dates that are already taken"""
+
+    def setup(self, client, rng):
+        self.login(client, f"user{rng.randrange(self.options.users)}")
+
+    def step(self, client, rng):
+        start = date.today() + timedelta(days=rng.randint(1, 3 * 365))
+        data = {"first_name": "Bench", "last_name": "Mark", "phone_number": "0700000000", "vehicle_id": rng.randint(1, self.options.vehicles),
+                "start_date": start.isoformat(), "end_date": (start + timedelta(days=rng.randint(1, 7))).isoformat()}
+        status = client.request("POST", "/make_reservation", data)[0]
+        #The form answers 200 with an error page when the dates are taken, that is still a working request
+        return "book:make_reservation", status
+
+
+class Admin(Scenario):
+    """An admin going through the sorted and filtered lists"""
+
+    SORTS = {"/all_reservations": ["id", "start_date", "total_price"], "/contracts": ["id", "end_date", "days"], "/cars": ["id", "price_per_day", "year"]}
+
+    def setup(self, client, rng):
+        self.login(client, "admin")
+
+    def step(self, client, rng):
+        path = rng.choice(list(self.SORTS))
+        query = {"sort": rng.choice(self.SORTS[path]), "order": rng.choice(["asc", "desc"])}
+        if path == "/all_reservations" and rng.random() < 0.3:
+            query.update({"filter": "vehicle_id", "value": rng.randint(1, self.options.vehicles)})
+        return f"admin:{path[1:]}", client.request("GET", f"{path}?{urllib.parse.urlencode(query)}")[0]
+
+
+class LoginStorm(Scenario):
+    """Many users logging in at once, every login checks a password hash"""
+
+    def step(self, client, rng):
+        status = client.request("POST", "/login", {"username": f"user{rng.randrange(self.options.users)}", "password": "password"})[0]
+        return "login:login", status
+
+
+SCENARIOS = {"browse": Browse, "book": Book, "admin": Admin, "login": LoginStorm}
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(scenario, make_client, options):
+    """Run a scenario on every worker for the duration and return the results per step"""
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    #Every worker is set up before the clock starts
+    ready = threading.Barrier(options.concurrency + 1)
+    started = threading.Event()
+    clock = {}
+
+    def worker(number):
+        rng = random.Random(options.seed * 1000 + number)
+        client = make_client()
+        user = scenario(options)
+        try:
+            user.setup(client, rng)
+        except BaseException:
+            #Don't leave the other workers waiting
+            ready.abort()
+            raise
+        ready.wait()
+        started.wait()
+
+        mine = defaultdict(list)
+        failed = defaultdict(int)
+        while True:
+            start = time.perf_counter()
+            if start >= clock["stop"]:
+                break
+            name, status = user.step(client, rng)
+            if start >= clock["measure"]:
+                mine[name].append(time.perf_counter() - start)
+                if status >= 400 and status != 409 and status != 304:
+                    failed[name] += 1
+
+        with lock:
+            for name, values in mine.items():
+                timings[name].extend(values)
+            for name, count in failed.items():
+                errors[name] += count
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(options.concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    clock["measure"] = time.perf_counter() + options.warmup
+    clock["stop"] = clock["measure"] + options.duration
+    started.set()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for name, values in sorted(timings.items()):
+        values.sort()
+        results[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "throughput": len(values) / options.duration,
+            "p50": percentile(values, 0.50) * 1000,
+            "p95": percentile(values, 0.95) * 1000,
+            "p99": percentile(values, 0.99) * 1000,
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """The steps that got slower than the baseline by more than the tolerance"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95']:.1f}ms -> {result['p95']:.1f}ms")
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']:.0f}/s -> {result['throughput']:.0f}/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app")
+    parser.add_argument("--database", default="bench.db", help="SQLite database made by generate.py, for the in-process app and --server")
+    parser.add_argument("--url", help="run against a server that is already running")
+    parser.add_argument("--server", action="store_true", help="start a threaded WSGI server in this process and go through HTTP")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="can be given more than once, all of them by default")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds before the measurement starts")
+    parser.add_argument("--users", type=int, default=10000, help="how many synthetic users the database has")
+    parser.add_argument("--vehicles", type=int, default=1000, help="how many vehicles the database has")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--baseline", help="compare with this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a step counts as a regression")
+    options = parser.parse_args()
+
+    if options.url:
+        def make_client():
+            return HttpClient(options.url)
+    else:
+        os.chdir(LUXENT)
+        sys.path.insert(0, LUXENT)
+        from app import create_app
+        app = create_app({"DATABASE_URL": "sqlite:///" + os.path.abspath(options.database)})
+
+        if options.server:
+            import logging
+            from werkzeug.serving import make_server
+            #One log line per request would be most of the work
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            server = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{server.server_port}"
+
+            def make_client():
+                return HttpClient(url)
+        else:
+            def make_client():
+                return InProcessClient(app)
+
+    results = {}
+    for name in options.scenario or list(SCENARIOS):
+        results.update(run(SCENARIOS[name], make_client, options))
+
+    print(f"{'step':<28}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<28}{result['requests']:>10}{result['errors']:>8}{result['throughput']:>10.1f}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['p99']:>10.1f}")
+
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(results, json.load(file), options.tolerance)
+        for regression in regressions:
+            print("Regression", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Read throughput of SQLite while a writer inserts bookings, with a rollback journal and with WAL.
+
+Run from the Luxent folder, for example:
+
+    python benchmarks/wal.py --readers 4 --seconds 10
+
+For every mode it fills a temporary database, then runs reader threads that check the
+availability of random cars with availability.is_booked, each on its own connection,
+while one writer thread inserts reservations in transactions of --batch rows. The
+rollback journal mode is the setup before WAL: no PRAGMAs, so a reader waits while the
+writer holds the database and a commit syncs the whole file.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from availability import is_booked
+from database import SQLiteDatabase
+
+INSERT = "INSERT INTO reservations (user_id, vehicle_id, start_date, end_date, reservation_made_date) VALUES (?, ?, ?, ?, ?)"
+
+
+class RollbackJournal(SQLiteDatabase):
+    """SQLiteDatabase without the PRAGMAs, the journal and the sync of a new SQLite database"""
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            self.local.connection = connection
+        return connection
+
+
+def booking(rng, vehicles):
+    start = date(2020, 1, 1) + timedelta(days=rng.randrange(3000))
+    return [rng.randint(1, 1000), rng.randint(1, vehicles), start, start + timedelta(days=rng.randint(1, 14)), start]
+
+
+def fill(db, vehicles, bookings, rng):
+    db.execute("CREATE TABLE reservations (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, vehicle_id INTEGER, start_date DATE, end_date DATE, reservation_made_date DATE)")
+    db.execute("CREATE TABLE contracts (id INTEGER PRIMARY KEY AUTOINCREMENT, vehicle_id INTEGER, start_date DATE, end_date DATE, price_per_day NUMERIC)")
+    db.execute("CREATE TABLE fleet_alerts (vehicle_id INTEGER NOT NULL, kind TEXT NOT NULL, due_date DATE NOT NULL, PRIMARY KEY (vehicle_id, kind))")
+    #The indexes of migrations.py that the overlap check seeks
+    db.execute("CREATE INDEX reservations_vehicle_end ON reservations (vehicle_id, end_date, start_date)")
+    db.execute("CREATE INDEX contracts_vehicle_end ON contracts (vehicle_id, end_date, start_date)")
+    with db.transaction():
+        db.execute_many(INSERT, (booking(rng, vehicles) for _ in range(bookings)))
+
+
+def measure(db, options, seed):
+    """Reads per second, writes per second and the slowest read in milliseconds"""
+    stop = threading.Event()
+    reads = [0] * options.readers
+    slowest = [0.0] * options.readers
+    writes = [0]
+    errors = []
+
+    def reader(number):
+        rng = random.Random(seed + number)
+        try:
+            while not stop.is_set():
+                start = date(2020, 1, 1) + timedelta(days=rng.randrange(3000))
+                began = time.perf_counter()
+                is_booked(db, rng.randint(1, options.vehicles), start, start + timedelta(days=3))
+                slowest[number] = max(slowest[number], time.perf_counter() - began)
+                reads[number] += 1
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    def writer():
+        rng = random.Random(seed)
+        try:
+            while not stop.is_set():
+                with db.transaction():
+                    db.execute_many(INSERT, [booking(rng, options.vehicles) for _ in range(options.batch)])
+                writes[0] += options.batch
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=reader, args=(number,)) for number in range(options.readers)]
+    if options.batch:
+        threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(options.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return sum(reads) / options.seconds, writes[0] / options.seconds, max(slowest) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reads while a writer inserts, rollback journal against WAL")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=500, help="rows per write transaction, 0 for no writer")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--bookings", type=int, default=100000, help="reservations in the database before the test")
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+
+    print(f"{'mode':<18}{'reads/s':>10}{'writes/s':>10}{'slowest read ms':>17}")
+    with tempfile.TemporaryDirectory() as folder:
+        for mode, database in [("rollback journal", RollbackJournal), ("wal", SQLiteDatabase)]:
+            db = database(os.path.join(folder, f"{mode.replace(' ', '_')}.db"))
+            fill(db, options.vehicles, options.bookings, random.Random(options.seed))
+            db.close()
+            reads, writes, slowest = measure(db, options, options.seed)
+            print(f"{mode:<18}{reads:>10.0f}{writes:>10.0f}{slowest:>17.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
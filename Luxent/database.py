@@ -0,0 +1,339 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+
+#Settings applied to every new connection
+PRAGMAS = [
+    #Readers don't wait for the writers and the writers don't wait for the readers
+    "PRAGMA journal_mode = WAL",
+    #Safe with WAL, only the checkpoints wait for the disk
+    "PRAGMA synchronous = NORMAL",
+    #Read the database through a memory map instead of read() calls
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+def connect(url):
+    """Open the database of a URL like sqlite:///luxent.db or postgresql://user@host/luxent"""
+    if url.startswith("sqlite:///"):
+        return SQLiteDatabase(url[len("sqlite:///"):])
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresDatabase(url)
+    raise ValueError(f"Unsupported database URL {url}")
+
+
+def connect_async(url, threads=4):
+    """The database of a URL for the async handlers of asgi.py, open() it in the event loop"""
+    if url.startswith("sqlite:///"):
+        return AsyncSQLiteDatabase(SQLiteDatabase(url[len("sqlite:///"):]), threads)
+    if url.startswith(("postgresql://", "postgres://")):
+        return AsyncPostgresDatabase(url)
+    raise ValueError(f"Unsupported database URL {url}")
+
+
+def parameters(args):
+    #Dates are stored the same way on every backend
+    return [value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime)
+            else value.isoformat() if isinstance(value, date) else value for value in args]
+
+
+def numbers_as_floats(connection):
+    #NUMERIC columns like price_per_day come back as numbers like on SQLite, psycopg makes them
+    #Decimal and the JSON of the API would have them as strings
+    from psycopg.types.numeric import FloatLoader
+    connection.adapters.register_loader("numeric", FloatLoader)
+
+
+async def numbers_as_floats_async(connection):
+    numbers_as_floats(connection)
+
+
+def result(command, cursor, inserted_id):
+    #The same return values as the SQL class from CS50
+    if command == "INSERT":
+        return inserted_id if cursor.rowcount == 1 else None
+    if command in ("UPDATE", "DELETE", "REPLACE"):
+        return cursor.rowcount
+    return True
+
+
+class SQLiteDatabase:
+    """
+    SQLite database with one connection per thread.
+
+    execute() works like the SQL class from CS50: it returns a list of dicts for queries,
+    the new ID for an INSERT (or None if nothing was inserted) and the number of rows
+    changed for an UPDATE or DELETE. Use insert() when the new ID is needed, so the code
+    also works on PostgreSQL.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path, busy_timeout=5.0, retries=5, retry_delay=0.05):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            #Autocommit mode, every statement is its own transaction unless transaction() is used
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                connection.execute(pragma)
+            self.local.connection = connection
+        return connection
+
+    def execute(self, sql, *args):
+        values = parameters(args)
+        connection = self.connection()
+
+        #Retry when another connection holds the write lock for longer than the busy timeout
+        for attempt in range(self.retries + 1):
+            try:
+                cursor = connection.execute(sql, values)
+                if cursor.description is not None:
+                    return [dict(row) for row in cursor.fetchall()]
+                break
+            except sqlite3.OperationalError as error:
+                locked = "locked" in str(error) or "busy" in str(error)
+                if not locked or attempt == self.retries or connection.in_transaction:
+                    raise
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+        command = sql.lstrip().split(None, 1)[0].upper()
+        return result(command, cursor, cursor.lastrowid)
+
+    def insert(self, sql, *args):
+        """Run an INSERT of one row, returns its new ID or None if nothing was inserted"""
+        return self.execute(sql, *args)
+
+    def execute_many(self, sql, rows):
+        """Run one INSERT, UPDATE or DELETE for every row of parameters, returns the number of rows changed"""
+        cursor = self.connection().executemany(sql, [parameters(row) for row in rows])
+        return cursor.rowcount
+
+    def iterate(self, sql, *args, chunk_size=1000):
+        """Yield the rows of a query as dicts, read from the cursor a chunk at a time instead of all at once"""
+        cursor = self.connection().execute(sql, parameters(args))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """Run several statements in one write transaction"""
+        connection = self.connection()
+        self.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def lock_row(self, table, row_id):
+        #BEGIN IMMEDIATE already lets a single writer in
+        pass
+
+    def days_between(self, start, end):
+        """SQL expression for the number of days between two date columns"""
+        return f"CAST(julianday({end}) - julianday({start}) AS INTEGER)"
+
+    def open(self):
+        """Open the connection of this thread now instead of on the first query"""
+        self.connection()
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+class PostgresDatabase:
+    """
+    PostgreSQL database behind a connection pool, so several app nodes can share it.
+
+    It has the same methods as SQLiteDatabase. Queries use ? placeholders like everywhere
+    else in the app and psycopg prepares the statements that are run often on each connection.
+    PostgreSQL only gives the new ID of a row with RETURNING, so execute() returns the number
+    of rows inserted for an INSERT and insert() asks for the ID.
+    """
+
+    dialect = "postgresql"
+
+    def __init__(self, url, min_size=1, max_size=10):
+        #Only needed when the app runs on PostgreSQL
+        try:
+            from psycopg.rows import dict_row
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise RuntimeError("PostgreSQL needs the psycopg and psycopg_pool packages")
+
+        self.make_pool = lambda: ConnectionPool(url, min_size=min_size, max_size=max_size, open=True, configure=numbers_as_floats,
+                                                kwargs={"autocommit": True, "row_factory": dict_row, "prepare_threshold": 2})
+        self.pool = self.make_pool()
+        self.local = threading.local()
+
+    def run(self, connection, sql, values):
+        command = sql.lstrip().split(None, 1)[0].upper()
+        sql = sql.replace("%", "%%").replace("?", "%s")
+
+        cursor = connection.execute(sql, values)
+        if cursor.description is not None:
+            return cursor.fetchall()
+        if command == "INSERT":
+            return cursor.rowcount
+        return result(command, cursor, None)
+
+    def execute(self, sql, *args):
+        values = parameters(args)
+
+        #Use the connection of the open transaction, if there is one
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            return self.run(connection, sql, values)
+        with self.pool.connection() as connection:
+            return self.run(connection, sql, values)
+
+    def insert(self, sql, *args):
+        """Run an INSERT of one row, returns its new ID or None if nothing was inserted"""
+        rows = self.execute(sql + " RETURNING id", *args)
+        return rows[0]["id"] if rows else None
+
+    def execute_many(self, sql, rows):
+        """Run one INSERT, UPDATE or DELETE for every row of parameters, returns the number of rows changed"""
+        sql = sql.replace("%", "%%").replace("?", "%s")
+        values = [parameters(row) for row in rows]
+
+        def run(connection):
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, values)
+                return cursor.rowcount
+
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            return run(connection)
+        with self.pool.connection() as connection:
+            return run(connection)
+
+    def iterate(self, sql, *args, chunk_size=1000):
+        """Yield the rows of a query as dicts, read from a server side cursor a chunk at a time"""
+        sql = sql.replace("%", "%%").replace("?", "%s")
+        values = parameters(args)
+
+        def rows(connection):
+            #A server side cursor only lives in a transaction, in an open one it is a savepoint
+            with connection.transaction():
+                with connection.cursor(name="luxent_rows") as cursor:
+                    cursor.itersize = chunk_size
+                    cursor.execute(sql, values)
+                    yield from cursor
+
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            yield from rows(connection)
+            return
+        #The connection stays out of the pool until every row was read
+        with self.pool.connection() as connection:
+            yield from rows(connection)
+
+    @contextmanager
+    def transaction(self):
+        """Run several statements in one transaction on the same pooled connection"""
+        with self.pool.connection() as connection:
+            with connection.transaction():
+                self.local.connection = connection
+                try:
+                    yield self
+                finally:
+                    self.local.connection = None
+
+    def lock_row(self, table, row_id):
+        #Other transactions that lock the same row wait until this one ends
+        self.execute(f"SELECT id FROM {table} WHERE id = ? FOR UPDATE", row_id)
+
+    def days_between(self, start, end):
+        """SQL expression for the number of days between two date columns"""
+        return f"({end} - {start})"
+
+    def open(self):
+        """Start a new pool after close(), a worker forked from the master can't use its connections"""
+        if self.pool.closed:
+            self.pool = self.make_pool()
+        self.pool.wait()
+
+    def close(self):
+        self.pool.close()
+
+
+class AsyncSQLiteDatabase:
+    """
+    SQLite for the async handlers, execute() is awaited and gives the same results.
+
+    SQLite has no asynchronous interface, so the queries run on a few threads of their own,
+    each with its connection, and the event loop only waits for them. The async handlers
+    only read, the writes stay on the Flask app.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, db, threads=4):
+        self.db = db
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="sqlite")
+
+    async def execute(self, sql, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.db.execute, sql, *args)
+
+    async def open(self):
+        #Start the threads and open their connections now instead of on the first queries
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, self.db.open) for _ in range(self.threads)])
+
+    async def close(self):
+        self.executor.shutdown()
+
+
+class AsyncPostgresDatabase:
+    """PostgreSQL for the async handlers, on the asynchronous pool of psycopg"""
+
+    dialect = "postgresql"
+
+    def __init__(self, url, min_size=1, max_size=10):
+        try:
+            from psycopg.rows import dict_row
+            from psycopg_pool import AsyncConnectionPool
+        except ImportError:
+            raise RuntimeError("PostgreSQL needs the psycopg and psycopg_pool packages")
+
+        #The pool belongs to an event loop, so it is opened by open()
+        self.pool = AsyncConnectionPool(url, min_size=min_size, max_size=max_size, open=False, configure=numbers_as_floats_async,
+                                        kwargs={"autocommit": True, "row_factory": dict_row, "prepare_threshold": 2})
+
+    async def execute(self, sql, *args):
+        sql = sql.replace("%", "%%").replace("?", "%s")
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute(sql, parameters(args))
+            return await cursor.fetchall() if cursor.description is not None else cursor.rowcount
+
+    async def open(self):
+        await self.pool.open(wait=True)
+
+    async def close(self):
+        await self.pool.close()
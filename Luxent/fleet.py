@@ -0,0 +1,61 @@
+#Fleet alerts for the vehicles whose insurance expires or whose maintenance is due, built by a background job
+
+from datetime import date, timedelta
+
+from versions import bump
+
+#The date column of the vehicles behind every kind of alert, each one has an index from migrations.py
+KINDS = {"insurance": "insurance_expiration_date", "maintenance": "maintenance_need_date"}
+
+#How many days ahead a vehicle gets an alert
+ALERT_DAYS = 30
+
+
+def scan_fleet(db, days=ALERT_DAYS, today=None):
+    """
+    Rebuild the fleet_alerts table from the vehicles that are due in the next days.
+
+    Every kind is one range on its indexed date column, so only the vehicles that are due
+    are read. An alert also counts the bookings that end after its date. The table is only
+    rewritten when the alerts changed. Returns the number of alerts.
+    """
+    today = today or date.today()
+    horizon = (today + timedelta(days=days)).isoformat()
+
+    alerts = {}
+    for kind, column in KINDS.items():
+        for row in db.execute(f"SELECT id, {column} AS due_date FROM vehicles WHERE {column} < ?", horizon):
+            alerts[(row["id"], kind)] = str(row["due_date"])
+
+    rows = []
+    for (vehicle_id, kind), due_date in sorted(alerts.items()):
+        #Seeks the (vehicle_id, end_date) indexes, the bookings of a car that end before the date aren't read
+        bookings = db.execute("SELECT (SELECT COUNT(*) FROM reservations WHERE vehicle_id = ? AND end_date > ?) + (SELECT COUNT(*) FROM contracts WHERE vehicle_id = ? AND end_date > ?) AS count",
+                              vehicle_id, due_date, vehicle_id, due_date)[0]["count"]
+        rows.append((vehicle_id, kind, due_date, bookings))
+
+    with db.transaction():
+        saved = db.execute("SELECT vehicle_id, kind, due_date, bookings FROM fleet_alerts ORDER BY vehicle_id, kind")
+        if [(row["vehicle_id"], row["kind"], str(row["due_date"]), row["bookings"]) for row in saved] != rows:
+            db.execute("DELETE FROM fleet_alerts")
+            if rows:
+                db.execute_many("INSERT INTO fleet_alerts (vehicle_id, kind, due_date, bookings) VALUES (?, ?, ?, ?)", rows)
+            #The vehicles that are free change with the alerts
+            bump(db, "fleet_alerts")
+    return len(rows)
+
+
+def fleet_summary(db, today=None):
+    """The saved alerts with their vehicles and the counts per kind, without scanning the vehicles"""
+    today = (today or date.today()).isoformat()
+    alerts = db.execute("""
+        SELECT a.vehicle_id, a.kind, a.due_date, a.bookings, v.make, v.model
+        FROM fleet_alerts a
+        JOIN vehicles v ON v.id = a.vehicle_id
+        ORDER BY a.due_date, a.vehicle_id
+    """)
+    counts = {kind: {"overdue": 0, "due": 0} for kind in KINDS}
+    for alert in alerts:
+        alert["overdue"] = str(alert["due_date"]) < today
+        counts[alert["kind"]]["overdue" if alert["overdue"] else "due"] += 1
+    return alerts, counts
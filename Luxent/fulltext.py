@@ -0,0 +1,184 @@
+#Full-text lookup of the people in the reservations, the contracts and the customers
+
+import re
+from difflib import SequenceMatcher
+
+from archive import ARCHIVES
+
+#The columns of the index and the ones every table fills, the others are left empty
+COLUMNS = ["first_name", "last_name", "phone_number", "contract_number", "email"]
+SOURCES = {
+    "reservations": ["first_name", "last_name", "phone_number"],
+    "contracts": ["first_name", "last_name", "phone_number", "contract_number"],
+    "customers": ["first_name", "last_name", "email"],
+}
+#A row of the index is id * 3 + the position of its table, so it points back to its row
+KINDS = list(SOURCES)
+
+#The names count more than the phone numbers, the contract numbers and the emails in the ranking
+WEIGHTS = [10.0, 10.0, 4.0, 4.0, 2.0]
+
+#What a result shows and the page it links to
+FIELDS = {
+    "reservations": "id, user_id, first_name, last_name, phone_number, NULL AS contract_number, NULL AS email, vehicle_id, start_date, end_date",
+    "contracts": "id, NULL AS user_id, first_name, last_name, phone_number, contract_number, NULL AS email, vehicle_id, start_date, end_date",
+    "customers": "id, user_id, first_name, last_name, NULL AS phone_number, NULL AS contract_number, email, NULL AS vehicle_id, NULL AS start_date, NULL AS end_date",
+}
+LINKS = {
+    "reservations": "/all_reservations?filter=id&value={id}",
+    "contracts": "/contracts?filter=id&value={id}",
+    "customers": "/all_reservations?filter=user_id&value={user_id}",
+}
+#The archived bookings are found too, their links ask for the history
+HISTORY = "&history=1"
+
+#How close a word of the index has to be to a misspelled word of the search
+FUZZY_RATIO = 0.75
+FUZZY_TERMS = 5
+
+
+def digits(expression):
+    #The phone numbers are also indexed without their separators, so 0123456 finds 0123-456-789
+    for separator in ["-", " ", ".", "(", ")", "+", "/"]:
+        expression = f"replace({expression}, '{separator}', '')"
+    return expression
+
+
+def index_values(source, row):
+    """SQL expressions of the index columns for a row of a table, row is new or old in a trigger"""
+    values = []
+    for column in COLUMNS:
+        if column not in SOURCES[source]:
+            values.append("NULL")
+        elif column == "phone_number":
+            values.append(f"{row}.phone_number || ' ' || {digits(row + '.phone_number')}")
+        else:
+            values.append(f"{row}.{column}")
+    return ", ".join(values)
+
+
+def create_search_index(db):
+    """
+    Create the index and the triggers that keep it up to date, and fill it.
+
+    On SQLite it is a contentless FTS5 table with prefix indexes, so it only stores the
+    words and not a second copy of the rows. On PostgreSQL it is a GIN index on the
+    tsvector of every table.
+    """
+    if db.dialect == "postgresql":
+        for source, columns in SOURCES.items():
+            db.execute(f"CREATE INDEX IF NOT EXISTS {source}_search ON {source} USING GIN (to_tsvector('simple', {document(columns)}))")
+        return
+
+    names = ", ".join(COLUMNS)
+    db.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5({names}, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2')")
+    #The words of the index, for the fuzzy matching
+    db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_terms USING fts5vocab(search_index, 'col')")
+
+    for position, source in enumerate(SOURCES):
+        index_table(db, source, source, position)
+    db.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+
+
+def index_table(db, table, source, position):
+    """The triggers that keep the rows of a table in the index, and the rows it already has"""
+    names = ", ".join(COLUMNS)
+    insert = f"INSERT INTO search_index (rowid, {names}) VALUES (new.id * 3 + {position}, {index_values(source, 'new')})"
+    #A contentless index forgets a row when it gets the values it was indexed with
+    delete = f"INSERT INTO search_index (search_index, rowid, {names}) VALUES ('delete', old.id * 3 + {position}, {index_values(source, 'old')})"
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN {insert}; END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN {delete}; END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {', '.join(SOURCES[source])} ON {table} BEGIN {delete}; {insert}; END")
+    db.execute(f"INSERT INTO search_index (rowid, {names}) SELECT id * 3 + {position}, {index_values(source, table)} FROM {table}")
+
+
+def index_archives(db):
+    """
+    Index the archive tables like their live tables.
+
+    An archived row keeps its ID and so its row of the index, the live table's trigger
+    takes it out and the archive's trigger puts it back.
+    """
+    for source, archive in ARCHIVES.items():
+        if db.dialect == "postgresql":
+            db.execute(f"CREATE INDEX IF NOT EXISTS {archive}_search ON {archive} USING GIN (to_tsvector('simple', {document(SOURCES[source])}))")
+        else:
+            index_table(db, archive, source, KINDS.index(source))
+
+
+def document(columns):
+    return " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+
+
+def words(text):
+    """The words of a search, lowercase and without the characters the query syntax uses"""
+    return re.findall(r"\w+", text.lower())[:8]
+
+
+def close_terms(db, word):
+    """The words of the names in the index that look like a misspelled word"""
+    if len(word) < 4 or word.isdigit():
+        return []
+    #Only the words with the same first two letters are compared, a range of the index
+    start = word[:2]
+    end = start[:-1] + chr(ord(start[-1]) + 1)
+    rows = db.execute("SELECT DISTINCT term FROM search_terms WHERE term >= ? AND term < ? AND col IN ('first_name', 'last_name')", start, end)
+    scored = [(SequenceMatcher(None, word, row["term"]).ratio(), row["term"]) for row in rows if abs(len(row["term"]) - len(word)) <= 2]
+    return [term for ratio, term in sorted(scored, reverse=True)[:FUZZY_TERMS] if ratio >= FUZZY_RATIO]
+
+
+def ranked_sqlite(db, terms, limit):
+    #Every word has to match, as a prefix or as one of its close words
+    query = " AND ".join("(" + " OR ".join(f'"{term}"' + ("*" if i == 0 else "") for i, term in enumerate(options)) + ")" for options in terms)
+    rows = db.execute(f"SELECT rowid, bm25(search_index, {', '.join(map(str, WEIGHTS))}) AS score FROM search_index WHERE search_index MATCH ? ORDER BY score LIMIT ?", query, limit)
+    return [(KINDS[row["rowid"] % 3], row["rowid"] // 3) for row in rows]
+
+
+def ranked_postgres(db, terms, limit):
+    query = " & ".join("(" + " | ".join(f"{term}:*" if i == 0 else term for i, term in enumerate(options)) + ")" for options in terms)
+    found = []
+    for table, source in [(source, source) for source in SOURCES] + [(archive, source) for source, archive in ARCHIVES.items()]:
+        vector = f"to_tsvector('simple', {document(SOURCES[source])})"
+        for row in db.execute(f"SELECT id, ts_rank({vector}, to_tsquery('simple', ?)) AS score FROM {table} WHERE {vector} @@ to_tsquery('simple', ?) ORDER BY score DESC LIMIT ?",
+                              query, query, limit):
+            found.append((row["score"], source, row["id"]))
+    return [(source, id) for score, source, id in sorted(found, key=lambda result: -result[0])[:limit]]
+
+
+def search_people(db, text, limit=50, fuzzy=True):
+    """
+    The reservations, contracts and customers that match every word of text, best first.
+
+    A word matches the start of a first name, last name, phone number, contract number or
+    email. When nothing matches and fuzzy is on, the misspelled names are tried again with
+    the closest names of the index.
+    """
+    found_words = words(text)
+    if not found_words:
+        return []
+    ranked = ranked_postgres if db.dialect == "postgresql" else ranked_sqlite
+
+    results = ranked(db, [[word] for word in found_words], limit)
+    if not results and fuzzy and db.dialect != "postgresql":
+        results = ranked(db, [[word] + close_terms(db, word) for word in found_words], limit)
+
+    #The rows of the results, one query per table, the bookings that aren't live are in the archive
+    rows = {}
+    for source in SOURCES:
+        ids = [id for kind, id in results if kind == source]
+        for table in [source, ARCHIVES.get(source)]:
+            if not ids or table is None:
+                continue
+            for row in db.execute(f"SELECT {FIELDS[source]} FROM {table} WHERE id IN ({', '.join(['?'] * len(ids))})", *ids):
+                row["archived"] = table != source
+                rows[(source, row["id"])] = row
+            ids = [id for id in ids if (source, id) not in rows]
+
+    people = []
+    for source, id in results:
+        row = rows.get((source, id))
+        if row is not None:
+            row["kind"] = source
+            row["link"] = LINKS[source].format(**row) + (HISTORY if row["archived"] else "")
+            people.append(row)
+    return people
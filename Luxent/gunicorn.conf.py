@@ -0,0 +1,39 @@
+#Settings of the production server, start it with "gunicorn" in this folder.
+#kill -HUP the master restarts the workers one by one, the README tells how to load new code
+
+import os
+
+from server import after_fork, before_fork, shutdown, warm
+
+#The app is made once in the master and the workers are forked from it
+wsgi_app = "app:create_app({'PREFORK': True})"
+preload_app = True
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1))
+#Threads per worker, they mostly wait on the database and the password hashing
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 8))
+#How long a worker gets to finish its requests on a reload or a shutdown
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+timeout = 60
+keepalive = 5
+
+#There is already a worker per CPU, so one hashing process each is enough
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "1")
+
+
+def when_ready(server):
+    warm(server.app.wsgi())
+
+
+def pre_fork(server, worker):
+    before_fork(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    after_fork(server.app.wsgi())
+
+
+def worker_exit(server, worker):
+    shutdown(server.app.wsgi())
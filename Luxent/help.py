@@ -1,3 +1,6 @@
+import threading
+import time
+from collections import OrderedDict
 from flask import redirect, session
 from functools import wraps
 
@@ -16,3 +19,181 @@ def login_required(f):
         return f(*args, **kwargs)
 
     return decorated_function
+
+
+#The identity cache
+class IdentityCache:
+    """
+    Remember the role of every logged in user so it isn't queried on every request.
+
+    An entry is a dict with the "is_admin" and "is_customer" flags of the user. Every worker
+    has its own cache, so a change made by another worker is seen through version, a function
+    that gives the users counter of table_versions: it is read at most every check seconds
+    and when it moved every entry is dropped. An entry also expires after ttl seconds.
+    """
+
+    def __init__(self, version=None, max_size=10000, ttl=60, check=5):
+        self.version = version
+        self.max_size = max_size
+        self.ttl = ttl
+        self.check = check
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.seen = None
+        self.checked = None
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self):
+        """Drop every entry if the users changed since the last check"""
+        if self.version is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if self.checked is not None and now - self.checked < self.check:
+                return
+            self.checked = now
+
+        version = self.version()
+        with self.lock:
+            if version != self.seen:
+                self.entries.clear()
+                self.seen = version
+
+    def get(self, user_id):
+        self.refresh()
+        with self.lock:
+            #Count every lookup so the hit rate can be reported
+            entry = self.entries.get(user_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self.entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, identity):
+        with self.lock:
+            #Drop the oldest entry when the cache is full
+            if user_id not in self.entries and len(self.entries) >= self.max_size:
+                del self.entries[next(iter(self.entries))]
+            self.entries[user_id] = (identity, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "hit_rate": self.hit_rate()}
+
+
+#The catalog cache
+class CatalogCache:
+    """
+    Keep the engine, color and car type tables in memory, they almost never change.
+
+    The app has no form that changes them, they are read once per process. After changing
+    them in the database, restart the app or reload the workers. Every load() bumps the
+    version, so the cached pages made from an older catalog aren't used.
+    """
+
+    #Table name and the column with its name
+    TABLES = {"engine": "engine_type", "color": "color_name", "car_type": "car_type"}
+
+    def __init__(self, db):
+        self.db = db
+        self.version = 0
+        self.tables = None
+        self.ids = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        tables = {}
+        for table, column in self.TABLES.items():
+            tables[table] = self.db.execute(f"SELECT id, {column} FROM {table} ORDER BY id")
+
+        #Replace everything at once so readers never see a half loaded catalog
+        self.ids = {table: {row["id"] for row in rows} for table, rows in tables.items()}
+        self.tables = tables
+        self.version += 1
+
+    def rows(self, table):
+        if self.tables is None:
+            self.misses += 1
+            self.load()
+        else:
+            self.hits += 1
+        return self.tables[table]
+
+    def has_id(self, table, row_id):
+        self.rows(table)
+        return int(row_id) in self.ids[table]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "version": self.version}
+
+
+#The render cache
+class RenderCache:
+    """
+    Keep rendered pages in memory, least recently used first out.
+
+    The key says which template, for which role and for which version of the data,
+    so a page is never served for data that changed since it was rendered.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = html
+            self.size += len(html)
+
+            #Drop the least recently used pages until it fits under the cap
+            while self.size > self.max_bytes and self.entries:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+
+    def invalidate(self, template):
+        """Drop every cached page of a template"""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == template]:
+                self.size -= len(self.entries.pop(key))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.size}
+
+
+#Tables whose rows can be checked by ID
+ID_TABLES = {"vehicles", "reservations", "contracts", "engine", "color", "car_type"}
+
+def row_exists(db, table, row_id):
+    """Check if a row exists with a single primary key lookup"""
+    if table not in ID_TABLES:
+        raise ValueError(f"Unknown table {table}")
+
+    rows = db.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE id = ?) AS found", int(row_id))
+    return bool(rows[0]["found"])
@@ -0,0 +1,85 @@
+#Background jobs that run on a schedule, outside of the requests
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Run jobs every few seconds in a background thread, with their state in the jobs table.
+
+    A worker claims a job that is due with one conditional UPDATE, so when several workers
+    or app nodes share the database only one of them runs it. The claim is a lease, if the
+    worker dies the job can be claimed again once the lease is over.
+    """
+
+    def __init__(self, db, poll=30, lease=600):
+        self.db = db
+        self.poll = poll
+        self.lease = lease
+        self.jobs = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, name, interval, function):
+        """Run function every interval seconds, the first time as soon as the scheduler starts"""
+        self.jobs[name] = (interval, function)
+        #Kept if it is already there, so a restart doesn't change when the job runs next
+        self.db.execute("INSERT INTO jobs (name, interval_seconds, next_run_at) SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE name = ?)",
+                        name, interval, datetime.now(), name)
+        self.db.execute("UPDATE jobs SET interval_seconds = ? WHERE name = ?", interval, name)
+
+    def wake(self, name):
+        """Run a job on the next pass instead of waiting for its interval, without running it here"""
+        self.db.execute("UPDATE jobs SET next_run_at = ? WHERE name = ?", datetime.now(), name)
+        self.wakeup.set()
+
+    def claim(self, name, now):
+        #Only one worker changes the row, the others see 0 rows changed. While it runs the job is
+        #next due when the lease ends, so a wake() meanwhile shows as an earlier next_run_at
+        lease = now + timedelta(seconds=self.lease)
+        return self.db.execute("UPDATE jobs SET locked_until = ?, next_run_at = ?, last_started_at = ? WHERE name = ? AND next_run_at <= ? AND (locked_until IS NULL OR locked_until < ?)",
+                               lease, lease, now, name, now, now) == 1
+
+    def run(self, name):
+        """Run a job now in this thread and save how it went, returns the result of the job"""
+        interval, function = self.jobs[name]
+        status, error, result = "ok", None, None
+        try:
+            result = function()
+        except Exception as e:
+            status, error = "error", str(e)
+            logger.exception("Error running the %s job", name)
+
+        finished = datetime.now()
+        #A wake() during the run is kept, the job may have read the rows before they changed
+        self.db.execute("UPDATE jobs SET locked_until = NULL, last_finished_at = ?, last_status = ?, last_error = ?, runs = runs + 1, "
+                        "next_run_at = CASE WHEN locked_until IS NULL OR next_run_at = locked_until THEN ? ELSE next_run_at END WHERE name = ?",
+                        finished, status, error, finished + timedelta(seconds=interval), name)
+        return result
+
+    def run_due(self):
+        """Run the jobs that are due and that no other worker is running"""
+        for name in self.jobs:
+            if self.claim(name, datetime.now()):
+                self.run(name)
+
+    def start(self):
+        def loop():
+            while True:
+                try:
+                    self.run_due()
+                except Exception:
+                    logger.exception("Error checking the jobs")
+                self.wakeup.wait(self.poll)
+                self.wakeup.clear()
+
+        self.thread = threading.Thread(target=loop, name="scheduler", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def status(self):
+        return self.db.execute("SELECT name, interval_seconds, next_run_at, last_started_at, last_finished_at, last_status, last_error, runs FROM jobs ORDER BY name")
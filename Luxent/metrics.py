@@ -0,0 +1,255 @@
+#Request, query and template timings, shown in the Prometheus text format
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import before_render_template, g, request, template_rendered
+
+#Upper bounds of the histogram buckets, in seconds and in queries
+SECONDS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERIES = [1, 2, 5, 10, 20, 50, 100, 500]
+
+#Statements past this many get counted together, so a query built with many IDs can't grow the metrics forever
+MAX_STATEMENTS = 500
+
+
+class Histogram:
+    """Counts of observations per bucket and label values, like a Prometheus histogram"""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.series.get(labels)
+            if counts is None:
+                #One count per bucket, then the sum and the total count
+                counts = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def __len__(self):
+        return len(self.series)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, counts in series:
+            names = ",".join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, labels))
+            prefix = names + "," if names else ""
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {counts[-1]}')
+            lines.append(f"{self.name}_sum{{{names}}} {counts[-2]}")
+            lines.append(f"{self.name}_count{{{names}}} {counts[-1]}")
+        return "\n".join(lines)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def statement(sql):
+    """One line version of a query, with the lists of placeholders folded so they count as one statement"""
+    sql = " ".join(sql.split())
+    return re.sub(r"\?(, \?)+", "?, ...", sql)
+
+
+class InstrumentedDatabase:
+    """Time every statement of a database and count the statements of the current request"""
+
+    def __init__(self, db, metrics):
+        self.db = db
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def timed(self, method, sql, *args):
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            self.metrics.query(sql, time.perf_counter() - start)
+
+    def execute(self, sql, *args):
+        return self.timed(self.db.execute, sql, *args)
+
+    def insert(self, sql, *args):
+        return self.timed(self.db.insert, sql, *args)
+
+    def execute_many(self, sql, rows):
+        return self.timed(self.db.execute_many, sql, rows)
+
+    def iterate(self, sql, *args, **kwargs):
+        #Timed until the last row was read
+        start = time.perf_counter()
+        try:
+            yield from self.db.iterate(sql, *args, **kwargs)
+        finally:
+            self.metrics.query(sql, time.perf_counter() - start)
+
+
+class AsyncInstrumentedDatabase:
+    """The same for the async database of asgi.py"""
+
+    def __init__(self, db, metrics):
+        self.db = db
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    async def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return await self.db.execute(sql, *args)
+        finally:
+            self.metrics.query(sql, time.perf_counter() - start)
+
+
+class Profiler:
+    """
+    Sample the stacks of the threads that are answering a request.
+
+    One background thread looks at every running request every interval seconds. When a
+    request took longer than threshold seconds, its stacks are written to the folder in
+    the folded format ("a;b;c count") that flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, folder, threshold, interval=0.005):
+        self.folder = folder
+        self.threshold = threshold
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.running = {}
+        self.pid = None
+        os.makedirs(folder, exist_ok=True)
+
+    def sample(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.running.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[fold(frame)] += 1
+
+    def start(self):
+        with self.lock:
+            #The sampling thread starts with the first request, again in a worker forked after that
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self.sample, name="profiler", daemon=True).start()
+            self.running[threading.get_ident()] = Counter()
+
+    def stop(self, name, duration):
+        with self.lock:
+            stacks = self.running.pop(threading.get_ident(), None)
+        if not stacks or duration < self.threshold:
+            return None
+
+        path = os.path.join(self.folder, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{name}.folded")
+        with open(path, "w") as file:
+            for stack, count in stacks.items():
+                file.write(f"{stack} {count}\n")
+        return path
+
+
+def fold(frame):
+    #Outermost function first, like the folded stacks of perf
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Metrics:
+    """
+    Record how long every route, query and template takes.
+
+    instrument() wraps the database so every statement is timed, render() gives all the
+    histograms in the Prometheus text format. With PROFILE_SLOW_MS set, the requests slower
+    than that are sampled and saved to PROFILE_FOLDER as folded stacks.
+    """
+
+    def __init__(self, app):
+        self.requests = Histogram("luxent_request_duration_seconds", "Time to answer a request", ["endpoint", "method", "status"], SECONDS)
+        self.request_queries = Histogram("luxent_request_queries", "Statements run by a request", ["endpoint"], QUERIES)
+        self.queries = Histogram("luxent_query_duration_seconds", "Time to run a statement", ["statement"], SECONDS)
+        self.templates = Histogram("luxent_template_render_seconds", "Time to render a template", ["template"], SECONDS)
+        self.local = threading.local()
+        #Statements of the current request, per thread or per task of the async handlers. A list,
+        #so the queries of the tasks an async handler starts count for it too
+        self.request_statements = ContextVar("request_statements", default=None)
+
+        self.profiler = None
+        if app.config.get("PROFILE_SLOW_MS"):
+            self.profiler = Profiler(app.config.get("PROFILE_FOLDER", "profiles"), app.config["PROFILE_SLOW_MS"] / 1000)
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        before_render_template.connect(self.before_render, app)
+        template_rendered.connect(self.rendered, app)
+
+    def instrument(self, db):
+        return InstrumentedDatabase(db, self)
+
+    def instrument_async(self, db):
+        return AsyncInstrumentedDatabase(db, self)
+
+    def query(self, sql, duration):
+        #Counted for the current request, if there is one
+        statements = self.request_statements.get()
+        if statements is not None:
+            statements[0] += 1
+
+        key = statement(sql)
+        if len(self.queries) >= MAX_STATEMENTS and (key,) not in self.queries.series:
+            key = "other"
+        self.queries.observe(duration, key)
+
+    def before_request(self):
+        g.metrics_start = time.perf_counter()
+        self.request_statements.set([0])
+        if self.profiler:
+            self.profiler.start()
+
+    def after_request(self, response):
+        duration = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or "none"
+        self.requests.observe(duration, endpoint, request.method, str(response.status_code))
+        self.request_queries.observe((self.request_statements.get() or [0])[0], endpoint)
+        self.request_statements.set(None)
+        if self.profiler:
+            self.profiler.stop(endpoint, duration)
+        return response
+
+    def before_render(self, app, template, context):
+        self.local.render_start = time.perf_counter()
+
+    def rendered(self, app, template, context):
+        start = getattr(self.local, "render_start", None)
+        if start is not None:
+            self.templates.observe(time.perf_counter() - start, template.name)
+            self.local.render_start = None
+
+    def render(self):
+        return "\n".join(histogram.render() for histogram in [self.requests, self.request_queries, self.queries, self.templates]) + "\n"
@@ -0,0 +1,239 @@
+#Versioned changes to the schema, applied in order at startup or with "flask --app app migrate"
+
+import logging
+from datetime import datetime
+
+from archive import create_archives
+from fulltext import create_search_index, index_archives
+from reports import rebuild as rebuild_reports
+
+logger = logging.getLogger(__name__)
+
+
+class Index:
+    """
+    An index a migration creates.
+
+    SQLite builds it inside the migration, the readers keep going in WAL mode. PostgreSQL
+    builds it CONCURRENTLY outside of a transaction, so the writes to the table aren't blocked.
+    """
+
+    def __init__(self, name, table, columns, unique=False):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+
+    def sql(self, concurrently=False):
+        return (f"CREATE {'UNIQUE ' if self.unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS "
+                f"{self.name} ON {self.table} ({', '.join(self.columns)})")
+
+
+def keep_first(table, column):
+    """Delete the rows that repeat a value of the column, keeping the oldest one"""
+    def step(db):
+        db.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {column})")
+    return step
+
+
+def no_duplicates(table, column):
+    """Stop the migration if a value is used twice, these can't be fixed by deleting rows"""
+    def step(db):
+        rows = db.execute(f"SELECT {column} FROM {table} GROUP BY {column} HAVING COUNT(*) > 1")
+        if rows:
+            values = ", ".join(str(row[column]) for row in rows[:20])
+            raise RuntimeError(f"Change the repeated {column} values in {table} before migrating: {values}")
+    return step
+
+
+#Formats the old rows were saved in, tried in order
+DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f",
+                "%Y/%m/%d", "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y"]
+DATE_COLUMNS = {
+    "vehicles": {"insurance_expiration_date": "date", "maintenance_need_date": "date"},
+    "reservations": {"start_date": "date", "end_date": "date", "reservation_made_date": "datetime"},
+    "contracts": {"start_date": "date", "end_date": "date", "contract_made_date": "datetime"},
+}
+#What the dates look like once they are normalized, so they compare and sort as text
+CANONICAL = {"date": "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]",
+             "datetime": "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]"}
+
+
+def parse_date(value):
+    for format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), format)
+        except ValueError:
+            pass
+    return None
+
+
+def normalize_dates(db):
+    """Rewrite the dates saved as free text to YYYY-MM-DD, and the made dates to YYYY-MM-DD HH:MM:SS"""
+    #PostgreSQL has real date columns
+    if db.dialect != "sqlite":
+        return
+
+    for table, columns in DATE_COLUMNS.items():
+        for column, kind in columns.items():
+            #Only the rows that aren't in the right format yet are read
+            rows = db.execute(f"SELECT id, {column} AS value FROM {table} WHERE {column} IS NOT NULL AND {column} NOT GLOB ?", CANONICAL[kind])
+            for row in rows:
+                parsed = parse_date(str(row["value"]))
+                if parsed is None:
+                    logger.warning("Can't read the %s of %s %s: %r", column, table, row["id"], row["value"])
+                    continue
+                value = parsed.date().isoformat() if kind == "date" else parsed.strftime("%Y-%m-%d %H:%M:%S")
+                db.execute(f"UPDATE {table} SET {column} = ? WHERE id = ?", value, row["id"])
+
+
+def integer_contract_vehicles(db):
+    """
+    Rebuild the contracts table with an INTEGER vehicle_id.
+
+    The column was made without a type, so comparing it with vehicles.id converts it and
+    SQLite can't seek the index on it, the overlap check walked every vehicle of the index.
+    """
+    if db.dialect != "sqlite":
+        return
+    columns = {row["name"]: row["type"] for row in db.execute("PRAGMA table_info(contracts)")}
+    if columns.get("vehicle_id", "").upper() == "INTEGER":
+        return
+
+    names = "id, first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_number, contract_made_date, price_per_day"
+    db.execute("CREATE TABLE contracts_new (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT, last_name TEXT, phone_number TEXT, vehicle_id INTEGER REFERENCES vehicles(id), "
+               "start_date DATE, end_date DATE, contract_number TEXT, contract_made_date DATE, price_per_day NUMERIC)")
+    db.execute(f"INSERT INTO contracts_new ({names}) SELECT {names} FROM contracts")
+    db.execute("DROP TABLE contracts")
+    db.execute("ALTER TABLE contracts_new RENAME TO contracts")
+    #The indexes went with the old table
+    db.execute(Index("contracts_contract_number", "contracts", ["contract_number"], unique=True).sql())
+    db.execute(Index("contracts_vehicle_end", "contracts", ["vehicle_id", "end_date", "start_date"]).sql())
+
+
+def create_versions(db):
+    db.execute("CREATE TABLE IF NOT EXISTS table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    for table in ["vehicles", "reservations", "contracts"]:
+        db.execute("INSERT INTO table_versions (name) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE name = ?)", table, table)
+
+
+def version_row(table):
+    """Add the change counter of a table that came later"""
+    def step(db):
+        db.execute("INSERT INTO table_versions (name) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE name = ?)", table, table)
+    return step
+
+
+def live_reports(db):
+    #The archive tables only come with migration 9
+    rebuild_reports(db, archived=False)
+
+
+#Version, name and steps. A step is an Index, SQL or a function of the database.
+#Never change a migration that was released, add a new one
+MIGRATIONS = [
+    #Most bookings are in the past and the searches are for the future, so seeking on the end
+    #date skips the history of a car instead of walking through it
+    (1, "availability and search indexes, table versions", [
+        Index("reservations_vehicle_end", "reservations", ["vehicle_id", "end_date", "start_date"]),
+        Index("contracts_vehicle_end", "contracts", ["vehicle_id", "end_date", "start_date"]),
+        Index("vehicles_facets", "vehicles", ["engine_type_id", "color_id", "car_type_id", "price_per_day", "year"]),
+        create_versions,
+    ]),
+    (2, "one admin and one customer row per user, reservations by user", [
+        keep_first("admins", "user_id"),
+        keep_first("customers", "user_id"),
+        Index("admins_user_id", "admins", ["user_id"], unique=True),
+        Index("customers_user_id", "customers", ["user_id"], unique=True),
+        Index("reservations_user_id", "reservations", ["user_id"]),
+    ]),
+    (3, "unique contract numbers", [
+        no_duplicates("contracts", "contract_number"),
+        Index("contracts_contract_number", "contracts", ["contract_number"], unique=True),
+    ]),
+    (4, "dates in one format", [
+        normalize_dates,
+    ]),
+    (5, "integer vehicle IDs in contracts", [
+        integer_contract_vehicles,
+    ]),
+    (6, "background jobs and fleet alerts", [
+        "CREATE TABLE IF NOT EXISTS jobs (name TEXT PRIMARY KEY, interval_seconds INTEGER NOT NULL, next_run_at TEXT NOT NULL, locked_until TEXT, "
+        "last_started_at TEXT, last_finished_at TEXT, last_status TEXT, last_error TEXT, runs INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS fleet_alerts (vehicle_id INTEGER NOT NULL, kind TEXT NOT NULL, due_date DATE NOT NULL, "
+        "bookings INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (vehicle_id, kind))",
+        Index("vehicles_insurance_expiration", "vehicles", ["insurance_expiration_date"]),
+        Index("vehicles_maintenance_need", "vehicles", ["maintenance_need_date"]),
+        version_row("fleet_alerts"),
+    ]),
+    (7, "booked days and revenue rollups", [
+        "CREATE TABLE IF NOT EXISTS usage_rollups (grain TEXT NOT NULL, dimension TEXT NOT NULL, period TEXT NOT NULL, key INTEGER NOT NULL, "
+        "booked_days INTEGER NOT NULL DEFAULT 0, revenue NUMERIC NOT NULL DEFAULT 0, PRIMARY KEY (grain, dimension, period, key))",
+        live_reports,
+    ]),
+    (8, "full-text search of the reservations, contracts and customers", [
+        create_search_index,
+    ]),
+    (9, "archive tables for the finished reservations and contracts", [
+        create_archives,
+        Index("reservations_archive_user_id", "reservations_archive", ["user_id"]),
+        Index("reservations_archive_vehicle_end", "reservations_archive", ["vehicle_id", "end_date", "start_date"]),
+        Index("contracts_archive_vehicle_end", "contracts_archive", ["vehicle_id", "end_date", "start_date"]),
+        Index("contracts_archive_contract_number", "contracts_archive", ["contract_number"], unique=True),
+        index_archives,
+    ]),
+    #The workers drop their cached roles when it moves
+    (10, "change counter of the users", [
+        version_row("users"),
+    ]),
+]
+
+
+def run_step(db, step):
+    if isinstance(step, Index):
+        db.execute(step.sql())
+    elif callable(step):
+        step(db)
+    else:
+        db.execute(step)
+
+
+def applied_versions(db):
+    db.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)")
+    return {row["version"] for row in db.execute("SELECT version FROM schema_migrations")}
+
+
+def migrate(db, migrations=MIGRATIONS):
+    """
+    Apply the migrations that weren't applied yet, in order.
+
+    Safe to run while the app is serving and from several workers at once, on SQLite a
+    migration is checked again once its transaction has the write lock. Returns the
+    versions and names of the applied migrations.
+    """
+    applied = []
+    done = applied_versions(db)
+    for version, name, steps in migrations:
+        if version in done:
+            continue
+
+        if db.dialect == "postgresql":
+            #The indexes can't be built CONCURRENTLY in a transaction, so every step is on its own.
+            #The steps can all run twice, in case two workers get here at the same time
+            for step in steps:
+                if isinstance(step, Index):
+                    db.execute(step.sql(concurrently=True))
+                else:
+                    with db.transaction():
+                        run_step(db, step)
+            db.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?) ON CONFLICT (version) DO NOTHING", version, name, datetime.now())
+        else:
+            with db.transaction():
+                #Another worker may have applied it while this one waited for the write lock
+                if db.execute("SELECT 1 AS found FROM schema_migrations WHERE version = ?", version):
+                    continue
+                for step in steps:
+                    run_step(db, step)
+                db.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)", version, name, datetime.now())
+        applied.append(f"{version} {name}")
+    return applied
@@ -0,0 +1,59 @@
+#The GET pages that the ASGI mode also serves on the async database, written once for both.
+#A page is a generator that yields its steps and returns the response: a Query, or a list of
+#them, gives back their rows and a Render gives back the HTML. The Flask view runs the steps
+#on the database of the app, asgi.py awaits them without holding a thread.
+
+import inspect
+
+from flask import Response, render_template, stream_template
+
+from streaming import buffered
+
+
+class Query:
+    """A step that reads rows, with stream they are a generator over a cursor for a streamed page"""
+
+    def __init__(self, sql, *parameters, stream=False):
+        self.sql = sql
+        self.parameters = parameters
+        self.stream = stream
+
+
+class Render:
+    """A step that renders a template, with stream the page is sent while it renders when it can be"""
+
+    def __init__(self, template, stream=False, **context):
+        self.template = template
+        self.stream = stream
+        self.context = context
+
+
+def stream_page(template, **context):
+    """Send a page while it renders, so the browser gets the top before the last row is read"""
+    return Response(buffered(stream_template(template, **context)), mimetype="text/html")
+
+
+def rows(db, query):
+    if query.stream:
+        return db.iterate(query.sql, *query.parameters)
+    return db.execute(query.sql, *query.parameters)
+
+
+def run_steps(steps, db):
+    """Run the steps of a page on a synchronous database, returns the response of the page"""
+    if not inspect.isgenerator(steps):
+        #login_required answered with a redirect
+        return steps
+
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        if isinstance(step, Render):
+            result = stream_page(step.template, **step.context) if step.stream else render_template(step.template, **step.context)
+        elif isinstance(step, Query):
+            result = rows(db, step)
+        else:
+            result = [rows(db, query) for query in step]
@@ -0,0 +1,210 @@
+from flask import request, url_for
+
+#Upper limit for the page size asked in the URL
+MAX_PAGE_SIZE = 500
+
+
+class Page:
+    """One page of rows plus the cursors to move around"""
+
+    def __init__(self, rows, sort, order, filter_column, filter_value, next_cursor=None, prev_cursor=None, everything=False):
+        self.rows = rows
+        self.sort = sort
+        self.order = order
+        self.filter_column = filter_column
+        self.filter_value = filter_value
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        #All the rows on one page, rows is then a generator
+        self.everything = everything
+
+    def link(self, **changes):
+        """URL of the current view with some arguments changed, the cursors are always dropped"""
+        args = {key: value for key, value in request.args.items() if key not in ("after", "before")}
+        args.update(changes)
+        return url_for(request.endpoint, **{key: value for key, value in args.items() if value is not None})
+
+    def kept_args(self):
+        """The URL arguments that aren't part of the filter form, like history, so filtering keeps them"""
+        return {key: value for key, value in request.args.items() if key not in ("filter", "value", "sort", "order", "after", "before")}
+
+    def sort_link(self, column):
+        #Clicking the sorted column again flips the order
+        order = "desc" if self.sort == column and self.order == "asc" else "asc"
+        return self.link(sort=column, order=order)
+
+    def next_link(self):
+        return self.link(after=self.next_cursor) if self.next_cursor else None
+
+    def prev_link(self):
+        return self.link(before=self.prev_cursor) if self.prev_cursor else None
+
+
+class Computed(str):
+    """
+    The SQL expression of a column the query computes, like the days times the price per day.
+
+    SQLite gives such an expression no type affinity, so it would compare it with the text
+    of a cursor or of ?value= as a string and never match. convert turns that text into
+    the type of the column before it is bound.
+    """
+
+    def __new__(cls, expression, convert):
+        column = super().__new__(cls, expression)
+        column.convert = convert
+        return column
+
+
+def number(value):
+    """A whole number, or a float if it has a fraction like a NUMERIC price can"""
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def bound(expression, value):
+    """The value from the URL to compare with a column, raises ValueError if it can't be one of its values"""
+    convert = getattr(expression, "convert", None)
+    return convert(value) if convert else value
+
+
+def cursor(row, sort):
+    #The sort value and the ID, the ID is the last part so the value can contain anything
+    return f"{row[sort]}|{row['id']}"
+
+
+class PageQuery:
+    """
+    The keyset paginated query the current request asks for.
+
+    select is the query without WHERE and ORDER BY, columns maps every column that can be
+    sorted or filtered to its SQL expression and key is the expression of the unique ID.
+    The URL can ask for sort, order, filter, value, size and after or before a cursor.
+    conditions and their parameters are always applied, whatever the URL asks for. Run sql
+    with parameters on any database and give the rows to page().
+    """
+
+    def __init__(self, select, columns, page_size, key="id", conditions=(), parameters=(), allow_all=False):
+        args = request.args
+
+        sort = args.get("sort", "id")
+        if sort not in columns:
+            sort = "id"
+        order = "desc" if args.get("order") == "desc" else "asc"
+
+        self.everything = allow_all and args.get("size") == "all"
+        try:
+            size = min(max(int(args.get("size", page_size)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            size = page_size
+
+        conditions = list(conditions)
+        parameters = list(parameters)
+
+        #Filter on one column
+        filter_column = args.get("filter")
+        filter_value = args.get("value")
+        if filter_column in columns and filter_value:
+            try:
+                parameters.append(bound(columns[filter_column], filter_value))
+                conditions.append(f"{columns[filter_column]} = ?")
+            except ValueError:
+                #Text can't be equal to a number column, so nothing matches
+                conditions.append("1 = 0")
+        else:
+            filter_column = filter_value = None
+
+        self.sort = sort
+        self.order = order
+        self.size = size
+        self.filter_column = filter_column
+        self.filter_value = filter_value
+        self.position = None
+        self.backwards = False
+
+        if self.everything:
+            query = select
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += f" ORDER BY {key} {order.upper()}" if sort == "id" else f" ORDER BY {columns[sort]} {order.upper()}, {key} {order.upper()}"
+            self.sql = query
+            self.parameters = parameters
+            return
+
+        #Seek past the cursor instead of skipping rows with OFFSET
+        after = args.get("after")
+        before = args.get("before")
+        backwards = bool(before) and not after
+        position = after or before
+        if position:
+            value, _, row_id = position.rpartition("|")
+            try:
+                value = bound(columns[sort], value)
+            except ValueError:
+                row_id = ""
+            if row_id.isdigit():
+                forward = ">" if order == "asc" else "<"
+                backward = "<" if order == "asc" else ">"
+                operator = backward if backwards else forward
+                if sort == "id":
+                    conditions.append(f"{key} {operator} ?")
+                    parameters.append(int(row_id))
+                else:
+                    conditions.append(f"({columns[sort]}, {key}) {operator} (?, ?)")
+                    parameters.extend([value, int(row_id)])
+            else:
+                position = None
+                backwards = False
+
+        direction = order.upper()
+        if backwards:
+            direction = "DESC" if direction == "ASC" else "ASC"
+
+        query = select
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if sort == "id":
+            query += f" ORDER BY {key} {direction}"
+        else:
+            query += f" ORDER BY {columns[sort]} {direction}, {key} {direction}"
+        query += " LIMIT ?"
+        parameters.append(size + 1)
+
+        self.sql = query
+        self.parameters = parameters
+        self.position = position
+        self.backwards = backwards
+
+    def page(self, rows):
+        """The Page of the rows the query returned, with size=all they can be a generator"""
+        if self.everything:
+            return Page(rows, self.sort, self.order, self.filter_column, self.filter_value, everything=True)
+
+        #One extra row tells if there is another page in the same direction
+        more = len(rows) > self.size
+        rows = rows[:self.size]
+        if self.backwards:
+            rows.reverse()
+
+        next_cursor = prev_cursor = None
+        if rows:
+            if more or self.backwards:
+                next_cursor = cursor(rows[-1], self.sort)
+            if (more and self.backwards) or (self.position and not self.backwards):
+                prev_cursor = cursor(rows[0], self.sort)
+
+        return Page(rows, self.sort, self.order, self.filter_column, self.filter_value, next_cursor, prev_cursor)
+
+
+def paginate(db, select, columns, page_size, key="id", conditions=(), parameters=(), allow_all=False):
+    """
+    Run a keyset paginated query for the current request, the arguments are the ones of PageQuery.
+
+    With allow_all, size=all gives every row as a generator over a database cursor, for
+    pages that are streamed while they render.
+    """
+    query = PageQuery(select, columns, page_size, key, conditions, parameters, allow_all)
+    if query.everything:
+        return query.page(db.iterate(query.sql, *query.parameters))
+    return query.page(db.execute(query.sql, *query.parameters))
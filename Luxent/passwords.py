@@ -0,0 +1,53 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasher:
+    """
+    Hash and check passwords in a small pool of processes.
+
+    Hashing is slow on purpose, running it in other processes keeps the web threads
+    free to answer the rest of the requests while a burst of logins is being checked.
+    """
+
+    def __init__(self, method="scrypt:32768:8:1", workers=2, max_pending=64):
+        self.method = method
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pid = None
+
+    def executor(self):
+        #Start the pool on first use, and again in a process forked after that
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                self.pid = os.getpid()
+            return self.pool
+
+    def run(self, function, *args):
+        #Wait for a free slot so a burst can't queue up without limit
+        self.slots.acquire()
+        try:
+            return self.executor().submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check if a hash was made with another method or work factor than the current one"""
+        return pwhash.split("$", 1)[0] != self.method
+
+    def shutdown(self):
+        if self.pool is not None and self.pid == os.getpid():
+            self.pool.shutdown()
+        self.pool = None
@@ -0,0 +1,22 @@
+-- Schema of luxent.db for running the app on PostgreSQL
+-- psql "$DATABASE_URL" -f postgres.sql
+
+CREATE TABLE users (
+id SERIAL PRIMARY KEY,
+username TEXT NOT NULL UNIQUE,
+password TEXT NOT NULL);
+CREATE TABLE admins (
+id SERIAL PRIMARY KEY,
+user_id INTEGER NOT NULL REFERENCES users (id));
+CREATE TABLE customers (
+id SERIAL PRIMARY KEY,
+user_id INTEGER NOT NULL REFERENCES users (id),
+first_name TEXT NOT NULL,
+last_name TEXT NOT NULL,
+email TEXT NOT NULL);
+CREATE TABLE engine (id SERIAL PRIMARY KEY, engine_type TEXT);
+CREATE TABLE color (id SERIAL PRIMARY KEY, color_name TEXT);
+CREATE TABLE car_type (id SERIAL PRIMARY KEY, car_type TEXT);
+CREATE TABLE vehicles (id SERIAL PRIMARY KEY, make TEXT, model TEXT, engine_type_id INTEGER REFERENCES engine (id), color_id INTEGER REFERENCES color (id), car_type_id INTEGER REFERENCES car_type (id), year INTEGER, insurance_expiration_date DATE, maintenance_need_date DATE, price_per_day NUMERIC, accidents TEXT);
+CREATE TABLE reservations (id SERIAL PRIMARY KEY, user_id INTEGER REFERENCES users (id), vehicle_id INTEGER REFERENCES vehicles (id), start_date DATE, end_date DATE, phone_number TEXT, first_name TEXT, last_name TEXT, reservation_made_date TIMESTAMP);
+CREATE TABLE contracts (id SERIAL PRIMARY KEY, first_name TEXT, last_name TEXT, phone_number TEXT, vehicle_id INTEGER REFERENCES vehicles (id), start_date DATE, end_date DATE, contract_number TEXT, contract_made_date TIMESTAMP, price_per_day NUMERIC);
@@ -0,0 +1,215 @@
+#Daily and monthly rollups of the booked days and the revenue, kept up to date as the bookings change
+
+from collections import defaultdict
+from datetime import date, timedelta
+
+from archive import ARCHIVES
+
+#The rollups are kept for every vehicle, car type and engine type, and for the whole fleet with the key 0
+DIMENSIONS = {"fleet": None, "car_type": "car_type_id", "engine": "engine_type_id", "vehicle": "id"}
+#What a key is called on the dashboard
+LABELS = {"car_type": ("car_type", "car_type"), "engine": ("engine", "engine_type"), "vehicle": ("vehicles", "make || ' ' || model")}
+
+#Adds to the rollup of a period, the row is made the first time
+UPSERT = ("INSERT INTO usage_rollups (grain, dimension, period, key, booked_days, revenue) VALUES (?, ?, ?, ?, ?, ?) "
+          "ON CONFLICT (grain, dimension, period, key) DO UPDATE SET booked_days = usage_rollups.booked_days + excluded.booked_days, "
+          "revenue = usage_rollups.revenue + excluded.revenue")
+
+#Bookings read at a time by rebuild()
+CHUNK_SIZE = 10000
+
+
+def as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def add_days(totals, keys, start_date, end_date, days, revenue):
+    """Add days and revenue to every day and month of a booking [start, end), for every (dimension, key)"""
+    day = as_date(start_date)
+    end = as_date(end_date)
+    months = defaultdict(int)
+    while day < end:
+        period = day.isoformat()
+        for dimension, key in keys:
+            counts = totals[("day", dimension, period, key)]
+            counts[0] += days
+            counts[1] += revenue
+        months[period[:7]] += 1
+        day += timedelta(days=1)
+    for month, count in months.items():
+        for dimension, key in keys:
+            counts = totals[("month", dimension, month, key)]
+            counts[0] += days * count
+            counts[1] += revenue * count
+
+
+def save(db, totals):
+    #In the order of the primary key, so the rows next to each other in the index are written together
+    db.execute_many(UPSERT, [(grain, dimension, period, key, days, revenue) for (grain, dimension, period, key), (days, revenue) in sorted(totals.items())])
+
+
+def record_bookings(db, bookings, sign=1):
+    """
+    Add bookings to the rollups, or take them out with sign=-1.
+
+    bookings are (vehicle_id, start_date, end_date, price_per_day) and the price is None for
+    the reservations, they are worth the price of the vehicle like on the admin tables. Call
+    it in the transaction that inserts or deletes the bookings.
+    """
+    if not bookings:
+        return
+    ids = sorted({booking[0] for booking in bookings})
+    vehicles = {row["id"]: row for row in db.execute(f"SELECT id, car_type_id, engine_type_id, price_per_day FROM vehicles WHERE id IN ({', '.join(['?'] * len(ids))})", *ids)}
+
+    totals = defaultdict(lambda: [0, 0.0])
+    for vehicle_id, start_date, end_date, price in bookings:
+        vehicle = vehicles.get(vehicle_id)
+        if vehicle is None:
+            continue
+        price = vehicle["price_per_day"] if price is None else price
+        add_days(totals, keys_of(vehicle), start_date, end_date, sign, sign * float(price))
+    save(db, totals)
+
+
+def keys_of(vehicle):
+    return [("fleet", 0), ("car_type", vehicle["car_type_id"]), ("engine", vehicle["engine_type_id"]), ("vehicle", vehicle["id"])]
+
+
+def delete_booking(db, table, booking_id):
+    """Delete a reservation or a contract and take it out of the rollups, returns the number of rows deleted"""
+    price = "price_per_day" if table == "contracts" else "NULL"
+    with db.transaction():
+        rows = db.execute(f"SELECT vehicle_id, start_date, end_date, {price} AS price FROM {table} WHERE id = ?", booking_id)
+        deleted = db.execute(f"DELETE FROM {table} WHERE id = ?", booking_id)
+        record_bookings(db, [(row["vehicle_id"], row["start_date"], row["end_date"], row["price"]) for row in rows], sign=-1)
+    return deleted
+
+
+def delete_vehicle(db, vehicle_id):
+    """
+    Delete a vehicle with its reservations and contracts, archived or not, and take them out of the rollups.
+
+    The bookings are taken out before the vehicle is deleted, record_bookings() needs it for their keys.
+    Returns the number of vehicles deleted.
+    """
+    tables = [("reservations", "NULL"), (ARCHIVES["reservations"], "NULL"), ("contracts", "price_per_day"), (ARCHIVES["contracts"], "price_per_day")]
+    with db.transaction():
+        #No booking of the vehicle can be made meanwhile, they lock it too
+        db.lock_row("vehicles", vehicle_id)
+        bookings = []
+        for table, price in tables:
+            rows = db.execute(f"SELECT vehicle_id, start_date, end_date, {price} AS price FROM {table} WHERE vehicle_id = ?", vehicle_id)
+            bookings.extend((row["vehicle_id"], row["start_date"], row["end_date"], row["price"]) for row in rows)
+        record_bookings(db, bookings, sign=-1)
+        for table, _ in tables:
+            db.execute(f"DELETE FROM {table} WHERE vehicle_id = ?", vehicle_id)
+        return db.execute("DELETE FROM vehicles WHERE id = ?", vehicle_id)
+
+
+def reprice_vehicle(db, vehicle_id, old_price, new_price):
+    """
+    Change the revenue of the reservations of a vehicle after its price changed.
+
+    Call it in the transaction that updates the price. The booked days stay the same.
+    The archived reservations are repriced too, like on the history of the admin tables.
+    """
+    vehicle = db.execute("SELECT id, car_type_id, engine_type_id FROM vehicles WHERE id = ?", vehicle_id)
+    if not vehicle:
+        return
+    difference = float(new_price) - float(old_price)
+    totals = defaultdict(lambda: [0, 0.0])
+    for table in ["reservations", ARCHIVES["reservations"]]:
+        for row in db.execute(f"SELECT start_date, end_date FROM {table} WHERE vehicle_id = ?", vehicle_id):
+            add_days(totals, keys_of(vehicle[0]), row["start_date"], row["end_date"], 0, difference)
+    save(db, totals)
+
+
+def rebuild(db, chunk_size=CHUNK_SIZE, archived=True):
+    """
+    Compute the rollups again from all the reservations and contracts, archived or not.
+
+    The bookings are read a chunk at a time and every chunk is added with one upsert per
+    rollup it touches, so the memory doesn't grow with the tables. archived=False leaves
+    the archive tables out, for the databases that don't have them yet.
+    """
+    db.execute("DELETE FROM usage_rollups")
+    queries = []
+    reservations, contracts = ["reservations"], ["contracts"]
+    if archived:
+        reservations.append(ARCHIVES["reservations"])
+        contracts.append(ARCHIVES["contracts"])
+    for table in reservations:
+        queries.append(f"SELECT r.id, v.id AS vehicle_id, v.car_type_id, v.engine_type_id, r.start_date, r.end_date, v.price_per_day AS price FROM {table} r JOIN vehicles v ON v.id = r.vehicle_id WHERE r.id > ? ORDER BY r.id LIMIT ?")
+    for table in contracts:
+        queries.append(f"SELECT k.id, v.id AS vehicle_id, v.car_type_id, v.engine_type_id, k.start_date, k.end_date, k.price_per_day AS price FROM {table} k JOIN vehicles v ON v.id = k.vehicle_id WHERE k.id > ? ORDER BY k.id LIMIT ?")
+    for query in queries:
+        last = 0
+        while True:
+            rows = db.execute(query, last, chunk_size)
+            if not rows:
+                break
+            totals = defaultdict(lambda: [0, 0.0])
+            for row in rows:
+                keys = [("fleet", 0), ("car_type", row["car_type_id"]), ("engine", row["engine_type_id"]), ("vehicle", row["vehicle_id"])]
+                add_days(totals, keys, row["start_date"], row["end_date"], 1, float(row["price"] or 0))
+            save(db, totals)
+            last = rows[-1]["id"]
+
+
+def month_start(month):
+    """The first day of a month given as YYYY-MM"""
+    return date.fromisoformat(month + "-01")
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def usage_report(db, start_month, end_month, dimension):
+    """
+    Booked days, utilization and revenue from start_month to end_month, both YYYY-MM.
+
+    Returns the timeline of the fleet, by day for a single month and by month otherwise,
+    and the totals of every key of the dimension. Only the rollups are read.
+    """
+    first = month_start(start_month)
+    after = next_month(month_start(end_month))
+    days = (after - first).days
+
+    #How many vehicles every key has, for the utilization
+    column = DIMENSIONS[dimension]
+    if column is None:
+        sizes = {0: db.execute("SELECT COUNT(*) AS vehicles FROM vehicles")[0]["vehicles"]}
+    else:
+        sizes = {row["key"]: row["vehicles"] for row in db.execute(f"SELECT {column} AS key, COUNT(*) AS vehicles FROM vehicles GROUP BY {column}")}
+    fleet = db.execute("SELECT COUNT(*) AS vehicles FROM vehicles")[0]["vehicles"]
+
+    if start_month == end_month:
+        timeline = db.execute("SELECT period, booked_days, revenue FROM usage_rollups WHERE grain = 'day' AND dimension = 'fleet' AND key = 0 AND period >= ? AND period < ? ORDER BY period",
+                              first.isoformat(), after.isoformat())
+        for row in timeline:
+            row["utilization"] = row["booked_days"] / fleet if fleet else 0
+    else:
+        timeline = db.execute("SELECT period, booked_days, revenue FROM usage_rollups WHERE grain = 'month' AND dimension = 'fleet' AND key = 0 AND period >= ? AND period <= ? ORDER BY period",
+                              start_month, end_month)
+        for row in timeline:
+            month = month_start(row["period"])
+            row["utilization"] = row["booked_days"] / (fleet * (next_month(month) - month).days) if fleet else 0
+
+    if dimension in LABELS:
+        table, label = LABELS[dimension]
+        label = f"(SELECT {label} FROM {table} WHERE id = u.key)"
+    else:
+        label = "'Fleet'"
+    breakdown = db.execute(f"""
+        SELECT u.key, {label} AS label, SUM(u.booked_days) AS booked_days, SUM(u.revenue) AS revenue
+        FROM usage_rollups u
+        WHERE u.grain = 'month' AND u.dimension = ? AND u.period >= ? AND u.period <= ?
+        GROUP BY u.key
+        ORDER BY revenue DESC
+    """, dimension, start_month, end_month)
+    for row in breakdown:
+        vehicles = sizes.get(row["key"], 0)
+        row["utilization"] = row["booked_days"] / (vehicles * days) if vehicles else 0
+
+    return timeline, breakdown
@@ -0,0 +1,102 @@
+#Faceted search over the vehicles for the /reservations filter
+
+from availability import free_condition, booked_parameters
+
+#The facets and the foreign key they filter on, the vehicles_facets index of migrations.py covers the counts
+FACETS = {"engine": "engine_type_id", "color": "color_id", "car_type": "car_type_id"}
+
+#The cars shown to the customers
+CATALOG_QUERY = """
+    SELECT
+        v.id,
+        v.make,
+        v.model,
+        e.engine_type AS engine_type,
+        c.color_name AS color,
+        ct.car_type AS car_type,
+        v.year,
+        v.price_per_day
+    FROM vehicles v
+    JOIN engine e ON e.id = v.engine_type_id
+    JOIN color c ON c.id = v.color_id
+    JOIN car_type ct ON ct.id = v.car_type_id
+"""
+
+
+def empty_filters():
+    return {"engine": [], "color": [], "car_type": [], "min_price": None, "max_price": None,
+            "min_year": None, "max_year": None, "text": "", "start_date": None, "end_date": None}
+
+
+def base_conditions(filters):
+    """Conditions of every filter that isn't a facet"""
+    conditions = []
+    parameters = []
+
+    if filters["min_price"] is not None:
+        conditions.append("v.price_per_day >= ?")
+        parameters.append(filters["min_price"])
+    if filters["max_price"] is not None:
+        conditions.append("v.price_per_day <= ?")
+        parameters.append(filters["max_price"])
+    if filters["min_year"] is not None:
+        conditions.append("v.year >= ?")
+        parameters.append(filters["min_year"])
+    if filters["max_year"] is not None:
+        conditions.append("v.year <= ?")
+        parameters.append(filters["max_year"])
+
+    #Every word has to be in the make or the model
+    for word in filters["text"].split():
+        conditions.append("(lower(v.make) LIKE ? OR lower(v.model) LIKE ?)")
+        parameters.extend([f"%{word.lower()}%"] * 2)
+
+    #Keep only the cars that are free for the whole period
+    if filters["start_date"] and filters["end_date"]:
+        conditions.append(free_condition())
+        parameters.extend(booked_parameters(filters["start_date"], filters["end_date"]))
+
+    return conditions, parameters
+
+
+def where(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def search_queries(filters):
+    """
+    The two queries of a search, as (sql, parameters) pairs.
+
+    The first one counts the cars of every engine, color and car type combination that
+    match the filters other than the facets, the second one finds the cars themselves.
+    """
+    conditions, parameters = base_conditions(filters)
+
+    #One grouped pass gives the number of cars of every engine, color and car type combination
+    columns = ", ".join(FACETS.values())
+    groups = (f"SELECT {columns}, COUNT(*) AS matches FROM vehicles v{where(conditions)} GROUP BY {columns}", list(parameters))
+
+    #The cars themselves match every filter
+    for facet, column in FACETS.items():
+        if filters[facet]:
+            conditions.append(f"v.{column} IN ({', '.join(['?'] * len(filters[facet]))})")
+            parameters.extend(filters[facet])
+    cars = (CATALOG_QUERY + where(conditions) + " ORDER BY v.id", parameters)
+
+    return groups, cars
+
+
+def facet_counts(groups, filters):
+    """
+    Count the matches of every facet value from the grouped rows.
+
+    The count of a value is how many cars would match if it was picked, keeping the
+    picks of the other facets. Returns counts[facet][id].
+    """
+    counts = {facet: {} for facet in FACETS}
+    for group in groups:
+        for facet, column in FACETS.items():
+            others = [(other, other_column) for other, other_column in FACETS.items() if other != facet]
+            if all(not filters[other] or group[other_column] in filters[other] for other, other_column in others):
+                counts[facet][group[column]] = counts[facet].get(group[column], 0) + group["matches"]
+    return counts
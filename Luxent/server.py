@@ -0,0 +1,70 @@
+#Running the app in production: the health check and the hooks of the prefork server in gunicorn.conf.py
+
+import gc
+import json
+
+
+class HealthCheck:
+    """
+    Answer /healthz before Flask, for the load balancer and the process manager.
+
+    It doesn't open the session, load the user or go through the other hooks, it only runs
+    SELECT 1 so a worker that lost its database answers 503 instead of 200.
+    """
+
+    def __init__(self, wsgi_app, db, path="/healthz"):
+        self.wsgi_app = wsgi_app
+        self.db = db
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") != self.path:
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            self.db.execute("SELECT 1 AS ok")
+            status, body = "200 OK", {"status": "ok"}
+        except Exception as e:
+            status, body = "503 Service Unavailable", {"status": "error", "error": str(e)}
+        data = json.dumps(body).encode()
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(data))), ("Cache-Control", "no-store")])
+        return [data]
+
+
+def start_background(app):
+    """Start the background threads of this process, the jobs and the session sweeper"""
+    if app.config["JOBS_ENABLED"]:
+        app.extensions["luxent"]["scheduler"].start()
+    if hasattr(app.session_interface, "sweep"):
+        app.session_interface.sweep(app.config.get("SESSION_SWEEP_INTERVAL", 300))
+
+
+def warm(app):
+    """Compile every template and load the catalog in the master, the workers then share them copy-on-write"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    app.extensions["luxent"]["catalog"].load()
+
+
+def before_fork(app):
+    """Close what a worker can't share with the master, call it in the master before every fork"""
+    app.extensions["luxent"]["db"].close()
+    if hasattr(app.session_interface, "db"):
+        app.session_interface.db.close()
+    #What was loaded so far is left alone by the garbage collector, so it doesn't write to
+    #the shared pages and make every worker copy them
+    gc.freeze()
+
+
+def after_fork(app):
+    """Open the database connections of a new worker and start its threads"""
+    db = app.extensions["luxent"]["db"]
+    db.open()
+    db.execute("SELECT 1 AS ok")
+    start_background(app)
+
+
+def shutdown(app):
+    """Close the connections and the hashing processes of a worker that is exiting"""
+    app.extensions["luxent"]["hasher"].shutdown()
+    app.extensions["luxent"]["db"].close()
@@ -0,0 +1,96 @@
+import logging
+import os
+import secrets
+import threading
+import time
+
+from flask_session import Session
+from flask_session.base import ServerSideSession, ServerSideSessionInterface
+
+from database import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteSessionInterface(ServerSideSessionInterface):
+    """
+    Keep the sessions in one table of a small SQLite file instead of one file per session.
+
+    SQLite has no expiry of its own, so the expired rows are removed by sweep().
+    """
+
+    session_class = ServerSideSession
+    ttl = False
+
+    def __init__(self, app, path="sessions.db", **kwargs):
+        self.db = SQLiteDatabase(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expiry REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)")
+        super().__init__(app, **kwargs)
+
+    def _retrieve_session_data(self, store_id):
+        rows = self.db.execute("SELECT data FROM sessions WHERE id = ? AND expiry > ?", store_id, time.time())
+        if not rows:
+            return None
+        return self.serializer.decode(rows[0]["data"])
+
+    def _delete_session(self, store_id):
+        self.db.execute("DELETE FROM sessions WHERE id = ?", store_id)
+
+    def _upsert_session(self, session_lifetime, session, store_id):
+        expiry = time.time() + session_lifetime.total_seconds()
+        self.db.execute("INSERT INTO sessions (id, data, expiry) VALUES (?, ?, ?) ON CONFLICT (id) DO UPDATE SET data = excluded.data, expiry = excluded.expiry",
+                        store_id, self.serializer.encode(session), expiry)
+
+    def _delete_expired_sessions(self):
+        return self.db.execute("DELETE FROM sessions WHERE expiry <= ?", time.time())
+
+    def sweep(self, interval):
+        """Delete the expired sessions every interval seconds in a background thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self._delete_expired_sessions()
+                except Exception:
+                    logger.exception("Error sweeping sessions")
+
+        thread = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        thread.start()
+        return thread
+
+
+def configure_sessions(app):
+    """
+    Set up the session backend chosen by app.config["SESSION_BACKEND"].
+
+    cookie keeps the session in a signed cookie, sqlite in sessions.db, redis in the
+    server from REDIS_URL and memory in a bounded in-process cache that stands in for redis.
+    """
+    #Needed to sign the cookies, set SECRET_KEY so every worker uses the same one
+    app.secret_key = app.secret_key or os.environ.get("SECRET_KEY") or secrets.token_hex(32)
+
+    #Only write the session when a route changed it
+    app.config["SESSION_REFRESH_EACH_REQUEST"] = False
+
+    backend = app.config["SESSION_BACKEND"]
+    if backend == "cookie":
+        #Flask's own signed cookie sessions, nothing is stored on the server
+        return
+
+    if backend == "sqlite":
+        #The expired rows are swept by a thread that server.start_background() starts
+        app.session_interface = SQLiteSessionInterface(app, app.config.get("SESSION_SQLITE_PATH", "sessions.db"), permanent=app.config["SESSION_PERMANENT"])
+    elif backend == "redis":
+        #Redis expires the sessions by itself
+        import redis
+        app.config["SESSION_TYPE"] = "redis"
+        app.config["SESSION_REDIS"] = redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+        Session(app)
+    elif backend == "memory":
+        from cachelib import SimpleCache
+        app.config["SESSION_TYPE"] = "cachelib"
+        app.config["SESSION_CACHELIB"] = SimpleCache(threshold=app.config.get("SESSION_MEMORY_THRESHOLD", 10000))
+        Session(app)
+    else:
+        raise ValueError(f"Unknown session backend {backend}")
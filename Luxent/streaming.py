@@ -0,0 +1,109 @@
+#Streamed pages and responses compressed while they are sent
+
+import zlib
+
+from flask import request
+
+#The responses worth compressing, the images and the fonts already are
+COMPRESSIBLE = {"text/html", "text/plain", "text/csv", "text/css", "application/json", "application/x-ndjson", "application/javascript", "image/svg+xml"}
+
+#A response smaller than this gets bigger once compressed
+MIN_SIZE = 500
+
+#Bytes sent at a time by a streamed page, one flush per row would make tiny packets
+BUFFER_SIZE = 16 * 1024
+
+
+def buffered(chunks, size=BUFFER_SIZE):
+    """Join the small strings of a streamed template into pieces of about size characters"""
+    pieces = []
+    length = 0
+    for chunk in chunks:
+        pieces.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(pieces)
+            pieces = []
+            length = 0
+    if pieces:
+        yield "".join(pieces)
+
+
+class Compression:
+    """
+    Compress the text responses with brotli or gzip, the first one the browser accepts.
+
+    A streamed response is compressed a piece at a time and every piece is flushed, so
+    the browser gets the top of a page while the rest is still rendering and the server
+    never holds the whole body. brotli is only used if the brotli package is installed.
+    The files of /assets are already compressed and are left alone.
+    """
+
+    def __init__(self, app, level=6, brotli_quality=4, min_size=MIN_SIZE):
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        try:
+            import brotli
+            self.brotli = brotli
+        except ImportError:
+            self.brotli = None
+        app.after_request(self.compress)
+
+    def encoding(self):
+        if self.brotli and "br" in request.accept_encodings:
+            return "br"
+        if "gzip" in request.accept_encodings:
+            return "gzip"
+        return None
+
+    def compressor(self, encoding):
+        """The functions to compress a piece, flush what was compressed so far and end the stream"""
+        if encoding == "br":
+            compressor = self.brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.flush, compressor.finish
+        #31 is a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    def compress(self, response):
+        if response.mimetype not in COMPRESSIBLE or response.direct_passthrough or "Content-Encoding" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.encoding()
+        if encoding is None:
+            return response
+
+        #The compressed body is another representation, so its tag can only be weak
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        if request.method == "HEAD" or response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        if not response.is_streamed and len(response.get_data()) < self.min_size:
+            return response
+
+        process, flush, finish = self.compressor(encoding)
+        if response.is_streamed:
+            original = response.response
+            chunks = response.iter_encoded()
+
+            def generate():
+                try:
+                    for chunk in chunks:
+                        data = process(chunk) + flush()
+                        if data:
+                            yield data
+                    yield finish()
+                finally:
+                    #Ends the database cursor and the request context of the stream
+                    if hasattr(original, "close"):
+                        original.close()
+
+            response.response = generate()
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(process(response.get_data()) + finish())
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,54 @@
+#Every test gets the app on its own copy of luxent.db, run "python -m pytest" in the Luxent folder
+
+import os
+import shutil
+import sys
+
+import pytest
+
+LUXENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LUXENT)
+
+from app import create_app
+from server import shutdown
+
+#Users of luxent.db
+ADMIN = 1
+CUSTOMER = 10
+
+
+@pytest.fixture
+def app(tmp_path):
+    shutil.copy(os.path.join(LUXENT, "luxent.db"), tmp_path / "luxent.db")
+    app = create_app({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'luxent.db'}",
+        "SESSION_SQLITE_PATH": str(tmp_path / "sessions.db"),
+        "JOBS_ENABLED": False,
+        "PASSWORD_HASH_WORKERS": 1,
+        "TESTING": True,
+    })
+    yield app
+    shutdown(app)
+
+
+@pytest.fixture
+def db(app):
+    return app.extensions["luxent"]["db"]
+
+
+def logged_in(app, user_id):
+    """A test client with the session of a user, without checking a password"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client
+
+
+@pytest.fixture
+def admin(app):
+    return logged_in(app, ADMIN)
+
+
+@pytest.fixture
+def customer(app):
+    return logged_in(app, CUSTOMER)
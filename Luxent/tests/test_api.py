@@ -0,0 +1,38 @@
+def test_cursor_of_computed_sort(admin):
+    first = admin.get("/api/v1/reservations?sort=total_price&size=1").get_json()
+    assert len(first["data"]) == 1
+    second = admin.get(first["next"]).get_json()
+    assert len(second["data"]) == 1
+    assert second["data"][0]["id"] != first["data"][0]["id"]
+    assert admin.get(second["prev"]).get_json()["data"] == first["data"]
+
+
+def test_reservation_needs_an_object(customer):
+    for body in [[1, 2], "text", 5]:
+        response = customer.post("/api/v1/reservations", json=body)
+        assert response.status_code == 400
+        assert "error" in response.get_json()
+
+
+def test_etag_until_the_list_changes(admin, customer):
+    url = "/api/v1/reservations?size=500"
+    tag = admin.get(url).headers["ETag"]
+    unchanged = admin.get(url, headers={"If-None-Match": tag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b""
+
+    created = customer.post("/api/v1/reservations", json={"first_name": "Arbore", "last_name": "Mihaela", "phone_number": "1111-222-333",
+                                                           "vehicle_id": 2, "start_date": "2099-05-01", "end_date": "2099-05-10"})
+    assert created.status_code == 201
+    #The new reservation changed the counter of the table, so the old tag gets the new list
+    changed = admin.get(url, headers={"If-None-Match": tag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != tag
+    assert created.get_json()["id"] in [row["id"] for row in changed.get_json()["data"]]
+    assert admin.get(url, headers={"If-None-Match": changed.headers["ETag"]}).status_code == 304
+
+
+def test_etag_of_another_user(admin, customer):
+    #A customer only sees their own reservations, so their tag doesn't match the list of an admin
+    tag = admin.get("/api/v1/reservations").headers["ETag"]
+    assert customer.get("/api/v1/reservations", headers={"If-None-Match": tag}).status_code == 200
@@ -0,0 +1,94 @@
+#The pages asgi.py runs on the async database are the ones of the Flask app
+
+import asyncio
+import os
+import shutil
+
+import pytest
+
+from conftest import CUSTOMER, LUXENT, logged_in
+from server import shutdown
+
+pytest.importorskip("a2wsgi")
+
+from asgi import create_asgi_app
+
+PAGES = ["/", "/reservations", "/my_reservations", "/my_reservations?history=1", "/cars", "/cars?sort=year&order=desc&size=3",
+         "/about_us", "/contact", "/faq"]
+
+
+@pytest.fixture
+def asgi(tmp_path):
+    shutil.copy(os.path.join(LUXENT, "luxent.db"), tmp_path / "luxent.db")
+    asgi = create_asgi_app({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'luxent.db'}",
+        "SESSION_SQLITE_PATH": str(tmp_path / "sessions.db"),
+        "JOBS_ENABLED": False,
+        "PASSWORD_HASH_WORKERS": 1,
+        "TESTING": True,
+    })
+    yield asgi
+    asgi.wsgi.executor.shutdown()
+    shutdown(asgi.app)
+
+
+def get(asgi, paths, cookie=None):
+    """Status and body of every path through the ASGI app, with the async database open"""
+    async def request(path):
+        path, _, query = path.partition("?")
+        scope = {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+                 "query_string": query.encode(), "root_path": "", "server": ("localhost", 80), "client": ("127.0.0.1", 1234),
+                 "headers": [(b"host", b"localhost")] + ([(b"cookie", cookie.encode())] if cookie else [])}
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi(scope, receive, send)
+        return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:]).decode()
+
+    async def run():
+        db = asgi.app.extensions["luxent"]["async_db"]
+        await db.open()
+        try:
+            return [await request(path) for path in paths]
+        finally:
+            await db.close()
+
+    return asyncio.run(run())
+
+
+def test_the_steps_pages_are_served_async(asgi):
+    assert {"/", "/reservations", "/my_reservations", "/cars", "/about_us", "/contact", "/faq"} == set(asgi.handlers)
+
+
+def test_same_pages_as_flask(asgi):
+    client = logged_in(asgi.app, CUSTOMER)
+    cookie = f"session={client.get_cookie('session').value}"
+    expected = [(response.status_code, response.get_data(as_text=True)) for response in map(client.get, PAGES)]
+    assert get(asgi, PAGES, cookie) == expected
+
+
+def test_guests_are_sent_to_the_login(asgi):
+    (status, _), faq = get(asgi, ["/my_reservations", "/faq"])
+    assert status == 302
+    assert faq == (200, asgi.app.test_client().get("/faq").get_data(as_text=True))
+
+
+def test_an_error_in_the_steps_is_the_error_page(asgi, monkeypatch):
+    client = logged_in(asgi.app, CUSTOMER)
+    cookie = f"session={client.get_cookie('session').value}"
+
+    async def broken(sql, *parameters):
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(asgi.app.extensions["luxent"]["async_db"], "execute", broken)
+    #Not raised to the test like the other TESTING errors
+    asgi.app.config["PROPAGATE_EXCEPTIONS"] = False
+    (status, _), (about, _) = get(asgi, ["/my_reservations", "/about_us"], cookie)
+    assert status == 500
+    #The next request of the session still works
+    assert about == 200
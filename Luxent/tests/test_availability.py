@@ -0,0 +1,41 @@
+from availability import book_contract, book_reservation, is_booked
+from conftest import CUSTOMER
+
+#Reservation 4 of luxent.db has vehicle 8 from 2025-01-01 to 2025-02-03
+VEHICLE = 8
+
+
+def reserve(db, start_date, end_date, vehicle_id=VEHICLE):
+    return book_reservation(db, CUSTOMER, "Arbore", "Mihaela", "1111-222-333", vehicle_id, start_date, end_date, "2024-12-01 10:00:00")
+
+
+def contract(db, number, start_date, end_date, vehicle_id=VEHICLE):
+    return book_contract(db, number, "Arbore", "Gabriel", "0123-456-789", vehicle_id, start_date, end_date, "2024-12-01 10:00:00", 80)
+
+
+def test_overlapping_bookings_are_refused(db):
+    count = db.execute("SELECT COUNT(*) AS count FROM reservations")[0]["count"]
+    for start_date, end_date in [("2025-01-10", "2025-01-20"), ("2024-12-25", "2025-01-02"), ("2025-02-02", "2025-02-10"), ("2024-12-01", "2025-03-01")]:
+        assert reserve(db, start_date, end_date) is None, (start_date, end_date)
+        assert contract(db, f"C{start_date}", start_date, end_date) is None, (start_date, end_date)
+    #Nothing was inserted
+    assert db.execute("SELECT COUNT(*) AS count FROM reservations")[0]["count"] == count
+    assert db.execute("SELECT COUNT(*) AS count FROM contracts WHERE contract_number LIKE 'C20%'") == [{"count": 0}]
+
+
+def test_adjacent_bookings_are_allowed(db):
+    #The end date is the day the car comes back, so the next booking can start on it
+    before = reserve(db, "2024-12-25", "2025-01-01")
+    after = contract(db, "C-after", "2025-02-03", "2025-02-10")
+    assert before and after
+    assert db.execute("SELECT vehicle_id FROM reservations WHERE id = ?", before) == [{"vehicle_id": VEHICLE}]
+    assert db.execute("SELECT contract_number FROM contracts WHERE id = ?", after) == [{"contract_number": "C-after"}]
+
+
+def test_reservations_and_contracts_block_each_other(db):
+    assert reserve(db, "2031-05-01", "2031-05-10", vehicle_id=2)
+    assert contract(db, "C-overlap", "2031-05-09", "2031-05-12", vehicle_id=2) is None
+    assert contract(db, "C-first", "2031-06-01", "2031-06-10", vehicle_id=2)
+    assert reserve(db, "2031-06-05", "2031-06-06", vehicle_id=2) is None
+    #Another car is free in the same period
+    assert not is_booked(db, 3, "2031-05-01", "2031-06-10")
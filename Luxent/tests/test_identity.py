@@ -0,0 +1,33 @@
+from conftest import CUSTOMER
+from help import IdentityCache
+from versions import bump, current
+
+CUSTOMER_ROLES = {"is_admin": False, "is_customer": True}
+
+
+def test_change_in_another_worker_drops_the_roles(db):
+    #Two workers with their own caches on the same database
+    workers = [IdentityCache(lambda: current(db, "users"), check=0) for _ in range(2)]
+    for cache in workers:
+        assert cache.get(CUSTOMER) is None
+        cache.set(CUSTOMER, CUSTOMER_ROLES)
+        assert cache.get(CUSTOMER) == CUSTOMER_ROLES
+
+    bump(db, "users")
+    assert [cache.get(CUSTOMER) for cache in workers] == [None, None]
+
+
+def test_roles_expire(db):
+    cache = IdentityCache(lambda: current(db, "users"), ttl=0)
+    cache.set(CUSTOMER, CUSTOMER_ROLES)
+    assert cache.get(CUSTOMER) is None
+
+
+def test_promoted_customer_sees_the_admin_pages(app, db, customer):
+    app.extensions["luxent"]["identity_cache"].check = 0
+    assert customer.get("/fleet_alerts").status_code == 302
+
+    #What add_admin does in another worker
+    db.execute("INSERT INTO admins (user_id) VALUES (?)", CUSTOMER)
+    bump(db, "users")
+    assert customer.get("/fleet_alerts").status_code == 200
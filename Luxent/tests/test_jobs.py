@@ -0,0 +1,38 @@
+import logging
+
+from jobs import Scheduler
+
+
+def test_failed_job_is_logged_and_saved(db, caplog):
+    scheduler = Scheduler(db)
+
+    def broken():
+        raise RuntimeError("no fleet")
+
+    scheduler.add("broken", 60, broken)
+    with caplog.at_level(logging.ERROR, logger="jobs"):
+        scheduler.run("broken")
+
+    #The traceback goes to the log, the message to the jobs table
+    assert caplog.records[0].exc_info[0] is RuntimeError
+    job = db.execute("SELECT last_status, last_error FROM jobs WHERE name = ?", "broken")[0]
+    assert job == {"last_status": "error", "last_error": "no fleet"}
+
+
+def test_wake_during_the_run_is_kept(db):
+    scheduler = Scheduler(db)
+    runs = []
+
+    def scan():
+        runs.append(len(runs))
+        if len(runs) == 1:
+            #What vehicles_changed() does while the scan is running
+            scheduler.wake("scan")
+
+    scheduler.add("scan", 3600, scan)
+    scheduler.run_due()
+    #Due again now instead of in an hour
+    scheduler.run_due()
+    assert runs == [0, 1]
+    scheduler.run_due()
+    assert runs == [0, 1]
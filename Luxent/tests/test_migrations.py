@@ -0,0 +1,44 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import LUXENT
+from database import SQLiteDatabase
+from migrations import MIGRATIONS, migrate
+from versions import TABLES
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    #luxent.db as it is in the repository, before any migration
+    shutil.copy(os.path.join(LUXENT, "luxent.db"), tmp_path / "luxent.db")
+    db = SQLiteDatabase(str(tmp_path / "luxent.db"))
+    yield db
+    db.close()
+
+
+def counts(db):
+    return {table: db.execute(f"SELECT COUNT(*) AS count FROM {table}")[0]["count"]
+            for table in ["users", "vehicles", "reservations", "contracts"]}
+
+
+def test_migrations_on_the_baseline_database(baseline):
+    before = counts(baseline)
+    assert migrate(baseline) == [f"{version} {name}" for version, name, _ in MIGRATIONS]
+
+    assert {row["version"] for row in baseline.execute("SELECT version FROM schema_migrations")} == {version for version, _, _ in MIGRATIONS}
+    assert {row["name"] for row in baseline.execute("SELECT name FROM table_versions")} == set(TABLES)
+    indexes = {row["name"] for row in baseline.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"reservations_vehicle_end", "contracts_vehicle_end", "contracts_contract_number"} <= indexes
+    assert not {"reservations_vehicle_dates", "contracts_vehicle_dates"} & indexes
+    #The rows are all kept
+    assert counts(baseline) == before
+    assert baseline.execute("PRAGMA integrity_check") == [{"integrity_check": "ok"}]
+
+
+def test_migrations_run_once(baseline):
+    migrate(baseline, MIGRATIONS[:5])
+    #Only the ones that weren't applied yet, then nothing
+    assert migrate(baseline) == [f"{version} {name}" for version, name, _ in MIGRATIONS[5:]]
+    assert migrate(baseline) == []
@@ -0,0 +1,174 @@
+#Runs only against a real server, for example DATABASE_URL=postgresql://localhost/luxent_test python -m pytest tests/test_postgres.py
+#The user of the URL needs to create databases, every app test gets its own one made with postgres.sql
+
+import os
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from availability import book_reservation
+from conftest import LUXENT, logged_in
+from database import connect
+from migrations import MIGRATIONS, migrate
+from server import shutdown
+from test_reports import assert_same_as_rebuild
+
+URL = os.environ.get("DATABASE_URL", "")
+
+pytestmark = pytest.mark.skipif(not URL.startswith(("postgresql://", "postgres://")), reason="DATABASE_URL is not a PostgreSQL database")
+
+#Users of the app tests
+ADMIN = 1
+CUSTOMER = 2
+
+SEED = """
+INSERT INTO engine (engine_type) VALUES ('Petrol'), ('Diesel');
+INSERT INTO color (color_name) VALUES ('White'), ('Black');
+INSERT INTO car_type (car_type) VALUES ('Sedan'), ('Coupe');
+INSERT INTO vehicles (make, model, engine_type_id, color_id, car_type_id, year, insurance_expiration_date, maintenance_need_date, price_per_day, accidents) VALUES
+    ('BMW', '540i', 1, 1, 1, 2022, '2099-06-01', '2099-06-01', 100, 'No'),
+    ('BMW', '330e', 2, 2, 2, 2020, '2099-06-01', '2099-06-01', 80, 'No'),
+    ('Audi', 'A4', 1, 2, 1, 2021, '2099-06-01', '2099-06-01', 90, 'No');
+INSERT INTO users (username, password) VALUES ('admin1', %(hash)s), ('lala03', %(hash)s);
+INSERT INTO admins (user_id) VALUES (1);
+INSERT INTO customers (user_id, first_name, last_name, email) VALUES (2, 'Arbore', 'Mihaela', 'mihaela@example.com');
+INSERT INTO reservations (user_id, vehicle_id, start_date, end_date, phone_number, first_name, last_name, reservation_made_date) VALUES
+    (2, 1, '2099-01-01', '2099-01-11', '1111-222-333', 'Arbore', 'Mihaela', '2098-12-01 10:00:00'),
+    (2, 3, '2099-01-01', '2099-01-04', '1111-222-333', 'Arbore', 'Mihaela', '2098-12-01 10:00:00');
+INSERT INTO contracts (contract_number, first_name, last_name, phone_number, vehicle_id, start_date, end_date, contract_made_date, price_per_day) VALUES
+    ('50%', 'Arbore', 'Gabriel', '0123-456-789', 2, '2099-01-01', '2099-01-04', '2098-12-01 10:00:00', 70);
+"""
+
+
+@pytest.fixture
+def pg():
+    pytest.importorskip("psycopg")
+    db = connect(URL)
+    #Tables of this run only, so it can share a database
+    cars, names = f"luxent_smoke_cars_{os.getpid()}", f"luxent_smoke_names_{os.getpid()}"
+    db.execute(f"CREATE TABLE {cars} (id SERIAL PRIMARY KEY, model TEXT NOT NULL, start_date DATE, end_date DATE)")
+    db.execute(f"CREATE TABLE {names} (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    yield db, cars, names
+    db.execute(f"DROP TABLE {cars}")
+    db.execute(f"DROP TABLE {names}")
+    db.close()
+
+
+@pytest.fixture
+def pg_app(tmp_path):
+    psycopg = pytest.importorskip("psycopg")
+    from app import create_app
+
+    name = f"luxent_test_{os.getpid()}"
+    with psycopg.connect(URL, autocommit=True) as server:
+        server.execute(f"DROP DATABASE IF EXISTS {name}")
+        server.execute(f"CREATE DATABASE {name}")
+    url = f"{URL.rsplit('/', 1)[0]}/{name}"
+    #The catalog is read when the app starts, so the rows are there before it
+    with psycopg.connect(url, autocommit=True) as connection:
+        with open(os.path.join(LUXENT, "postgres.sql")) as schema:
+            connection.execute(schema.read())
+        password = generate_password_hash("password")
+        for statement in SEED.split(";")[:-1]:
+            connection.execute(statement, {"hash": password} if "%(hash)s" in statement else None)
+
+    app = create_app({
+        "DATABASE_URL": url,
+        "SESSION_SQLITE_PATH": str(tmp_path / "sessions.db"),
+        "JOBS_ENABLED": False,
+        "PASSWORD_HASH_WORKERS": 1,
+        "TESTING": True,
+    })
+    yield app
+    shutdown(app)
+    with psycopg.connect(URL, autocommit=True) as server:
+        server.execute(f"DROP DATABASE {name} WITH (FORCE)")
+
+
+def test_insert_returns_the_new_id(pg):
+    db, cars, _ = pg
+    first = db.insert(f"INSERT INTO {cars} (model) VALUES (?)", "X5")
+    second = db.insert(f"INSERT INTO {cars} (model) VALUES (?)", "Golf")
+    assert second == first + 1
+    assert db.execute(f"SELECT model FROM {cars} WHERE id = ?", second) == [{"model": "Golf"}]
+
+
+def test_execute_insert_without_id_column(pg):
+    #Like table_versions and schema_migrations, an INSERT on its own doesn't ask for an id
+    db, cars, names = pg
+    assert db.execute(f"INSERT INTO {cars} (model) VALUES (?)", "X5") == 1
+    insert = f"INSERT INTO {names} (name) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM {names} WHERE name = ?)"
+    assert db.execute(insert, "vehicles", "vehicles") == 1
+    assert db.execute(insert, "vehicles", "vehicles") == 0
+    assert db.execute(f"INSERT INTO {names} (name) VALUES (?) ON CONFLICT (name) DO NOTHING", "vehicles") == 0
+    assert db.execute(f"UPDATE {names} SET version = version + 1 WHERE name = ?", "vehicles") == 1
+
+
+def test_placeholders_percent_signs_and_days(pg):
+    db, cars, _ = pg
+    db.insert(f"INSERT INTO {cars} (model, start_date, end_date) VALUES (?, ?, ?)", "100% electric", "2099-01-01", "2099-01-11")
+    #A % in the SQL is not a placeholder of psycopg
+    rows = db.execute(f"SELECT model, {db.days_between('start_date', 'end_date')} AS days FROM {cars} WHERE model LIKE '%\\%%' ESCAPE '\\' AND model <> ?", "?")
+    assert rows == [{"model": "100% electric", "days": 10}]
+    assert list(db.iterate(f"SELECT model FROM {cars} WHERE model LIKE ?", "100%")) == [{"model": "100% electric"}]
+
+
+def test_transaction_rolls_back(pg):
+    db, cars, _ = pg
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.insert(f"INSERT INTO {cars} (model) VALUES (?)", "X5")
+            raise RuntimeError("stop")
+    assert db.execute(f"SELECT COUNT(*) AS count FROM {cars}") == [{"count": 0}]
+
+
+def test_migrations_on_postgres(pg_app):
+    db = pg_app.extensions["luxent"]["db"]
+    assert [row["version"] for row in db.execute("SELECT version FROM schema_migrations ORDER BY version")] == [version for version, _, _ in MIGRATIONS]
+    #The indexes were built CONCURRENTLY, outside of the transactions
+    indexes = {row["indexname"] for row in db.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")}
+    assert {"reservations_vehicle_end", "contracts_vehicle_end", "contracts_contract_number", "admins_user_id"} <= indexes
+    assert migrate(db) == []
+
+
+def test_bookings_on_postgres(pg_app):
+    db = pg_app.extensions["luxent"]["db"]
+    assert book_reservation(db, CUSTOMER, "Arbore", "Mihaela", "1111-222-333", 1, "2099-01-05", "2099-01-06", "2098-12-01 10:00:00") is None
+    reservation = book_reservation(db, CUSTOMER, "Arbore", "Mihaela", "1111-222-333", 1, "2099-01-11", "2099-01-12", "2098-12-01 10:00:00")
+    assert db.execute("SELECT vehicle_id FROM reservations WHERE id = ?", reservation) == [{"vehicle_id": 1}]
+
+
+def test_api_on_postgres(pg_app):
+    admin, customer = logged_in(pg_app, ADMIN), logged_in(pg_app, CUSTOMER)
+    listing = admin.get("/api/v1/reservations?sort=total_price&order=desc&fields=days,total_price")
+    assert [(row["days"], row["total_price"]) for row in listing.get_json()["data"]] == [(10, 1000), (3, 270)]
+    tag = listing.headers["ETag"]
+    assert admin.get("/api/v1/reservations?sort=total_price&order=desc&fields=days,total_price", headers={"If-None-Match": tag}).status_code == 304
+
+    created = customer.post("/api/v1/reservations", json={"first_name": "Arbore", "last_name": "Mihaela", "phone_number": "1111-222-333",
+                                                           "vehicle_id": 2, "start_date": "2099-05-01", "end_date": "2099-05-10"})
+    assert created.status_code == 201
+    assert isinstance(created.get_json()["id"], int)
+    assert admin.get("/api/v1/reservations?sort=total_price&order=desc&fields=days,total_price", headers={"If-None-Match": tag}).status_code == 200
+
+
+def test_admin_pages_on_postgres(pg_app):
+    admin = logged_in(pg_app, ADMIN)
+    for path in ["/all_reservations?sort=total_price&size=1", "/contracts?sort=days", "/cars?sort=price_per_day&order=desc", "/reports", "/search?q=Arbore", "/fleet_alerts"]:
+        assert admin.get(path).status_code == 200, path
+    #The contract number with a % in it
+    assert "50%" in admin.get("/api/v1/search?q=50").get_data(as_text=True)
+
+    response = admin.post("/add_admin", data={"username": "admin2", "password": "password", "confirm_password": "password"})
+    assert response.status_code == 302
+    db = pg_app.extensions["luxent"]["db"]
+    assert db.execute("SELECT u.username FROM admins a JOIN users u ON u.id = a.user_id ORDER BY a.id") == [{"username": "admin1"}, {"username": "admin2"}]
+
+
+def test_remove_vehicle_on_postgres(pg_app):
+    admin = logged_in(pg_app, ADMIN)
+    db = pg_app.extensions["luxent"]["db"]
+    assert_same_as_rebuild(db)
+    assert admin.post("/remove", data={"remove_car": 1}).status_code == 302
+    assert db.execute("SELECT COUNT(*) AS count FROM reservations WHERE vehicle_id = 1") == [{"count": 0}]
+    assert_same_as_rebuild(db)
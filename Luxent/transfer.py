@@ -0,0 +1,280 @@
+#Bulk import and export of the vehicles, reservations and contracts as CSV or JSON lines
+
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+
+from archive import ARCHIVES, with_history
+from availability import is_booked
+from reports import record_bookings
+
+#Columns of every table that can be imported, the exports add the ID in front
+TABLES = {
+    "vehicles": ["make", "model", "engine_type_id", "color_id", "car_type_id", "year", "insurance_expiration_date", "maintenance_need_date", "price_per_day", "accidents"],
+    "reservations": ["user_id", "first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date", "reservation_made_date"],
+    "contracts": ["contract_number", "first_name", "last_name", "phone_number", "vehicle_id", "start_date", "end_date", "contract_made_date", "price_per_day"],
+}
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+#The engine, color and car type of a vehicle can be given by ID or by name
+ID_FIELDS = {"engine": "engine_type_id", "color": "color_id", "car_type": "car_type_id"}
+NAME_FIELDS = {"engine": "engine_type", "color": "color", "car_type": "car_type"}
+
+#Rows per transaction, and rows per query of an export
+CHUNK_SIZE = 500
+#Only the first errors are reported, the rest are counted
+MAX_ERRORS = 100
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def format_of(filename):
+    """csv or jsonl from the extension of a file name"""
+    extension = filename.rsplit(".", 1)[-1].lower()
+    return "jsonl" if extension in ("jsonl", "ndjson", "json") else "csv"
+
+
+def read_rows(stream, format):
+    """Yield the line number and a dict for every row of a binary stream, without reading it all"""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def text(row, field):
+    value = row.get(field)
+    value = "" if value is None else str(value).strip()
+    if not value:
+        raise InvalidRow(f"Enter a {field.replace('_', ' ')}")
+    return value
+
+
+def number(row, field, kind=int, minimum=1):
+    try:
+        value = kind(text(row, field))
+    except ValueError:
+        raise InvalidRow(f"Enter a number for the {field.replace('_', ' ')}")
+    if value < minimum:
+        raise InvalidRow(f"The {field.replace('_', ' ')} can't be less than {minimum}")
+    return value
+
+
+def day(row, field, required=True):
+    if not required and not row.get(field):
+        return None
+    value = text(row, field)
+    try:
+        parsed = datetime.strptime(value[:10], "%Y-%m-%d")
+    except ValueError:
+        raise InvalidRow(f"Enter the {field.replace('_', ' ')} as YYYY-MM-DD")
+    #Saved the same way as the forms save them
+    return parsed.date().isoformat()
+
+
+def moment(row, field):
+    """When a booking was made, now if the file doesn't say"""
+    if not row.get(field):
+        return datetime.now()
+    value = text(row, field)
+    for format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise InvalidRow(f"Enter the {field.replace('_', ' ')} as YYYY-MM-DD HH:MM:SS")
+
+
+class Importer:
+    """
+    Check and insert the rows of one table in chunks.
+
+    The engines, colors and car types are checked against the catalog cache and can be given
+    by ID or by name. The vehicles and users the bookings point to are checked with one query
+    per chunk, and every chunk is inserted in one transaction with a single prepared INSERT.
+    Rows that don't pass are skipped and reported with their line number.
+    """
+
+    def __init__(self, db, catalog, table, chunk_size=CHUNK_SIZE):
+        if table not in TABLES:
+            raise ValueError(f"Unknown table {table}")
+        self.db = db
+        self.catalog = catalog
+        self.table = table
+        self.chunk_size = chunk_size
+        self.columns = TABLES[table]
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+        #Contract numbers taken by the earlier rows of the file
+        self.numbers = set()
+        #Lowercase names of the engines, colors and car types to their IDs
+        self.names = {table: {str(row[column]).lower(): row["id"] for row in catalog.rows(table)} for table, column in catalog.TABLES.items()}
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def dimension(self, row, table):
+        """ID of an engine, color or car type from its ID or its name"""
+        field = ID_FIELDS[table]
+        name_field = NAME_FIELDS[table]
+        value = row.get(field)
+        if not value and row.get(name_field):
+            value = self.names[table].get(str(row[name_field]).strip().lower())
+            if value is None:
+                raise InvalidRow(f"Unknown {name_field.replace('_', ' ')} {row[name_field]}")
+        value = number({field: value}, field)
+        if not self.catalog.has_id(table, value):
+            raise InvalidRow(f"Invalid {field.replace('_', ' ')}")
+        return value
+
+    def vehicle(self, row):
+        year = number(row, "year")
+        if year <= 1950:
+            raise InvalidRow("Enter a year after 1950")
+        return (text(row, "make"), text(row, "model"), self.dimension(row, "engine"), self.dimension(row, "color"),
+                self.dimension(row, "car_type"), year, day(row, "insurance_expiration_date"), day(row, "maintenance_need_date"),
+                number(row, "price_per_day", float), text(row, "accidents"))
+
+    def booking(self, row):
+        start_date = day(row, "start_date")
+        end_date = day(row, "end_date")
+        if end_date <= start_date:
+            raise InvalidRow("The end date can't be before or the same as the start")
+        made_date = moment(row, self.columns[7])
+        if self.table == "reservations":
+            return (number(row, "user_id"), text(row, "first_name"), text(row, "last_name"), text(row, "phone_number"),
+                    number(row, "vehicle_id"), start_date, end_date, made_date)
+        return (str(number(row, "contract_number")), text(row, "first_name"), text(row, "last_name"), text(row, "phone_number"),
+                number(row, "vehicle_id"), start_date, end_date, made_date, number(row, "price_per_day", float))
+
+    def existing(self, table, values, column="id"):
+        """The values of a column that are already in the table, with one query"""
+        values = sorted(set(values))
+        if not values:
+            return set()
+        rows = self.db.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({', '.join(['?'] * len(values))})", *values)
+        return {row[column] for row in rows}
+
+    def insert_chunk(self, chunk):
+        #Check every row on its own first, no queries yet
+        checked = []
+        for line, row in chunk:
+            if row is None:
+                self.reject(line, "Not a JSON object")
+                continue
+            try:
+                checked.append((line, self.vehicle(row) if self.table == "vehicles" else self.booking(row)))
+            except InvalidRow as error:
+                self.reject(line, str(error))
+
+        if self.table != "vehicles":
+            #The vehicles and users the bookings point to, one query for the whole chunk
+            vehicles = self.existing("vehicles", [values[4] for _, values in checked])
+            users = self.existing("users", [values[0] for _, values in checked]) if self.table == "reservations" else None
+            #The contract numbers are unique, in the table, its archive and the file
+            numbers = None
+            if self.table == "contracts":
+                contract_numbers = [values[0] for _, values in checked]
+                numbers = self.existing("contracts", contract_numbers, "contract_number") | self.existing(ARCHIVES["contracts"], contract_numbers, "contract_number")
+            valid = []
+            for line, values in checked:
+                if values[4] not in vehicles:
+                    self.reject(line, "Invalid vehicle id")
+                elif users is not None and values[0] not in users:
+                    self.reject(line, "Invalid user id")
+                elif numbers is not None and (values[0] in numbers or values[0] in self.numbers):
+                    self.reject(line, "Contract number already used")
+                else:
+                    if numbers is not None:
+                        self.numbers.add(values[0])
+                    valid.append((line, values))
+            checked = valid
+
+        if not checked:
+            return
+
+        sql = f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES ({', '.join(['?'] * len(self.columns))})"
+        with self.db.transaction():
+            rows = []
+            #Periods of the chunk by vehicle, they aren't in the table yet
+            periods = {}
+            for line, values in checked:
+                #A booking can't overlap the bookings already saved or the ones earlier in the file
+                if self.table != "vehicles":
+                    vehicle_id, start_date, end_date = values[4], values[5], values[6]
+                    taken = periods.setdefault(vehicle_id, [])
+                    if any(start < end_date and end > start_date for start, end in taken) or is_booked(self.db, vehicle_id, start_date, end_date, archived=True):
+                        self.reject(line, "The vehicle is already booked in that period")
+                        continue
+                    taken.append((start_date, end_date))
+                rows.append(values)
+            if rows:
+                self.db.execute_many(sql, rows)
+                if self.table != "vehicles":
+                    #The reservations are worth the price of their vehicle, the contracts have their own
+                    record_bookings(self.db, [(values[4], values[5], values[6], values[8] if self.table == "contracts" else None) for values in rows])
+        self.inserted += len(rows)
+
+    def run(self, rows):
+        """Import an iterable of (line, dict) and return the report"""
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            self.insert_chunk(chunk)
+        return self.report()
+
+    def report(self):
+        return {"table": self.table, "inserted": self.inserted, "rejected": self.rejected, "errors": sorted(self.errors, key=lambda error: error["line"])}
+
+
+def export_rows(db, table, format, chunk_size=1000, history=False):
+    """
+    Yield a table as CSV or JSON lines, a chunk of rows at a time.
+
+    The rows are read with keyset queries on the ID, so the table is never loaded whole.
+    With history the reservations and contracts come with their archived rows.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table}")
+    columns = ["id"] + TABLES[table]
+    source = f"{with_history(table)} t" if history and table in ARCHIVES else table
+
+    if format == "csv":
+        yield ",".join(columns) + "\r\n"
+
+    last = 0
+    while True:
+        rows = db.execute(f"SELECT {', '.join(columns)} FROM {source} WHERE id > ? ORDER BY id LIMIT ?", last, chunk_size)
+        if not rows:
+            break
+
+        buffer = io.StringIO()
+        if format == "csv":
+            writer = csv.writer(buffer)
+            writer.writerows([row[column] for column in columns] for row in rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(row, default=str) + "\n")
+        yield buffer.getvalue()
+
+        last = rows[-1]["id"]
@@ -0,0 +1,30 @@
+#Change counters of the tables, so cached data can tell if it is still current.
+#The table_versions table is created by migrations.py
+
+#Tables that have a counter
+TABLES = ["vehicles", "reservations", "contracts", "fleet_alerts", "users"]
+
+
+def bump(db, table):
+    """Call after every change to a table"""
+    db.execute("UPDATE table_versions SET version = version + 1 WHERE name = ?", table)
+
+
+#The counter of one table, for any database
+VERSION = "SELECT version FROM table_versions WHERE name = ?"
+
+
+def version_of(rows):
+    """The counter in the rows of VERSION"""
+    return rows[0]["version"] if rows else 0
+
+
+def current(db, table):
+    return version_of(db.execute(VERSION, table))
+
+
+def snapshot(db, tables):
+    """Counters of several tables with one query, in the order of tables"""
+    rows = db.execute(f"SELECT name, version FROM table_versions WHERE name IN ({', '.join(['?'] * len(tables))})", *tables)
+    versions = {row["name"]: row["version"] for row in rows}
+    return tuple(versions.get(table, 0) for table in tables)